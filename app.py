@@ -1,191 +1,438 @@
+import asyncio
 import logging
-import os
-import re
 
-import openai
 import streamlit as st
-import yaml
-from dotenv import load_dotenv
-
-from src.elastic_search.query_index import search
-from src.elastic_search.utils import create_elasticsearch_client
-from src.openai_query import call_openai, strip_string
-
-with open("./config.yaml") as f:
-    config_dict = yaml.safe_load(f)
-
-# load environment variables
-load_dotenv()
-
-# load values for Elasticsearch
-ELASTIC_USERNAME = os.getenv("ELASTIC_USERNAME")
-ELASTIC_PASSWORD = os.getenv("ELASTIC_PASSWORD")
-INDEX_NAME = os.getenv("ELASTIC_INDEXNAME")
-CERTS_PATH = config_dict["elasticsearch"]["certs_path"]
-HOST = config_dict["elasticsearch"]["host_path"]
-
-# load values for OpenAPI
-openai.api_type = os.getenv("OPENAI_API_TYPE")
-openai.api_base = os.getenv("OPENAI_API_BASE")
-openai.api_version = os.getenv("OPENAI_API_VERSION")
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-
-# set log level; debug, info, warning, error, critical
-logging.basicConfig(
-    format="%(asctime)s | %(levelname)s | %(module)s:%(funcName)s:%(lineno)d | %(message)s",
-    level=logging.DEBUG,
-    filename=config_dict["logpath"],
+from elasticsearch import NotFoundError
+
+from src.elastic_search.facets import load_facet_counts
+from src.elastic_search.query_index import SORT_OPTIONS
+from src.logs import configure_logging, log_payload
+from src.openai_query import (
+    MEDICAL_PROMPT,
+    astream_openai,
+    parse_specialists,
+    strip_string,
 )
-
-logging.info("Creating elasticsearch client")
-ES_CLIENT = create_elasticsearch_client(
-    host=HOST,
-    certs_path=CERTS_PATH,
-    username=ELASTIC_USERNAME,
-    password=ELASTIC_PASSWORD,
+from src.render import page_markdown
+from src.resources import (
+    get_config,
+    get_index_name,
+    get_search_backend,
+    get_search_client,
+    get_specialist_descriptions,
+    get_specialty_resolver,
+    get_triage_model,
+    start_health_check,
 )
+from src.specialist_descriptions import aget_specialist_description
+from src.tracing import span, traced, tracing_config
+from src.triage import triage
 
-MEDICAL_PROMPT = (
-    "Suggest medical specialists for a patient to see based on "
-    "their described symptoms in the format of {{specialist 1}},"
-    " {{specialist 2}}, ..., {{specialist n}}.\nPatient:"
-)
-MEDICAL_PROMPT_DESC = "Explain very very simply what the specialist does:"
+# config, clients and models are created once per process by `src.resources`,
+# not on every Streamlit rerun of this script
+config_dict = get_config()
+configure_logging()
+
+INDEX_NAME = get_index_name()
+FACET_CACHE_PATH = config_dict["facets"]["cache_path"]
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZES = config_dict["app"]["page_sizes"]
+FACET_LABELS = {
+    "specialty": "Specialty",
+    "district": "District",
+    "institution": "Qualification institution",
+    "qualification_year": "Qualification year",
+}
 
 
-def st_hit(hit):
-    """Displays the details of a hit from Elasticsearch medical database in
-    Streamlit format.
+@traced()
+def resolve_specialties(medical_specialist: str) -> list[str] | None:
+    """Resolves a suggested specialist to the register's specialty names.
 
     Args:
-        hit (dict): A dictionary containing the details of a hit.
+        medical_specialist (str): Specialist name suggested by the LLM.
 
     Returns:
-        None
+        list[str] | None: Canonical specialty names, or None if the resolver
+            is not built or nothing is similar enough, to search the text.
     """
-    st.write(
-        f"**Name:** {hit['name']}, Registration No: {hit['registration_no']}"
-    )
-    st.write(f"**Address:** {hit['address']}")
+    resolver = get_specialty_resolver()
+    if resolver is None or not medical_specialist:
+        return None
+    matches = resolver.resolve([medical_specialist])[0]
+    logger.info(f"Resolved {medical_specialist} to {matches}.")
+    return [name for name, _ in matches] or None
 
-    st.write("**Qualifications:**")
-    for qual in hit["qualifications"]:
-        st.write(f"{qual['nature']['text']} ({qual['tag']}) - {qual['year']}")
 
-    if hit["specialty_registration_no"]:
-        st.write(
-            f"**Specialty Name:** {hit['specialty_name']}, Registration No: {hit['specialty_registration_no']}"
+@st.cache_data
+def cached_facet_counts() -> dict[str, list[list]] | None:
+    """Loads the facet counts precomputed at index time, once per process."""
+    return load_facet_counts(FACET_CACHE_PATH)
+
+
+def display_facet_filters() -> dict[str, list]:
+    """Displays a multiselect per facet in the sidebar, with the global
+    document counts cached at index time.
+
+    Returns:
+        dict[str, list]: Facet name to the values selected for it.
+    """
+    facet_counts = cached_facet_counts()
+    if not facet_counts:
+        return {}
+
+    st.sidebar.write("**Filter by:**")
+    filters = {}
+    for facet, counts in facet_counts.items():
+        doc_counts = {value: count for value, count in counts}
+        filters[facet] = st.sidebar.multiselect(
+            FACET_LABELS[facet],
+            options=list(doc_counts),
+            format_func=lambda v, c=doc_counts: f"{v} ({c[v]})",
         )
-        st.write("**Specialty Qualifications:**")
-        if hit["speciality_qualification"]:
-            qual = hit["speciality_qualification"]
-            st.write(
-                f"{qual['nature']['text']}:({qual['tag']}) - {qual['year']}"
-            )
+    return filters
+
+
+def reset_register_pages(query: tuple) -> dict:
+    """Opens a new point in time for a search and resets paging state.
+
+    Any point in time left open by a previous search is closed first.
+
+    Args:
+        query (tuple): Search query, sort order, specialty and facet filters
+            the pages belong to.
 
+    Returns:
+        dict: Paging state stored in the Streamlit session.
+    """
+    state = st.session_state.get("register_pages")
+    if state:
+        get_search_backend().close_point_in_time(
+            get_search_client(), state["pit_id"]
+        )
 
-def display_doctors_register(search_query: str):
+    state = {
+        "query": query,
+        "pit_id": get_search_backend().open_point_in_time(
+            get_search_client(), INDEX_NAME
+        ),
+        "cursors": [None],  # `search_after` values for each visited page
+        "page": 0,
+        "next_cursor": None,
+    }
+    st.session_state["register_pages"] = state
+    return state
+
+
+def next_register_page():
+    """Moves the paging state to the page after the current one."""
+    state = st.session_state["register_pages"]
+    if state["page"] + 1 == len(state["cursors"]):
+        state["cursors"].append(state["next_cursor"])
+    state["page"] += 1
+
+
+def previous_register_page():
+    """Moves the paging state to the page before the current one."""
+    state = st.session_state["register_pages"]
+    state["page"] = max(state["page"] - 1, 0)
+
+
+@traced()
+def display_doctors_register(
+    search_query: str,
+    sort_by: str = "relevance",
+    specialties: list[str] | None = None,
+    filters: dict[str, list] | None = None,
+    page_size: int = PAGE_SIZES[0],
+):
     """Searches for doctors in an Elasticsearch index and displays the results
     of doctor's register and parses the result to be displayed on Streamlit.
 
-    This function checks if the Elasticsearch index exists and refreshes it
-    before performing a search query. The search results are then displayed.
+    Whether the index exists is checked once per process in the background by
+    `start_health_check`, not on every search. Results are paged through a point in
+    time with `search_after`, so every page costs the same to fetch, and each
+    page is rendered as one markdown block from the display strings built at
+    index time.
 
     Args:
         search_query (str): Search query  when searching for doctors in Elasticsearch index.
-
-    Raises:
-        AssertionError: If the Elasticsearch index does not exist.
+        sort_by (str): Key of `SORT_OPTIONS` to order results by.
+        specialties (list[str] | None): Canonical specialty names to filter
+            on exactly instead of searching the query's text.
+        filters (dict[str, list] | None): Facet name to the values selected
+            for it.
+        page_size (int): Number of doctors per page.
     """
-    # check if index exists
-    index_exists = ES_CLIENT.indices.exists(index=INDEX_NAME)
-    assert index_exists, f"{INDEX_NAME} Index does not exist!"
-    logging.info("Index exists! Proceeding with query.")
+    health = start_health_check()
+    if health.healthy is False:
+        st.error(f"Search is unavailable: {health.error}")
+        return
 
-    # Refresh the index
-    ES_CLIENT.indices.refresh(index=INDEX_NAME)
+    if search_query or any((filters or {}).values()):
+        query = (search_query, sort_by, specialties, filters, page_size)
+        state = st.session_state.get("register_pages")
+        if not state or state["query"] != query:
+            state = reset_register_pages(query)
 
-    if search_query:
         # Search query
-        logging.info(f"Searching {INDEX_NAME} index for {search_query}...")
-        res = search(ES_CLIENT, INDEX_NAME, search_query)
-        logging.info(f"{res['hits']['total']['value']} results found")
-        logging.info(res)
+        logger.info(
+            f"Searching {INDEX_NAME} index for {specialties or search_query}, "
+            f"page {state['page']}..."
+        )
+        try:
+            res = get_search_backend().search_page(
+                get_search_client(),
+                state["pit_id"],
+                search_query,
+                size=page_size,
+                search_after=state["cursors"][state["page"]],
+                sort_by=sort_by,
+                specialties=specialties,
+                filters=filters,
+            )
+        except NotFoundError:
+            # point in time expired; start again from the first page
+            logger.info("Point in time expired, reopening.")
+            state = reset_register_pages(query)
+            res = get_search_backend().search_page(
+                get_search_client(),
+                state["pit_id"],
+                search_query,
+                size=page_size,
+                sort_by=sort_by,
+                specialties=specialties,
+                filters=filters,
+            )
+        state["pit_id"] = res["pit_id"]
+
+        log_payload(logger, "Search response", res)
+        hits = res["hits"]["hits"]
+        if state["page"] == 0:
+            state["total"] = res["hits"]["total"]["value"]
+        logger.info(f"{state['total']} results found")
+        logger.debug(f"{len(hits)} hits on page {state['page']}")
 
-        for hit in res["hits"]["hits"]:
-            st_hit(hit["_source"])
-            st.write("-------------------")
+        first = state["page"] * page_size
+        st.write(
+            f"{state['total']} results found"
+            + (f", showing {first + 1}-{first + len(hits)}" if hits else "")
+        )
+        with span("render_hits", hits=len(hits)):
+            st.markdown(page_markdown([hit["_source"] for hit in hits]))
+
+        state["next_cursor"] = hits[-1]["sort"] if hits else None
+        prev_col, next_col = st.columns(2)
+        prev_col.button(
+            "Previous",
+            on_click=previous_register_page,
+            disabled=state["page"] == 0,
+        )
+        next_col.button(
+            "Next",
+            on_click=next_register_page,
+            disabled=len(hits) < page_size,
+        )
 
 
-def display_medical_issue(search_query: str):
-    """
-    Queries OpenAI's API for medical specialists related to medical problem and
-    displays the results for user to select. Then queries again for a
-    description of the specialist. Returns medical specialist chosen.
+@traced()
+def count_doctors(
+    medical_specialist: str, filters: dict[str, list] | None = None
+) -> int:
+    """Counts the doctors in the register matching a suggested specialist.
 
     Args:
-        search_query (str): The medical issue to search for.
+        medical_specialist (str): Specialist name suggested by the LLM.
+        filters (dict[str, list] | None): Facet name to the values selected
+            for it.
 
     Returns:
-        str: The selected medical specialist.
+        int: Number of matching doctors.
     """
-    # create a prompt for the user to enter their medical problem
-    prompt = MEDICAL_PROMPT + search_query
-    logging.info(f"Querying OpenAPI: {prompt}.")
-
-    # get the response from OpenAI's API
-    query_response = call_openai(prompt)
-    logging.info(f"OpenAPI response: {query_response}.")
+    res = get_search_backend().search(
+        get_search_client(),
+        INDEX_NAME,
+        medical_specialist,
+        size=0,
+        specialties=resolve_specialties(medical_specialist),
+        filters=filters,
+    )
+    return res["hits"]["total"]["value"]
+
+
+@traced()
+async def stream_medical_specialists(prompt: str) -> str:
+    """Streams the LLM's specialist suggestions into the page as they
+    arrive, and returns the full response."""
+    placeholder = st.empty()
+    query_response = ""
+    async for piece in astream_openai(prompt):
+        query_response += piece
+        placeholder.write(strip_string(query_response))
+    return strip_string(query_response)
+
+
+@traced()
+async def display_medical_issue_async(
+    search_query: str, filters: dict[str, list] | None = None
+) -> str | None:
+    """Async implementation of `display_medical_issue`.
+
+    As soon as the streamed suggestions are parsed, the descriptions of all
+    suggested specialists and their doctor counts are fetched concurrently,
+    so picking another specialist is served from the LLM cache. Descriptions
+    of known specialties come from the precomputed table without an LLM call,
+    and symptoms the local triage model is confident about skip the LLM
+    entirely.
+    """
+    # ask the local triage model first, and the LLM only if it's unsure
+    triage_model = get_triage_model()
+    medical_specialists = (
+        triage(triage_model, search_query) if triage_model else None
+    )
+    if medical_specialists:
+        logger.info(f"Triaged locally: {medical_specialists}.")
+        st.write(", ".join(medical_specialists))
+    else:
+        # create a prompt for the user to enter their medical problem
+        prompt = MEDICAL_PROMPT + search_query
+        logger.info(f"Querying OpenAPI: {prompt}.")
+
+        # stream the response from OpenAI's API
+        query_response = await stream_medical_specialists(prompt)
+        log_payload(logger, "OpenAPI response", query_response, logging.INFO)
+
+        # parse specialist names from the response
+        medical_specialists = parse_specialists(query_response)
+    if not medical_specialists:
+        st.write("No medical specialists found for your search.")
+        return None
+
+    description_tasks = {
+        specialist: asyncio.create_task(
+            aget_specialist_description(
+                specialist,
+                get_specialist_descriptions(),
+                get_specialty_resolver(),
+            )
+        )
+        for specialist in medical_specialists
+    }
+    doctor_counts = await asyncio.gather(
+        *(
+            asyncio.to_thread(count_doctors, specialist, filters)
+            for specialist in medical_specialists
+        )
+    )
+    doctor_counts = dict(zip(medical_specialists, doctor_counts))
 
-    # parse specialist names from the response
-    medical_specialists = re.findall(r"{{(.*?)}}", query_response)
     st.write(
         f"Found {len(medical_specialists)} medical specialists related to your search."
     )
     medical_specialist_option = st.selectbox(
-        "Select options:", medical_specialists
+        "Select options:",
+        medical_specialists,
+        format_func=lambda s: f"{s} ({doctor_counts[s]} doctors)",
     )
-    logging.info(f"Selected specialist: {medical_specialist_option}.")
+    logger.info(f"Selected specialist: {medical_specialist_option}.")
 
-    # get special description
-    specialist_description = call_openai(
-        MEDICAL_PROMPT_DESC + medical_specialist_option
-    )
+    # only the selected description is waited for; the others' tasks are
+    # cancelled when the run returns, but their completions still finish and
+    # are cached by the coalescer's threads
+    specialist_description = await description_tasks[medical_specialist_option]
     st.write(specialist_description)
-    logging.info(f"Specialist description: {specialist_description}.")
+    log_payload(
+        logger, "Specialist description", specialist_description, logging.INFO
+    )
     st.write("---")
     return medical_specialist_option
 
 
+def display_medical_issue(
+    search_query: str, filters: dict[str, list] | None = None
+) -> str | None:
+    """
+    Queries OpenAI's API for medical specialists related to medical problem and
+    displays the results for user to select, streaming the response as it
+    arrives. Then shows a description of the specialist, fetched concurrently
+    with the descriptions of the other suggestions. Returns medical specialist
+    chosen.
+
+    Args:
+        search_query (str): The medical issue to search for.
+        filters (dict[str, list] | None): Facet name to the values selected
+            for it, used to count matching doctors.
+
+    Returns:
+        str | None: The selected medical specialist, or None if there's no
+            query or no specialist was suggested.
+    """
+    if not search_query:
+        return None
+    return asyncio.run(display_medical_issue_async(search_query, filters))
+
+
+def display_timings(trace):
+    """Displays how long each span of a run took in a sidebar panel, eg. to
+    see how much of a slow query went to the LLM, search or rendering.
+
+    Args:
+        trace (Trace): Trace of the run.
+    """
+    with st.sidebar.expander("Timings"):
+        st.dataframe(trace.breakdown(), use_container_width=True)
+
+
 def main():
     """Displays a search bar and searches for the query in Elasticsearch index.
 
-    Raises:
-        AssertionError: If the Elasticsearch index does not exist.
+    Health checks start in the background on the first run, while the page
+    renders. Each run is traced, and its timing breakdown shown in the
+    sidebar if `tracing.debug_panel` is set.
     """
-    query_option = st.radio(
-        "Search by:", ["Doctor's Register", "Medical Issue"], index=0
-    )
-
-    if query_option == "Doctor's Register":
-        search_query = st.text_input(
-            "Enter the medical specialist you want to search:"
+    with span("app_run") as run_span:
+        start_health_check()
+        query_option = st.radio(
+            "Search by:", ["Doctor's Register", "Medical Issue"], index=0
         )
-        logging.info(f"{query_option} Query: {search_query}.")
-        display_doctors_register(search_query)
+        sort_by = st.selectbox("Sort by:", list(SORT_OPTIONS))
+        page_size = st.selectbox("Results per page:", PAGE_SIZES)
+        filters = display_facet_filters()
 
-    if query_option == "Medical Issue":
-        search_query = st.text_input("Enter your medical issue:")
-        logging.info(f"{query_option} Query: {search_query}.")
-        medical_specialist_option = display_medical_issue(search_query)
-        display_doctors_register(medical_specialist_option)
+        if query_option == "Doctor's Register":
+            search_query = st.text_input(
+                "Enter the medical specialist you want to search:"
+            )
+            logger.info(f"{query_option} Query: {search_query}.")
+            display_doctors_register(
+                search_query, sort_by, filters=filters, page_size=page_size
+            )
 
-    st.write(
-        "Disclaimer: This is a prototype and not a medical too. Please consult a"
-        "doctor for any medical advice and/or the emergency room for any medical"
-        "emergencies."
-    )
+        if query_option == "Medical Issue":
+            search_query = st.text_input("Enter your medical issue:")
+            logger.info(f"{query_option} Query: {search_query}.")
+            medical_specialist_option = display_medical_issue(
+                search_query, filters
+            )
+            specialties = resolve_specialties(medical_specialist_option)
+            display_doctors_register(
+                medical_specialist_option,
+                sort_by,
+                specialties,
+                filters,
+                page_size,
+            )
+
+        st.write(
+            "Disclaimer: This is a prototype and not a medical too. Please consult a"
+            "doctor for any medical advice and/or the emergency room for any medical"
+            "emergencies."
+        )
+
+    if run_span is not None and tracing_config()["debug_panel"]:
+        display_timings(run_span.trace)
 
 
 if __name__ == "__main__":
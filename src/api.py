@@ -0,0 +1,339 @@
+import argparse
+import asyncio
+import contextvars
+import functools
+import logging
+import multiprocessing
+import os
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from .elastic_search.facets import FACET_FIELDS
+from .logs import configure_logging, log_payload
+from .openai_query import (
+    MEDICAL_PROMPT,
+    acall_openai,
+    parse_specialists,
+    use_llm_cache,
+)
+from .resources import (
+    get_config,
+    get_index_name,
+    get_openai,
+    get_search_backend,
+    get_search_client,
+    get_specialty_resolver,
+    get_triage_model,
+    start_health_check,
+)
+from .tracing import span
+from .triage import triage
+
+config_dict = get_config()
+
+API_CONFIG = config_dict["api"]
+
+logger = logging.getLogger(__name__)
+
+
+def error_response(status: int, message: str, **headers) -> web.Response:
+    """Returns a json error body with the given status."""
+    return web.json_response(
+        {"error": message}, status=status, headers=headers
+    )
+
+
+@web.middleware
+async def back_pressure(request: web.Request, handler) -> web.StreamResponse:
+    """Bounds the work a worker takes on.
+
+    At most `max_concurrency` requests are handled at once; up to
+    `max_pending` more wait for a slot, and any beyond that are rejected
+    with 503 straight away rather than queueing until they time out.
+    Requests taking longer than `request_timeout_s` get a 504.
+    """
+    load = request.app["load"]
+    if (
+        load["in_flight"]
+        >= API_CONFIG["max_concurrency"] + API_CONFIG["max_pending"]
+    ):
+        load["rejected"] += 1
+        return error_response(503, "Server busy", **{"Retry-After": "1"})
+
+    load["in_flight"] += 1
+    try:
+        async with request.app["slots"]:
+            with span(f"{request.method} {request.path}"):
+                return await asyncio.wait_for(
+                    handler(request), API_CONFIG["request_timeout_s"]
+                )
+    except asyncio.TimeoutError:
+        logger.warning(f"Timed out handling {request.path_qs}")
+        return error_response(504, "Request timed out")
+    finally:
+        load["in_flight"] -= 1
+
+
+async def run_blocking(request: web.Request, f, *args, **kwargs):
+    """Runs a blocking call, eg. a search, on the worker's thread pool, in
+    the request's span."""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        request.app["executor"],
+        functools.partial(context.run, f, *args, **kwargs),
+    )
+
+
+def resolve_specialties(medical_specialist: str) -> list[str] | None:
+    """Resolves a suggested specialist to the register's specialty names;
+    None if the resolver isn't built or nothing is similar enough."""
+    resolver = get_specialty_resolver()
+    if resolver is None:
+        return None
+    matches = resolver.resolve([medical_specialist])[0]
+    return [name for name, _ in matches] or None
+
+
+async def search(request: web.Request) -> web.Response:
+    """`GET /search?q=...`: searches the doctors register.
+
+    Query parameters:
+        q: Text to search for.
+        size: Number of hits, at most `max_page_size`.
+        resolve: If "true", `q` is a specialist name (eg. from `/triage`)
+            resolved to the register's specialties and filtered on exactly.
+        specialty, district, institution, qualification_year: Facet values
+            to filter on; repeat a parameter to allow several values.
+    """
+    query_string = request.query.get("q", "")
+    try:
+        size = int(request.query.get("size", 10))
+    except ValueError:
+        return error_response(400, "size must be an integer")
+    if not 0 <= size <= API_CONFIG["max_page_size"]:
+        return error_response(
+            400, f"size must be between 0 and {API_CONFIG['max_page_size']}"
+        )
+
+    filters = {
+        facet: request.query.getall(facet)
+        for facet in FACET_FIELDS
+        if facet in request.query
+    }
+    specialties = None
+    if request.query.get("resolve") == "true" and query_string:
+        specialties = resolve_specialties(query_string)
+
+    res = await run_blocking(
+        request,
+        get_search_backend().search,
+        get_search_client(),
+        get_index_name(),
+        query_string,
+        size=size,
+        specialties=specialties,
+        filters=filters,
+    )
+    return web.json_response(
+        {
+            "total": res["hits"]["total"]["value"],
+            "specialties": specialties,
+            "hits": [hit["_source"] for hit in res["hits"]["hits"]],
+        }
+    )
+
+
+async def triage_symptoms(request: web.Request) -> web.Response:
+    """`POST /triage` with `{"symptoms": "..."}`: suggests specialists.
+
+    The local triage model answers if it is confident enough; otherwise the
+    LLM is asked with `MEDICAL_PROMPT`, through the completion cache and
+    coalescer. Each suggestion comes with the register specialties it
+    resolves to, for use with `/search`.
+    """
+    try:
+        body = await request.json()
+        symptoms = body["symptoms"].strip()
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return error_response(400, 'Expected json {"symptoms": "..."}')
+    if not symptoms:
+        return error_response(400, "symptoms must not be empty")
+
+    triage_model = get_triage_model()
+    specialists = triage(triage_model, symptoms) if triage_model else None
+    source = "model"
+    if not specialists:
+        completion = await acall_openai(MEDICAL_PROMPT + symptoms)
+        log_payload(logger, "Triage completion", completion)
+        specialists = parse_specialists(completion)
+        source = "llm"
+
+    return web.json_response(
+        {
+            "source": source,
+            "specialists": [
+                {"name": name, "specialties": resolve_specialties(name)}
+                for name in specialists
+            ],
+        }
+    )
+
+
+async def doctor(request: web.Request) -> web.Response:
+    """`GET /doctor/{registration_no}`: a doctor's register entry."""
+    registration_no = request.match_info["registration_no"]
+    doc = await run_blocking(
+        request,
+        get_search_backend().get_doctor,
+        get_search_client(),
+        get_index_name(),
+        registration_no,
+    )
+    if doc is None:
+        return error_response(
+            404, f"No doctor registered as {registration_no}"
+        )
+    return web.json_response(doc)
+
+
+async def health(request: web.Request) -> web.Response:
+    """`GET /health`: 200 once the startup checks pass, 503 until then or
+    if they failed, plus the worker's load."""
+    check = start_health_check()
+    status = {
+        "healthy": check.healthy,
+        "error": str(check.error) if check.error else None,
+        **request.app["load"],
+    }
+    return web.json_response(status, status=200 if check.healthy else 503)
+
+
+async def on_startup(app: web.Application):
+    """Starts loading resources in the background when a worker starts."""
+    start_health_check()
+
+
+async def on_cleanup(app: web.Application):
+    """Stops the worker's thread pool."""
+    app["executor"].shutdown(wait=False)
+
+
+def create_app() -> web.Application:
+    """Creates the API application of one worker process."""
+    app = web.Application(middlewares=[back_pressure])
+    app["load"] = {"in_flight": 0, "rejected": 0}
+    app["slots"] = asyncio.Semaphore(API_CONFIG["max_concurrency"])
+    app["executor"] = ThreadPoolExecutor(
+        max_workers=API_CONFIG["search_threads"], thread_name_prefix="search"
+    )
+    app.add_routes(
+        [
+            web.get("/search", search),
+            web.post("/triage", triage_symptoms),
+            web.get("/doctor/{registration_no}", doctor),
+            web.get("/health", health),
+        ]
+    )
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def apply_overrides(
+    backend: str | None = None,
+    index_path: str | None = None,
+    openai_api_base: str | None = None,
+    worker: int = 0,
+):
+    """Overrides the search backend, local index path and completion API
+    set in the config and environment, eg. to serve from local stand-ins.
+
+    Completions from another API are cached in a throwaway cache per
+    worker next to `benchmark.cache_path`, rather than the app's.
+    """
+    if backend:
+        config_dict["search"]["backend"] = backend
+    if index_path:
+        config_dict["local_search"]["index_path"] = index_path
+    if openai_api_base:
+        openai = get_openai()
+        openai.api_type = "open_ai"
+        openai.api_base = f"{openai_api_base}/v1"
+        openai.api_version = None
+        openai.api_key = "stub"
+        root, ext = os.path.splitext(config_dict["benchmark"]["cache_path"])
+        use_llm_cache(f"{root}_api_{worker}{ext}")
+
+
+def run_worker(host: str, port: int, overrides: dict, worker: int):
+    """Serves the API in this process; workers share the port."""
+    configure_logging()
+    apply_overrides(**overrides, worker=worker)
+    web.run_app(
+        create_app(), host=host, port=port, reuse_port=True, print=None
+    )
+
+
+def serve(host: str, port: int, workers: int, overrides: dict):
+    """Serves the API from `workers` processes sharing one port, so requests
+    are balanced by the kernel. Returns once all workers have exited.
+
+    Workers are spawned rather than forked so none inherits another's
+    SQLite connection or threads.
+    """
+    logger.info(f"Serving api on http://{host}:{port} with {workers} workers")
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=run_worker, args=(host, port, overrides, worker)
+        )
+        for worker in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    def stop(signum, frame):
+        """Stops the workers with the server, eg. on `kill`."""
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(
+        description="Serve search and triage as an HTTP API."
+    )
+    parser.add_argument("--host", default=API_CONFIG["host"])
+    parser.add_argument("--port", type=int, default=API_CONFIG["port"])
+    parser.add_argument("--workers", type=int, default=API_CONFIG["workers"])
+    parser.add_argument(
+        "--backend",
+        choices=["elasticsearch", "local"],
+        help="overrides search.backend",
+    )
+    parser.add_argument(
+        "--index-path", help="overrides local_search.index_path"
+    )
+    parser.add_argument(
+        "--openai-api-base",
+        help="OpenAI compatible completion API to use instead of Azure, "
+        "eg. the stub at http://127.0.0.1:8765",
+    )
+    args = parser.parse_args()
+
+    overrides = {
+        "backend": args.backend,
+        "index_path": args.index_path,
+        "openai_api_base": args.openai_api_base,
+    }
+    serve(args.host, args.port, args.workers, overrides)
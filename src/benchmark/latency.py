@@ -0,0 +1,327 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+
+import numpy as np
+import yaml
+from dotenv import load_dotenv
+
+from src import openai_query
+from src.benchmark.openai_stub import OpenAIStub, start_stub_server
+from src.elastic_search.enrich import DISTRICT_AREAS, INSTITUTION_TAGS
+from src.local_search import local_index
+from src.logs import configure_logging
+from src.openai_query import MEDICAL_PROMPT, astream_openai, parse_specialists
+from src.render import page_markdown
+from src.resources import get_openai
+from src.specialist_descriptions import (
+    aget_specialist_description,
+    load_description_table,
+)
+from src.specialty_resolver import RESOLVER_PATH, load_specialty_resolver
+
+with open("./config.yaml") as f:
+    config_dict = yaml.safe_load(f)
+
+BENCHMARK_CONFIG = config_dict["benchmark"]
+STUB_CONFIG = BENCHMARK_CONFIG["stub"]
+PAGE_SIZE = 10
+PERCENTILES = [50, 95, 99]
+
+logger = logging.getLogger(__name__)
+
+SYNTHETIC_SPECIALTIES = [
+    "Cardiology",
+    "Dermatology and Venereology",
+    "Family Medicine",
+    "Gastroenterology and Hepatology",
+    "Neurology",
+    "Ophthalmology",
+    "Orthopaedics and Traumatology",
+    "Otorhinolaryngology",
+    "Psychiatry",
+    "Respiratory Medicine",
+]
+
+
+def synthetic_documents(num_docs: int, seed: int = 0) -> list[dict]:
+    """Generates doctor documents shaped like the detail scraper's output,
+    for benchmarking without the scraped register."""
+    rng = random.Random(seed)
+    areas = [area for names in DISTRICT_AREAS.values() for area in names]
+    tags = list(INSTITUTION_TAGS)
+    docs = []
+    for i in range(num_docs):
+        year = rng.randint(1970, 2022)
+        specialty = rng.choice(SYNTHETIC_SPECIALTIES + [None] * 5)
+        docs.append(
+            {
+                "registration_no": f"M{i:05d}",
+                "name": f"DOCTOR {i} 醫生",
+                "address": f"{rng.randint(1, 300)} Main Road, "
+                f"{rng.choice(areas)}, Hong Kong",
+                "qualifications": [
+                    {
+                        "nature": {"text": "MB BS"},
+                        "tag": rng.choice(tags),
+                        "year": year,
+                    }
+                ],
+                "specialty_registration_no": f"S{i:05d}"
+                if specialty
+                else None,
+                "specialty_name": specialty,
+                "speciality_qualification": {
+                    "nature": {"text": "FHKAM"},
+                    "tag": "HK",
+                    "year": year + rng.randint(5, 12),
+                }
+                if specialty
+                else None,
+            }
+        )
+    return docs
+
+
+def create_search_client(backend: str, synthetic_docs: int):
+    """Returns the search backend module and its client.
+
+    The local backend loads the saved local index, or builds one in memory
+    from `synthetic_docs` generated documents if there isn't one (or
+    `synthetic_docs` is set), so no network is needed.
+    """
+    if backend == "elasticsearch":
+        from src.elastic_search import query_index
+        from src.elastic_search.utils import create_elasticsearch_client
+
+        load_dotenv()
+        return query_index, create_elasticsearch_client(
+            host=config_dict["elasticsearch"]["host_path"],
+            certs_path=config_dict["elasticsearch"]["certs_path"],
+            username=os.getenv("ELASTIC_USERNAME"),
+            password=os.getenv("ELASTIC_PASSWORD"),
+        )
+
+    if not synthetic_docs and os.path.exists(local_index.INDEX_PATH):
+        return local_index, local_index.load_local_index()
+    logger.info(f"Building local index of {synthetic_docs} synthetic docs")
+    return local_index, local_index.build_local_index(
+        synthetic_documents(synthetic_docs or 10000)
+    )
+
+
+class StageTimer:
+    """Collects the durations of each stage of the query path, in ms."""
+
+    def __init__(self):
+        self.durations = {}
+
+    def record(self, stage: str, started: float) -> float:
+        """Records the time since `started` for a stage and returns now."""
+        now = time.perf_counter()
+        self.durations.setdefault(stage, []).append((now - started) * 1000)
+        return now
+
+    def report(self) -> dict[str, dict[str, float]]:
+        """Returns the count and percentiles of every stage."""
+        report = {}
+        for stage, durations in self.durations.items():
+            values = np.percentile(durations, PERCENTILES)
+            report[stage] = {
+                "count": len(durations),
+                **{f"p{p}": float(v) for p, v in zip(PERCENTILES, values)},
+            }
+        return report
+
+
+async def run_query(
+    symptoms: str,
+    timer: StageTimer,
+    search_backend,
+    search_client,
+    index_name: str,
+    descriptions: dict[str, str],
+    resolver,
+):
+    """Runs one query through the app's path: suggest specialists, parse
+    them, resolve the first to register specialties, describe it, search the
+    register and format the first page for display."""
+    started = time.perf_counter()
+
+    response, stage_started = "", started
+    async for piece in astream_openai(MEDICAL_PROMPT + symptoms):
+        if not response:
+            timer.record("llm_first_token", stage_started)
+        response += piece
+    stage_started = timer.record("llm", stage_started)
+
+    specialists = parse_specialists(response)
+    stage_started = timer.record("parse", stage_started)
+    if not specialists:
+        logger.warning(f"No specialists parsed from {response}")
+        return
+    specialist = specialists[0]
+
+    matches = resolver.resolve([specialist])[0] if resolver else []
+    specialties = [name for name, _ in matches] or None
+    stage_started = timer.record("resolve", stage_started)
+
+    await aget_specialist_description(specialist, descriptions, resolver)
+    stage_started = timer.record("describe", stage_started)
+
+    def search_first_page():
+        """Searches the first page like `display_doctors_register`."""
+        pit_id = search_backend.open_point_in_time(search_client, index_name)
+        try:
+            return search_backend.search_page(
+                search_client,
+                pit_id,
+                specialist,
+                size=PAGE_SIZE,
+                specialties=specialties,
+            )
+        finally:
+            search_backend.close_point_in_time(search_client, pit_id)
+
+    res = await asyncio.to_thread(search_first_page)
+    stage_started = timer.record("search", stage_started)
+
+    page_markdown([hit["_source"] for hit in res["hits"]["hits"]])
+    timer.record("render", stage_started)
+    timer.record("total", started)
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    """Drives `args.requests` queries at `args.concurrency` through the query
+    path against the OpenAI stub and returns the per stage report."""
+    # keep the app's completion cache (and triage training data) clean
+    openai_query.use_llm_cache(BENCHMARK_CONFIG["cache_path"])
+
+    runner = None
+    if args.api_base is None:
+        stub = OpenAIStub(
+            args.latency_ms, args.jitter_ms, args.tokens_per_second, seed=0
+        )
+        runner = await start_stub_server(
+            stub, STUB_CONFIG["host"], STUB_CONFIG["port"]
+        )
+        args.api_base = f"http://{STUB_CONFIG['host']}:{STUB_CONFIG['port']}"
+    openai = get_openai()
+    openai.api_type = "open_ai"
+    openai.api_base = f"{args.api_base}/v1"
+    openai.api_version = None
+    openai.api_key = "stub"
+
+    search_backend, search_client = create_search_client(
+        args.backend, args.synthetic_docs
+    )
+    index_name = os.getenv("ELASTIC_INDEXNAME")
+    descriptions = load_description_table()
+    resolver = (
+        load_specialty_resolver() if os.path.exists(RESOLVER_PATH) else None
+    )
+
+    queries = BENCHMARK_CONFIG["queries"]
+    timer = StageTimer()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(i: int):
+        """Runs the i-th query once a concurrency slot is free."""
+        symptoms = queries[i % len(queries)]
+        if args.unique:
+            symptoms += f" (request {i})"
+        async with semaphore:
+            await run_query(
+                symptoms,
+                timer,
+                search_backend,
+                search_client,
+                index_name,
+                descriptions,
+                resolver,
+            )
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(limited(i) for i in range(args.requests)))
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "wall_seconds": time.perf_counter() - started,
+        "stages": timer.report(),
+        "llm_cache": openai_query.LLM_CACHE.stats(),
+        "coalescer": openai_query.COALESCER.stats(),
+    }
+
+
+def format_report(report: dict) -> str:
+    """Formats a benchmark report as a table of stage percentiles."""
+    lines = [
+        f"{report['requests']} requests at concurrency "
+        f"{report['concurrency']} in {report['wall_seconds']:.2f}s, "
+        f"LLM cache hit rate {report['llm_cache']['hit_rate']:.0%}",
+        f"{'stage':<16}{'count':>7}"
+        + "".join(f"{f'p{p} ms':>11}" for p in PERCENTILES),
+    ]
+    for stage, stats in report["stages"].items():
+        lines.append(
+            f"{stage:<16}{stats['count']:>7}"
+            + "".join(f"{stats[f'p{p}']:>11.2f}" for p in PERCENTILES)
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(
+        description="Benchmark the query path against a local OpenAI stub."
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--backend", choices=["local", "elasticsearch"], default="local"
+    )
+    parser.add_argument(
+        "--synthetic-docs",
+        type=int,
+        default=0,
+        help="search this many generated documents instead of the saved "
+        "local index",
+    )
+    parser.add_argument(
+        "--unique",
+        action="store_true",
+        help="make every query distinct so no completion is cached",
+    )
+    parser.add_argument(
+        "--api-base",
+        help="completion API to use instead of starting the stub, "
+        "eg. http://localhost:8765",
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=STUB_CONFIG["latency_ms"]
+    )
+    parser.add_argument(
+        "--jitter-ms", type=float, default=STUB_CONFIG["jitter_ms"]
+    )
+    parser.add_argument(
+        "--tokens-per-second",
+        type=float,
+        default=STUB_CONFIG["tokens_per_second"],
+    )
+    parser.add_argument("--output", help="also write the report as json")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmark(args))
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,269 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import subprocess
+import sys
+import time
+
+import aiohttp
+import numpy as np
+import yaml
+
+from src.benchmark.latency import (
+    PERCENTILES,
+    SYNTHETIC_SPECIALTIES,
+    synthetic_documents,
+)
+from src.elastic_search.enrich import DISTRICT_AREAS
+from src.local_search.local_index import build_local_index, save_local_index
+from src.logs import configure_logging, log_payload
+
+with open("./config.yaml") as f:
+    config_dict = yaml.safe_load(f)
+
+BENCHMARK_CONFIG = config_dict["benchmark"]
+LOAD_CONFIG = BENCHMARK_CONFIG["load_test"]
+STUB_CONFIG = BENCHMARK_CONFIG["stub"]
+
+logger = logging.getLogger(__name__)
+
+
+def start_stand_ins(args: argparse.Namespace) -> list[subprocess.Popen]:
+    """Starts the OpenAI stub and the API, serving a synthetic local index,
+    as subprocesses so they don't share a CPU with the load generator."""
+    logger.info(f"Building local index of {args.synthetic_docs} docs")
+    save_local_index(
+        build_local_index(synthetic_documents(args.synthetic_docs)),
+        LOAD_CONFIG["index_path"],
+    )
+    stub_url = f"http://{STUB_CONFIG['host']}:{STUB_CONFIG['port']}"
+    return [
+        subprocess.Popen([sys.executable, "-m", "src.benchmark.openai_stub"]),
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "src.api",
+                "--host",
+                "127.0.0.1",
+                "--port",
+                str(LOAD_CONFIG["port"]),
+                "--workers",
+                str(args.workers),
+                "--backend",
+                "local",
+                "--index-path",
+                LOAD_CONFIG["index_path"],
+                "--openai-api-base",
+                stub_url,
+            ]
+        ),
+    ]
+
+
+async def wait_until_healthy(
+    session: aiohttp.ClientSession, url: str, timeout_s: float = 60
+):
+    """Polls `/health` until the API is up and its checks pass."""
+    deadline = time.monotonic() + timeout_s
+    while True:
+        try:
+            async with session.get(f"{url}/health") as res:
+                if res.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{url} is not healthy after {timeout_s}s!")
+        await asyncio.sleep(0.5)
+
+
+class RequestMix:
+    """Draws requests in the proportions of `load_test.mix`."""
+
+    def __init__(self, registration_nos: list[str], seed: int = 0):
+        self.registration_nos = registration_nos
+        self.rng = random.Random(seed)
+        self.endpoints = list(LOAD_CONFIG["mix"])
+        self.weights = list(LOAD_CONFIG["mix"].values())
+        self.search_terms = SYNTHETIC_SPECIALTIES + [
+            area for areas in DISTRICT_AREAS.values() for area in areas
+        ]
+
+    def next(self) -> tuple[str, str, str, dict | None]:
+        """Returns the endpoint, method, path and json body of a request."""
+        endpoint = self.rng.choices(self.endpoints, self.weights)[0]
+        if endpoint == "search":
+            query = self.rng.choice(self.search_terms)
+            return endpoint, "GET", f"/search?q={query}", None
+        if endpoint == "doctor":
+            registration_no = self.rng.choice(self.registration_nos)
+            return endpoint, "GET", f"/doctor/{registration_no}", None
+        symptoms = self.rng.choice(BENCHMARK_CONFIG["queries"])
+        return endpoint, "POST", "/triage", {"symptoms": symptoms}
+
+
+async def run_level(
+    session: aiohttp.ClientSession,
+    url: str,
+    mix: RequestMix,
+    concurrency: int,
+    duration_s: float,
+) -> dict:
+    """Sends requests from `concurrency` closed-loop clients for
+    `duration_s` and summarises throughput, errors and latency."""
+    latencies = {}  # endpoint -> ms of successful requests
+    statuses = {}
+    deadline = time.perf_counter() + duration_s
+
+    async def client():
+        """Sends the next request as soon as the last one returns."""
+        while time.perf_counter() < deadline:
+            endpoint, method, path, body = mix.next()
+            started = time.perf_counter()
+            try:
+                async with session.request(
+                    method, f"{url}{path}", json=body
+                ) as res:
+                    await res.read()
+                    status = res.status
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                status = "error"
+            statuses[status] = statuses.get(status, 0) + 1
+            if status in (200, 404):
+                latencies.setdefault(endpoint, []).append(
+                    (time.perf_counter() - started) * 1000
+                )
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ok = sum(len(v) for v in latencies.values())
+    total = sum(statuses.values())
+    all_latencies = [ms for v in latencies.values() for ms in v]
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "rps": ok / elapsed,
+        "error_rate": (total - ok) / total if total else 0.0,
+        "statuses": {str(k): v for k, v in statuses.items()},
+        "latency_ms": {
+            endpoint: percentiles(values)
+            for endpoint, values in {"all": all_latencies, **latencies}.items()
+        },
+    }
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    """Returns the `PERCENTILES` of latencies, or zeros if there are none."""
+    if not values:
+        return {f"p{p}": 0.0 for p in PERCENTILES}
+    return {
+        f"p{p}": float(v)
+        for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))
+    }
+
+
+def sustainable_rps(levels: list[dict]) -> float:
+    """Highest throughput of a level within the error rate and p99 SLO."""
+    return max(
+        (
+            level["rps"]
+            for level in levels
+            if level["error_rate"] <= LOAD_CONFIG["max_error_rate"]
+            and level["latency_ms"]["all"]["p99"] <= LOAD_CONFIG["slo_p99_ms"]
+        ),
+        default=0.0,
+    )
+
+
+async def run_load_test(args: argparse.Namespace) -> dict:
+    """Steps through the concurrency levels against the API and reports the
+    sustainable requests/sec."""
+    url = args.url or f"http://127.0.0.1:{LOAD_CONFIG['port']}"
+    processes = [] if args.url else start_stand_ins(args)
+    timeout = aiohttp.ClientTimeout(total=LOAD_CONFIG["client_timeout_s"])
+    connector = aiohttp.TCPConnector(limit=max(args.concurrency))
+    try:
+        async with aiohttp.ClientSession(
+            timeout=timeout, connector=connector
+        ) as session:
+            await wait_until_healthy(session, url)
+            async with session.get(f"{url}/search?size=100") as res:
+                hits = (await res.json())["hits"]
+            mix = RequestMix([hit["registration_no"] for hit in hits])
+
+            levels = []
+            for concurrency in args.concurrency:
+                level = await run_level(
+                    session, url, mix, concurrency, args.duration_s
+                )
+                log_payload(logger, "Load test level", level, logging.INFO)
+                levels.append(level)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    return {
+        "url": url,
+        "duration_s": args.duration_s,
+        "levels": levels,
+        "sustainable_rps": sustainable_rps(levels),
+    }
+
+
+def format_report(report: dict) -> str:
+    """Formats a load test report as a table per concurrency level."""
+    lines = [
+        f"{'concurrency':>11}{'rps':>10}{'errors':>9}"
+        + "".join(f"{f'p{p} ms':>11}" for p in PERCENTILES)
+    ]
+    for level in report["levels"]:
+        latency = level["latency_ms"]["all"]
+        lines.append(
+            f"{level['concurrency']:>11}{level['rps']:>10.1f}"
+            f"{level['error_rate']:>9.1%}"
+            + "".join(f"{latency[f'p{p}']:>11.2f}" for p in PERCENTILES)
+        )
+    lines.append(
+        f"Sustainable: {report['sustainable_rps']:.1f} requests/sec "
+        f"(p99 <= {LOAD_CONFIG['slo_p99_ms']} ms, "
+        f"errors <= {LOAD_CONFIG['max_error_rate']:.0%})"
+    )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(
+        description="Load test the api against local stand-ins."
+    )
+    parser.add_argument(
+        "--url",
+        help="api to load test instead of starting one with the stand-ins",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=LOAD_CONFIG["concurrency_levels"],
+    )
+    parser.add_argument(
+        "--duration-s", type=float, default=LOAD_CONFIG["duration_s"]
+    )
+    parser.add_argument("--workers", type=int, default=LOAD_CONFIG["workers"])
+    parser.add_argument(
+        "--synthetic-docs", type=int, default=LOAD_CONFIG["synthetic_docs"]
+    )
+    parser.add_argument("--output", help="also write the report as json")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_load_test(args))
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
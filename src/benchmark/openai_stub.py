@@ -0,0 +1,216 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import re
+import time
+import uuid
+
+import yaml
+from aiohttp import web
+
+from src.logs import configure_logging
+
+with open("./config.yaml") as f:
+    config_dict = yaml.safe_load(f)
+
+STUB_CONFIG = config_dict["benchmark"]["stub"]
+
+logger = logging.getLogger(__name__)
+
+# canned specialists for symptoms containing a keyword, first match wins
+CANNED_SPECIALISTS = {
+    "tooth": ["Dentist", "Oral Surgeon"],
+    "skin": ["Dermatologist", "Allergist"],
+    "rash": ["Dermatologist", "Allergist"],
+    "chest": ["Cardiologist", "Pulmonologist"],
+    "heart": ["Cardiologist"],
+    "cough": ["Pulmonologist", "General Practitioner"],
+    "eye": ["Ophthalmologist"],
+    "vision": ["Ophthalmologist", "Neurologist"],
+    "ear": ["ENT Specialist"],
+    "throat": ["ENT Specialist", "General Practitioner"],
+    "head": ["Neurologist", "General Practitioner"],
+    "back": ["Orthopedist", "Physiotherapist"],
+    "knee": ["Orthopedist", "Sports Medicine Specialist"],
+    "stomach": ["Gastroenterologist", "General Practitioner"],
+    "anxiety": ["Psychiatrist", "Psychologist"],
+}
+DEFAULT_SPECIALISTS = ["General Practitioner", "Internal Medicine Specialist"]
+DESCRIPTION = (
+    "A {specialist} is a doctor who finds out what is wrong when a part of "
+    "your body is not working well, and helps you get better with medicine, "
+    "advice or treatment."
+)
+
+# words and the whitespace after them, each streamed as one token
+TOKEN_PATTERN = re.compile(r"\s*\S+")
+
+
+def canned_completion(prompt: str) -> str:
+    """Returns the stub's answer to a prompt.
+
+    Prompts asking for specialists (`openai_query.MEDICAL_PROMPT`) are
+    answered with `{{specialist}}` names picked from the symptoms' keywords;
+    any other prompt is taken as asking for a description of the specialist
+    it ends with.
+    """
+    if "Patient:" in prompt:
+        symptoms = prompt.rsplit("Patient:", 1)[1].lower()
+        specialists = next(
+            (
+                names
+                for keyword, names in CANNED_SPECIALISTS.items()
+                if keyword in symptoms
+            ),
+            DEFAULT_SPECIALISTS,
+        )
+        return "\n\n" + ", ".join(f"{{{{{s}}}}}" for s in specialists)
+    specialist = prompt.rsplit(":", 1)[-1].strip()
+    return "\n\n" + DESCRIPTION.format(specialist=specialist)
+
+
+def completion_body(engine: str, choices: list[dict]) -> dict:
+    """Wraps choices in a Completion API response body."""
+    return {
+        "id": f"cmpl-{uuid.uuid4().hex}",
+        "object": "text_completion",
+        "created": int(time.time()),
+        "model": engine,
+        "choices": choices,
+    }
+
+
+def choice(text: str, index: int, finish_reason: str | None) -> dict:
+    """Returns a Completion API choice."""
+    return {
+        "text": text,
+        "index": index,
+        "logprobs": None,
+        "finish_reason": finish_reason,
+    }
+
+
+class OpenAIStub:
+    """Stand-in for the Azure OpenAI and OpenAI Completion APIs.
+
+    Completions are canned, see `canned_completion`. Each request waits
+    `latency_ms` (plus up to `jitter_ms`) before its first token, then
+    produces `tokens_per_second` tokens, streamed as server-sent events when
+    `stream` is set. Multi-prompt requests generate their prompts in
+    parallel, like the real API.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float,
+        jitter_ms: float,
+        tokens_per_second: float,
+        seed: int | None = None,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tokens_per_second = tokens_per_second
+        self._random = random.Random(seed)
+        self.requests = 0
+
+    async def first_token_delay(self):
+        """Waits the configured latency before the first token."""
+        delay_ms = self.latency_ms + self._random.uniform(0, self.jitter_ms)
+        await asyncio.sleep(delay_ms / 1000)
+
+    async def completions(self, request: web.Request) -> web.StreamResponse:
+        """Handles `POST .../completions`."""
+        self.requests += 1
+        body = await request.json()
+        engine = request.match_info.get("engine", body.get("model", "stub"))
+        prompts = body["prompt"]
+        if isinstance(prompts, str):
+            prompts = [prompts]
+        texts = [canned_completion(prompt) for prompt in prompts]
+        logger.debug(f"Stub completing {len(prompts)} prompts for {engine}")
+
+        await self.first_token_delay()
+        if body.get("stream"):
+            return await self.stream(request, engine, texts[0])
+
+        num_tokens = max(len(TOKEN_PATTERN.findall(t)) for t in texts)
+        await asyncio.sleep(num_tokens / self.tokens_per_second)
+        return web.json_response(
+            completion_body(
+                engine,
+                [choice(text, i, "stop") for i, text in enumerate(texts)],
+            )
+        )
+
+    async def stream(
+        self, request: web.Request, engine: str, text: str
+    ) -> web.StreamResponse:
+        """Streams a completion one token per server-sent event."""
+        response = web.StreamResponse(
+            headers={"Content-Type": "text/event-stream"}
+        )
+        await response.prepare(request)
+        tokens = TOKEN_PATTERN.findall(text)
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            finish_reason = "stop" if i == len(tokens) - 1 else None
+            chunk = completion_body(engine, [choice(token, 0, finish_reason)])
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+
+def create_stub_app(stub: OpenAIStub) -> web.Application:
+    """Routes the Azure (`api_type: azure`) and OpenAI completion paths to
+    the stub, so either API type can point `api_base` at it."""
+    app = web.Application()
+    app.add_routes(
+        [
+            web.post(
+                "/openai/deployments/{engine}/completions", stub.completions
+            ),
+            web.post("/v1/engines/{engine}/completions", stub.completions),
+            web.post("/v1/completions", stub.completions),
+        ]
+    )
+    return app
+
+
+async def start_stub_server(
+    stub: OpenAIStub, host: str, port: int
+) -> web.AppRunner:
+    """Starts the stub on the running event loop; call `cleanup` on the
+    returned runner to stop it."""
+    runner = web.AppRunner(create_stub_app(stub))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"OpenAI stub listening on http://{host}:{port}")
+    return runner
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(
+        description="Serve canned completions in place of OpenAI."
+    )
+    parser.add_argument("--host", default=STUB_CONFIG["host"])
+    parser.add_argument("--port", type=int, default=STUB_CONFIG["port"])
+    parser.add_argument(
+        "--latency-ms", type=float, default=STUB_CONFIG["latency_ms"]
+    )
+    parser.add_argument(
+        "--jitter-ms", type=float, default=STUB_CONFIG["jitter_ms"]
+    )
+    parser.add_argument(
+        "--tokens-per-second",
+        type=float,
+        default=STUB_CONFIG["tokens_per_second"],
+    )
+    args = parser.parse_args()
+
+    stub = OpenAIStub(args.latency_ms, args.jitter_ms, args.tokens_per_second)
+    web.run_app(create_stub_app(stub), host=args.host, port=args.port)
@@ -4,7 +4,9 @@ import os
 import yaml
 from dotenv import load_dotenv
 from elasticsearch import Elasticsearch
-from utils import create_elasticsearch_client
+
+from ..logs import configure_logging
+from .utils import create_elasticsearch_client
 
 with open("./config.yaml") as f:
     config_dict = yaml.safe_load(f)
@@ -32,7 +34,11 @@ INDEX_SETTINGS = {
                 }
             },
             "specialty_registration_no": {"type": "keyword"},
-            "specialty_name": {"type": "text"},
+            # keyword subfield for exact `terms` filters on resolved names
+            "specialty_name": {
+                "type": "text",
+                "fields": {"keyword": {"type": "keyword"}},
+            },
             "speciality_qualification": {
                 "properties": {
                     "nature": {"properties": {"text": {"type": "text"}}},
@@ -40,16 +46,16 @@ INDEX_SETTINGS = {
                     "year": {"type": "integer"},
                 }
             },
+            # parsed at index time for faceted filtering; see `enrich.py`
+            "district": {"type": "keyword"},
+            "institutions": {"type": "keyword"},
+            # formatted at index time for display only; see `render.py`
+            "display_markdown": {"type": "text", "index": False},
         }
     }
 }
 
-# set log level; debug, info, warning, error, critical
-logging.basicConfig(
-    format="%(asctime)s | %(levelname)s | %(module)s:%(funcName)s:%(lineno)d | %(message)s",
-    level=logging.DEBUG,
-    filename=config_dict["logpath"],
-)
+logger = logging.getLogger(__name__)
 
 
 def create_index(
@@ -78,12 +84,13 @@ def create_index(
 
 
 if __name__ == "__main__":
-    logging.info("Creating elasticsearch client")
+    configure_logging()
+    logger.info("Creating elasticsearch client")
     es_client = create_elasticsearch_client(
         host=HOST,
         certs_path=CERTS_PATH,
         username=ELASTIC_USERNAME,
         password=ELASTIC_PASSWORD,
     )
-    logging.info(f"Creating index {INDEX_NAME}")
+    logger.info(f"Creating index {INDEX_NAME}")
     create_index(es_client, INDEX_NAME, INDEX_SETTINGS)
@@ -0,0 +1,215 @@
+import re
+
+from ..render import hit_markdown
+
+# areas found in registered addresses and the district each belongs to
+DISTRICT_AREAS = {
+    "Central and Western": [
+        "Central",
+        "Sheung Wan",
+        "Sai Ying Pun",
+        "Kennedy Town",
+        "Mid-Levels",
+        "Admiralty",
+        "The Peak",
+        "Shek Tong Tsui",
+    ],
+    "Wan Chai": [
+        "Wan Chai",
+        "Wanchai",
+        "Causeway Bay",
+        "Happy Valley",
+        "Tai Hang",
+    ],
+    "Eastern": [
+        "North Point",
+        "Quarry Bay",
+        "Tai Koo",
+        "Taikoo Shing",
+        "Sai Wan Ho",
+        "Shau Kei Wan",
+        "Chai Wan",
+        "Fortress Hill",
+        "Tin Hau",
+        "Siu Sai Wan",
+    ],
+    "Southern": [
+        "Aberdeen",
+        "Ap Lei Chau",
+        "Pok Fu Lam",
+        "Pokfulam",
+        "Wong Chuk Hang",
+        "Repulse Bay",
+        "Stanley",
+        "Tin Wan",
+    ],
+    "Yau Tsim Mong": [
+        "Tsim Sha Tsui",
+        "Yau Ma Tei",
+        "Jordan",
+        "Mong Kok",
+        "Mongkok",
+        "Tai Kok Tsui",
+        "Prince Edward",
+    ],
+    "Sham Shui Po": [
+        "Sham Shui Po",
+        "Cheung Sha Wan",
+        "Lai Chi Kok",
+        "Mei Foo",
+        "Shek Kip Mei",
+    ],
+    "Kowloon City": [
+        "Kowloon City",
+        "Hung Hom",
+        "To Kwa Wan",
+        "Ho Man Tin",
+        "Kowloon Tong",
+        "Ma Tau Wai",
+    ],
+    "Wong Tai Sin": [
+        "Wong Tai Sin",
+        "Diamond Hill",
+        "San Po Kong",
+        "Tsz Wan Shan",
+        "Lok Fu",
+    ],
+    "Kwun Tong": [
+        "Kwun Tong",
+        "Ngau Tau Kok",
+        "Kowloon Bay",
+        "Lam Tin",
+        "Yau Tong",
+        "Sau Mau Ping",
+    ],
+    "Kwai Tsing": ["Kwai Chung", "Kwai Fong", "Tsing Yi"],
+    "Tsuen Wan": ["Tsuen Wan", "Sham Tseng", "Ma Wan"],
+    "Tuen Mun": ["Tuen Mun"],
+    "Yuen Long": ["Yuen Long", "Tin Shui Wai", "Kam Tin"],
+    "North": ["Sheung Shui", "Fanling", "Sha Tau Kok"],
+    "Tai Po": ["Tai Po"],
+    "Sha Tin": [
+        "Sha Tin",
+        "Shatin",
+        "Tai Wai",
+        "Ma On Shan",
+        "Fo Tan",
+        "Fotan",
+    ],
+    "Sai Kung": ["Sai Kung", "Tseung Kwan O", "Hang Hau", "Po Lam"],
+    "Islands": [
+        "Tung Chung",
+        "Lantau",
+        "Discovery Bay",
+        "Cheung Chau",
+        "Lamma",
+        "Mui Wo",
+    ],
+}
+AREA_TO_DISTRICT = {
+    area.upper(): district
+    for district, areas in DISTRICT_AREAS.items()
+    for area in areas
+}
+# longest areas first so eg. "Kowloon City" wins over a shorter overlap
+AREA_PATTERN = re.compile(
+    r"\b("
+    + "|".join(
+        re.escape(area) for area in sorted(AREA_TO_DISTRICT, key=len)[::-1]
+    )
+    + r")\b"
+)
+
+# qualification tags of common institutions and their names
+INSTITUTION_TAGS = {
+    "HK": "The University of Hong Kong",
+    "CUHK": "The Chinese University of Hong Kong",
+    "Lond": "University of London",
+    "Edin": "University of Edinburgh",
+    "Glas": "University of Glasgow",
+    "Camb": "University of Cambridge",
+    "Oxon": "University of Oxford",
+    "Manc": "University of Manchester",
+    "Birm": "University of Birmingham",
+    "Liv": "University of Liverpool",
+    "Sheff": "University of Sheffield",
+    "Leeds": "University of Leeds",
+    "NSW": "University of New South Wales",
+    "Syd": "University of Sydney",
+    "Melb": "University of Melbourne",
+    "Qld": "University of Queensland",
+    "Otago": "University of Otago",
+    "Toronto": "University of Toronto",
+    "Ireland": "National University of Ireland",
+    "Belf": "Queen's University Belfast",
+}
+
+
+def parse_district(address: str) -> str | None:
+    """Parses the district from a registered address.
+
+    Addresses run from most to least specific, so the last area found is
+    used, eg. "..., 1 Queen's Road Central, Central, Hong Kong" is in
+    "Central and Western".
+
+    Args:
+        address (str): Registered address of a doctor.
+
+    Returns:
+        str | None: One of the 18 districts of Hong Kong, or None if no known
+            area is found.
+    """
+    areas = AREA_PATTERN.findall(address.upper()) if address else []
+    return AREA_TO_DISTRICT[areas[-1]] if areas else None
+
+
+def parse_institutions(doc: dict) -> list[str]:
+    """Returns the distinct institutions that granted a doctor's
+    qualifications, named from their tags where known."""
+    qualifications = list(doc.get("qualifications") or [])
+    if doc.get("speciality_qualification"):
+        qualifications.append(doc["speciality_qualification"])
+
+    institutions = []
+    for qual in qualifications:
+        tag = qual.get("tag")
+        if not tag:
+            continue
+        institution = INSTITUTION_TAGS.get(tag, tag)
+        if institution not in institutions:
+            institutions.append(institution)
+    return institutions
+
+
+def enrich_document(doc: dict) -> dict:
+    """Adds the keyword fields used for faceted filtering, and the markdown
+    the app displays, to a scraped doctor document.
+
+    Args:
+        doc (dict): Document as saved by the detail scraper.
+
+    Returns:
+        dict: A copy of the document with `district`, `institutions` and
+            `display_markdown`.
+    """
+    return {
+        **doc,
+        "district": parse_district(doc.get("address")),
+        "institutions": parse_institutions(doc),
+        "display_markdown": hit_markdown(doc),
+    }
+
+
+def facet_values(doc: dict) -> dict[str, list]:
+    """Returns the values of each facet for an enriched document; the keys
+    match `facets.FACET_FIELDS`."""
+    return {
+        "specialty": [doc["specialty_name"]]
+        if doc.get("specialty_name")
+        else [],
+        "district": [doc["district"]] if doc.get("district") else [],
+        "institution": doc.get("institutions") or [],
+        "qualification_year": sorted(
+            {q["year"] for q in doc.get("qualifications") or []}
+        ),
+    }
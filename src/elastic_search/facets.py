@@ -0,0 +1,102 @@
+import json
+import os
+
+from elasticsearch import Elasticsearch
+
+# facet name to the keyword field it aggregates and filters on
+FACET_FIELDS = {
+    "specialty": "specialty_name.keyword",
+    "district": "district",
+    "institution": "institutions",
+    "qualification_year": "qualifications.year",
+}
+
+# maximum number of values returned per facet
+FACET_SIZE = 200
+
+
+def build_filters(filters: dict[str, list] | None) -> list[dict]:
+    """Builds `terms` filter clauses from selected facet values.
+
+    Values of one facet are OR-ed together and facets are AND-ed.
+
+    Args:
+        filters: Facet name to the values selected for it
+
+    Returns:
+        list[dict]: Filter clauses for a `bool` query
+    """
+    return [
+        {"terms": {FACET_FIELDS[facet]: values}}
+        for facet, values in (filters or {}).items()
+        if values
+    ]
+
+
+def facet_aggregations(size: int = FACET_SIZE) -> dict:
+    """Builds a `terms` aggregation for every facet."""
+    aggs = {
+        facet: {"terms": {"field": field, "size": size}}
+        for facet, field in FACET_FIELDS.items()
+    }
+    # list years in order rather than by count
+    aggs["qualification_year"]["terms"]["order"] = {"_key": "desc"}
+    return aggs
+
+
+def get_facet_counts(
+    es_client: Elasticsearch, index_name: str, query: dict | None = None
+) -> dict[str, list[list]]:
+    """Counts the documents per value of each facet.
+
+    Args:
+        es_client: Elasticsearch client
+        index_name: Name of the index to aggregate
+        query: Query restricting the counted documents; all if None
+
+    Returns:
+        dict[str, list[list]]: Facet name to `[value, count]` pairs
+    """
+    res = es_client.search(
+        index=index_name,
+        query=query or {"match_all": {}},
+        aggs=facet_aggregations(),
+        size=0,
+    )
+    return {
+        facet: [
+            [bucket["key"], bucket["doc_count"]]
+            for bucket in res["aggregations"][facet]["buckets"]
+        ]
+        for facet in FACET_FIELDS
+    }
+
+
+def save_facet_counts(facet_counts: dict[str, list[list]], path: str):
+    """Saves facet counts to a json file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(facet_counts, f, ensure_ascii=False)
+
+
+def load_facet_counts(path: str) -> dict[str, list[list]] | None:
+    """Loads facet counts saved with `save_facet_counts`, or None if they
+    haven't been computed."""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def precompute_facet_counts(
+    es_client: Elasticsearch, index_name: str, output_path: str
+):
+    """Counts facet values over the whole index and caches them, so the
+    app's filters render without an aggregation query.
+
+    Args:
+        es_client: Elasticsearch client
+        index_name: Name of the index to aggregate
+        output_path: Path of the json cache to write
+    """
+    save_facet_counts(get_facet_counts(es_client, index_name), output_path)
@@ -6,7 +6,11 @@ import yaml
 from dotenv import load_dotenv
 from elasticsearch import Elasticsearch
 from tqdm import tqdm
-from utils import create_elasticsearch_client
+
+from ..logs import configure_logging
+from .enrich import enrich_document
+from .facets import precompute_facet_counts
+from .utils import create_elasticsearch_client
 
 with open("./config.yaml") as f:
     config_dict = yaml.safe_load(f)
@@ -19,13 +23,9 @@ INDEX_NAME = os.getenv("ELASTIC_INDEXNAME")
 CERTS_PATH = config_dict["elasticsearch"]["certs_path"]
 HOST = config_dict["elasticsearch"]["host_path"]
 DATA_DIR = config_dict["scraper"]["datapath"]
+FACET_CACHE_PATH = config_dict["facets"]["cache_path"]
 
-# set log level; debug, info, warning, error, critical
-logging.basicConfig(
-    format="%(asctime)s | %(levelname)s | %(module)s:%(funcName)s:%(lineno)d | %(message)s",
-    level=logging.DEBUG,
-    filename=config_dict["logpath"],
-)
+logger = logging.getLogger(__name__)
 
 
 def load_and_index_json_files(
@@ -48,13 +48,16 @@ def load_and_index_json_files(
         with open(data_dir + jf) as raw_data:
             json_docs = json.load(raw_data)
 
-        # add each json doc to the index
+        # add each json doc to the index, with its facet fields
         for json_doc in tqdm(json_docs):
-            es_client.index(index=index_name, document=json_doc)
+            es_client.index(
+                index=index_name, document=enrich_document(json_doc)
+            )
 
 
 if __name__ == "__main__":
-    logging.info("Creating elasticsearch client")
+    configure_logging()
+    logger.info("Creating elasticsearch client")
     es_client = create_elasticsearch_client(
         host=HOST,
         certs_path=CERTS_PATH,
@@ -65,7 +68,7 @@ if __name__ == "__main__":
     # check if index exists
     index_exists = es_client.indices.exists(index=INDEX_NAME)
     assert index_exists, f"{INDEX_NAME} Index does not exist!"
-    logging.info("Index exists! Proceeding to add data..")
+    logger.info("Index exists! Proceeding to add data..")
 
     # load json files
     json_filepaths = [
@@ -87,4 +90,8 @@ if __name__ == "__main__":
     # Get the document count
     res = es_client.cat.count(index=INDEX_NAME, params={"format": "json"})
     count = int(res[0]["count"])
-    logging.info(f"{count} number of documents added to index!")
+    logger.info(f"{count} number of documents added to index!")
+
+    # cache global facet counts so the app doesn't aggregate on page load
+    precompute_facet_counts(es_client, INDEX_NAME, FACET_CACHE_PATH)
+    logger.info(f"Facet counts cached to {FACET_CACHE_PATH}")
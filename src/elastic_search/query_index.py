@@ -1,11 +1,15 @@
 import logging
 import os
+from typing import Iterator
 
 import yaml
 from dotenv import load_dotenv
 from elastic_transport import ObjectApiResponse
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, NotFoundError
 
+from ..logs import configure_logging
+from ..tracing import traced
+from .facets import build_filters
 from .utils import create_elasticsearch_client
 
 with open("./config.yaml") as f:
@@ -20,48 +24,255 @@ CERTS_PATH = config_dict["elasticsearch"]["certs_path"]
 HOST = config_dict["elasticsearch"]["host_path"]
 
 
-# set log level; debug, info, warning, error, critical
-logging.basicConfig(
-    format="%(asctime)s | %(levelname)s | %(module)s:%(funcName)s:%(lineno)d | %(message)s",
-    level=logging.DEBUG,
-    filename=config_dict["logpath"],
-)
+logger = logging.getLogger(__name__)
 
 
+# fields matched by the full-text query
+SEARCH_FIELDS = [
+    "name",
+    "address",
+    "qualifications.nature.text",
+    "qualifications.nature.tag",
+    "specialty_name",
+    "speciality_qualification.nature.text",
+    "speciality_qualification.nature.tag",
+]
+
+# fields rendered by the app; everything else is dropped from `_source`
+SOURCE_FIELDS = [
+    "registration_no",
+    "name",
+    "address",
+    "qualifications",
+    "specialty_registration_no",
+    "specialty_name",
+    "speciality_qualification",
+    "display_markdown",
+]
+
+# stable sort orders for paging; `_shard_doc` is appended as a tiebreaker
+SORT_OPTIONS = {
+    "relevance": [{"_score": "desc"}],
+    "qualification_year": [
+        {"qualifications.year": {"order": "asc", "mode": "min"}}
+    ],
+    "specialty_year": [
+        {"speciality_qualification.year": {"order": "asc", "missing": "_last"}}
+    ],
+}
+
+
+def build_query(
+    query_string: str,
+    specialties: list[str] | None = None,
+    filters: dict[str, list] | None = None,
+) -> dict:
+    """Builds the query over the searchable doctor fields.
+
+    If canonical specialty names are given, an exact `terms` filter on them
+    is used instead of the full-text query. Selected facet values are added
+    as filters, which don't affect scoring.
+
+    Args:
+        query_string: Query to search for
+        specialties: Canonical specialty names to filter on
+        filters: Facet name to the values selected for it
+    Returns:
+        query: Elasticsearch query DSL
+    """
+    filter_clauses = build_filters(filters)
+    if specialties:
+        filter_clauses.append(
+            {"terms": {"specialty_name.keyword": specialties}}
+        )
+        must = []
+    elif query_string:
+        must = [
+            {"multi_match": {"query": query_string, "fields": SEARCH_FIELDS}}
+        ]
+    else:
+        must = [{"match_all": {}}]
+
+    if not filter_clauses:
+        return must[0]
+    return {"bool": {"must": must, "filter": filter_clauses}}
+
+
+@traced("elasticsearch.search")
 def search(
-    es_client: Elasticsearch, index_name: str, query_string: dict
+    es_client: Elasticsearch,
+    index_name: str,
+    query_string: str,
+    size: int = 10,
+    specialties: list[str] | None = None,
+    filters: dict[str, list] | None = None,
 ) -> ObjectApiResponse:
     """Searches the index for the query.
     Args:
         es_client: Elasticsearch client
         index_name: Name of the index to search
-        query: Query to search for
+        query_string: Query to search for
+        size: Number of hits to return
+        specialties: Canonical specialty names to filter on instead
+        filters: Facet name to the values selected for it
     Returns:
         res: Elasticsearch response
     """
-    # Search query
-    query = {
-        "multi_match": {
-            "query": query_string,
-            "fields": [
-                "name",
-                "address",
-                "qualifications.nature.text",
-                "qualifications.nature.tag",
-                "specialty_name",
-                "speciality_qualification.nature.text",
-                "speciality_qualification.nature.tag",
-            ],
-        }
-    }
-
     # get results from elasticsearch; ordered by score in descending order
-    res = es_client.search(index=index_name, query=query)
+    res = es_client.search(
+        index=index_name,
+        query=build_query(query_string, specialties, filters),
+        source=SOURCE_FIELDS,
+        size=size,
+    )
     return res
 
 
+@traced("elasticsearch.get_doctor")
+def get_doctor(
+    es_client: Elasticsearch, index_name: str, registration_no: str
+) -> dict | None:
+    """Looks up a doctor by registration number.
+    Args:
+        es_client: Elasticsearch client
+        index_name: Name of the index to search
+        registration_no: Registration number of the doctor
+    Returns:
+        doc: The doctor's `_source`, or None if not registered
+    """
+    res = es_client.search(
+        index=index_name,
+        query={"term": {"registration_no": registration_no}},
+        source=SOURCE_FIELDS,
+        size=1,
+    )
+    hits = res["hits"]["hits"]
+    return hits[0]["_source"] if hits else None
+
+
+@traced("elasticsearch.open_point_in_time")
+def open_point_in_time(
+    es_client: Elasticsearch, index_name: str, keep_alive: str = "5m"
+) -> str:
+    """Opens a point in time so pages are read from a consistent view.
+    Args:
+        es_client: Elasticsearch client
+        index_name: Name of the index to page through
+        keep_alive: How long the point in time is kept open between pages
+    Returns:
+        pit_id: Id of the opened point in time
+    """
+    res = es_client.open_point_in_time(index=index_name, keep_alive=keep_alive)
+    return res["id"]
+
+
+def close_point_in_time(es_client: Elasticsearch, pit_id: str):
+    """Closes a point in time, ignoring ones that have already expired.
+    Args:
+        es_client: Elasticsearch client
+        pit_id: Id of the point in time to close
+    """
+    try:
+        es_client.close_point_in_time(id=pit_id)
+    except NotFoundError:
+        logger.debug(f"Point in time already closed: {pit_id}")
+
+
+@traced("elasticsearch.search_page")
+def search_page(
+    es_client: Elasticsearch,
+    pit_id: str,
+    query_string: str,
+    size: int = 20,
+    search_after: list | None = None,
+    sort_by: str = "relevance",
+    keep_alive: str = "5m",
+    specialties: list[str] | None = None,
+    filters: dict[str, list] | None = None,
+) -> ObjectApiResponse:
+    """Fetches one page of results from a point in time.
+
+    Pass the `sort` values of the last hit of a page as `search_after` to get
+    the next page; each page costs the same regardless of its depth. The
+    response carries a (possibly refreshed) `pit_id` to use for the next page.
+
+    Args:
+        es_client: Elasticsearch client
+        pit_id: Id of the point in time opened with `open_point_in_time`
+        query_string: Query to search for
+        size: Number of hits per page
+        search_after: Sort values of the last hit of the previous page
+        sort_by: Key of `SORT_OPTIONS` to order results by
+        keep_alive: How long to extend the point in time by
+        specialties: Canonical specialty names to filter on instead
+        filters: Facet name to the values selected for it
+    Returns:
+        res: Elasticsearch response
+    """
+    sort = SORT_OPTIONS[sort_by] + [{"_shard_doc": "asc"}]
+    res = es_client.search(
+        query=build_query(query_string, specialties, filters),
+        pit={"id": pit_id, "keep_alive": keep_alive},
+        sort=sort,
+        search_after=search_after,
+        source=SOURCE_FIELDS,
+        size=size,
+        # only count the total on the first page
+        track_total_hits=search_after is None,
+    )
+    return res
+
+
+def iterate_pages(
+    es_client: Elasticsearch,
+    index_name: str,
+    query_string: str,
+    size: int = 20,
+    sort_by: str = "relevance",
+    specialties: list[str] | None = None,
+    filters: dict[str, list] | None = None,
+) -> Iterator[list[dict]]:
+    """Yields every page of hits for the query, one list of hits at a time.
+    Args:
+        es_client: Elasticsearch client
+        index_name: Name of the index to search
+        query_string: Query to search for
+        size: Number of hits per page
+        sort_by: Key of `SORT_OPTIONS` to order results by
+        specialties: Canonical specialty names to filter on instead
+        filters: Facet name to the values selected for it
+    Yields:
+        hits: Hits of the next page
+    """
+    pit_id = open_point_in_time(es_client, index_name)
+    search_after = None
+    try:
+        while True:
+            res = search_page(
+                es_client,
+                pit_id,
+                query_string,
+                size=size,
+                search_after=search_after,
+                sort_by=sort_by,
+                specialties=specialties,
+                filters=filters,
+            )
+            pit_id = res["pit_id"]
+            hits = res["hits"]["hits"]
+            if not hits:
+                break
+            yield hits
+            if len(hits) < size:
+                break
+            search_after = hits[-1]["sort"]
+    finally:
+        close_point_in_time(es_client, pit_id)
+
+
 if __name__ == "__main__":
-    logging.info("Creating elasticsearch client")
+    configure_logging()
+    logger.info("Creating elasticsearch client")
     es_client = create_elasticsearch_client(
         host=HOST,
         certs_path=CERTS_PATH,
@@ -72,7 +283,7 @@ if __name__ == "__main__":
     # check if index exists
     index_exists = es_client.indices.exists(index=INDEX_NAME)
     assert index_exists, f"{INDEX_NAME} Index does not exist!"
-    logging.info("Index exists!")
+    logger.info("Index exists!")
 
     # Refresh the index
     es_client.indices.refresh(index=INDEX_NAME)
@@ -80,13 +291,13 @@ if __name__ == "__main__":
     # Get the document count
     res = es_client.cat.count(index=INDEX_NAME, format="json")
     count = int(res[0]["count"])
-    logging.info(f"Document count: {count}")
+    logger.info(f"Document count: {count}")
 
     # Search for a query
     query_string = "Dr. John"
-    logging.info(f"Searching {INDEX_NAME} index for {query_string}...")
+    logger.info(f"Searching {INDEX_NAME} index for {query_string}...")
     res = search(es_client, INDEX_NAME, query_string)
-    logging.info(f"{res['hits']['total']['value']} results found")
+    logger.info(f"{res['hits']['total']['value']} results found")
 
     # printing hits
     for hit in res["hits"]["hits"]:
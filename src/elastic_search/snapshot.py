@@ -0,0 +1,278 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Iterator
+
+import yaml
+from dotenv import load_dotenv
+from elasticsearch import Elasticsearch, helpers
+
+from ..logs import configure_logging
+from .create_index import INDEX_SETTINGS
+from .facets import precompute_facet_counts
+from .utils import create_elasticsearch_client
+
+with open("./config.yaml") as f:
+    config_dict = yaml.safe_load(f)
+
+# load environment variables and set constants
+load_dotenv()
+ELASTIC_USERNAME = os.getenv("ELASTIC_USERNAME")
+ELASTIC_PASSWORD = os.getenv("ELASTIC_PASSWORD")
+INDEX_NAME = os.getenv("ELASTIC_INDEXNAME")
+CERTS_PATH = config_dict["elasticsearch"]["certs_path"]
+HOST = config_dict["elasticsearch"]["host_path"]
+SNAPSHOT_PATH = config_dict["snapshot"]["path"]
+DOCS_PER_FILE = config_dict["snapshot"]["docs_per_file"]
+BULK_THREADS = config_dict["snapshot"]["bulk_threads"]
+FACET_CACHE_PATH = config_dict["facets"]["cache_path"]
+
+# files built alongside the index that ship with the bundle, if present
+EXTRA_FILES = {
+    "specialist_descriptions.json": config_dict["specialist_descriptions"][
+        "path"
+    ],
+}
+
+MANIFEST_NAME = "manifest.json"
+FORMAT_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(filepath: str) -> str:
+    """Returns the hex sha256 checksum of a file, read in chunks."""
+    sha = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def write_documents(docs: list[dict], filepath: str) -> dict:
+    """Writes documents to a gzipped NDJSON file.
+
+    Args:
+        docs (list[dict]): `{"_id", "_source"}` documents to write.
+        filepath (str): Path of the file to write.
+
+    Returns:
+        dict: Manifest entry of the file with its checksum.
+    """
+    with gzip.open(filepath, "wt", encoding="utf-8") as f:
+        for doc in docs:
+            f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+    return {
+        "name": os.path.basename(filepath),
+        "documents": len(docs),
+        "bytes": os.path.getsize(filepath),
+        "sha256": file_sha256(filepath),
+    }
+
+
+def export_index(
+    es_client: Elasticsearch, index_name: str, snapshot_path: str
+):
+    """Exports an index to a bundle of gzipped NDJSON files and a manifest.
+
+    The manifest stores the index settings from `INDEX_SETTINGS`, the
+    document count and a sha256 checksum per file. Files in `EXTRA_FILES`,
+    such as the specialist description table, are bundled too.
+
+    Args:
+        es_client (Elasticsearch): An instance of the Elasticsearch client.
+        index_name (str): The name of the index to export.
+        snapshot_path (str): Directory to write the bundle to.
+    """
+    os.makedirs(snapshot_path, exist_ok=True)
+    files, batch = [], []
+
+    def flush():
+        """Writes the current batch of documents to the next file."""
+        filepath = os.path.join(
+            snapshot_path, f"documents-{len(files):05d}.ndjson.gz"
+        )
+        files.append(write_documents(batch, filepath))
+        batch.clear()
+
+    for hit in helpers.scan(
+        es_client, index=index_name, query={"query": {"match_all": {}}}
+    ):
+        batch.append({"_id": hit["_id"], "_source": hit["_source"]})
+        if len(batch) == DOCS_PER_FILE:
+            flush()
+    if batch:
+        flush()
+
+    extras = []
+    for name, source_path in EXTRA_FILES.items():
+        if os.path.exists(source_path):
+            shutil.copyfile(source_path, os.path.join(snapshot_path, name))
+            extras.append(
+                {
+                    "name": name,
+                    "bytes": os.path.getsize(source_path),
+                    "sha256": file_sha256(source_path),
+                }
+            )
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "index_name": index_name,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "settings": INDEX_SETTINGS,
+        "documents": sum(f["documents"] for f in files),
+        "files": files,
+        "extras": extras,
+    }
+    with open(os.path.join(snapshot_path, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    logger.info(
+        f"Exported {manifest['documents']} documents in {len(files)} files "
+        f"to {snapshot_path}"
+    )
+
+
+def load_manifest(snapshot_path: str) -> dict:
+    """Loads a bundle's manifest and verifies the checksum of every file.
+
+    Raises:
+        ValueError: If the format version or a checksum doesn't match.
+    """
+    with open(os.path.join(snapshot_path, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+
+    if manifest["format_version"] != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported snapshot version {manifest['format_version']}!"
+        )
+    # bundles exported before extras were added have none
+    for entry in manifest["files"] + manifest.get("extras", []):
+        checksum = file_sha256(os.path.join(snapshot_path, entry["name"]))
+        if checksum != entry["sha256"]:
+            raise ValueError(f"Checksum mismatch for {entry['name']}!")
+    return manifest
+
+
+def iter_actions(
+    snapshot_path: str, manifest: dict, index_name: str
+) -> Iterator[dict]:
+    """Yields bulk index actions for every document in a bundle."""
+    for entry in manifest["files"]:
+        filepath = os.path.join(snapshot_path, entry["name"])
+        with gzip.open(filepath, "rt", encoding="utf-8") as f:
+            for line in f:
+                doc = json.loads(line)
+                yield {
+                    "_index": index_name,
+                    "_id": doc["_id"],
+                    "_source": doc["_source"],
+                }
+
+
+def import_index(
+    es_client: Elasticsearch,
+    index_name: str,
+    snapshot_path: str,
+    overwrite: bool = False,
+):
+    """Restores an index from a bundle written by `export_index`.
+
+    Documents are loaded with parallel bulk requests while refreshes and
+    replicas are disabled. Once loading is done, both are restored to what
+    the cluster created the index with, eg. from an index template, rather
+    than to a fixed replica count.
+
+    Args:
+        es_client (Elasticsearch): An instance of the Elasticsearch client.
+        index_name (str): The name of the index to create.
+        snapshot_path (str): Directory the bundle was written to.
+        overwrite (bool): Delete the index first if it already exists.
+
+    Raises:
+        AssertionError: If the index exists and `overwrite` is False, or the
+            restored document count doesn't match the manifest.
+    """
+    manifest = load_manifest(snapshot_path)
+
+    if es_client.indices.exists(index=index_name):
+        assert overwrite, f"{index_name} Index already exists!"
+        es_client.indices.delete(index=index_name)
+
+    es_client.indices.create(
+        index=index_name,
+        mappings=manifest["settings"]["mappings"],
+        settings={"refresh_interval": "-1"},
+    )
+    replicas = es_client.indices.get_settings(
+        index=index_name, name="index.number_of_replicas"
+    )[index_name]["settings"]["index"]["number_of_replicas"]
+    es_client.indices.put_settings(
+        index=index_name, settings={"number_of_replicas": 0}
+    )
+
+    for ok, item in helpers.parallel_bulk(
+        es_client,
+        iter_actions(snapshot_path, manifest, index_name),
+        thread_count=BULK_THREADS,
+        chunk_size=1000,
+    ):
+        if not ok:
+            logger.error(f"Failed to index document: {item}")
+
+    es_client.indices.put_settings(
+        index=index_name,
+        settings={"number_of_replicas": replicas, "refresh_interval": None},
+    )
+    es_client.indices.refresh(index=index_name)
+
+    res = es_client.cat.count(index=index_name, format="json")
+    count = int(res[0]["count"])
+    assert (
+        count == manifest["documents"]
+    ), f"Restored {count} of {manifest['documents']} documents!"
+    logger.info(f"Imported {count} documents into {index_name}")
+
+    for entry in manifest.get("extras", []):
+        target_path = EXTRA_FILES[entry["name"]]
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        shutil.copyfile(
+            os.path.join(snapshot_path, entry["name"]), target_path
+        )
+        logger.info(f"Restored {entry['name']} to {target_path}")
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(
+        description="Export or import the doctors index as an NDJSON bundle."
+    )
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("--path", default=SNAPSHOT_PATH)
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="replace the index if it already exists when importing",
+    )
+    args = parser.parse_args()
+
+    logger.info("Creating elasticsearch client")
+    es_client = create_elasticsearch_client(
+        host=HOST,
+        certs_path=CERTS_PATH,
+        username=ELASTIC_USERNAME,
+        password=ELASTIC_PASSWORD,
+    )
+
+    started = time.perf_counter()
+    if args.command == "export":
+        export_index(es_client, INDEX_NAME, args.path)
+    else:
+        import_index(es_client, INDEX_NAME, args.path, args.overwrite)
+        precompute_facet_counts(es_client, INDEX_NAME, FACET_CACHE_PATH)
+    logger.info(f"{args.command} took {time.perf_counter() - started:.1f}s")
@@ -6,18 +6,24 @@ def create_elasticsearch_client(
     certs_path: str,
     username: str,
     password: str,
+    verify: bool = True,
+    connections_per_node: int = 10,
 ) -> Elasticsearch:
     """Creates an instance of the Elasticsearch client.
 
     This function creates an instance of the Elasticsearch client with the specified host,
     certificate path, username, and password. It checks if the client info is not None
-    and returns the client instance.
+    and returns the client instance, unless `verify` is False; the client then
+    connects lazily on its first request.
 
     Args:
         host (str): The host of the Elasticsearch cluster.
         certs_path (str): The path to the certificate file.
         username (str): The username for basic authentication.
         password (str): The password for basic authentication.
+        verify (bool): Check the cluster is reachable before returning.
+        connections_per_node (int): Size of the client's connection pool;
+            one connection is used per concurrent request.
 
     Returns:
         Elasticsearch: An instance of the Elasticsearch client.
@@ -27,10 +33,12 @@ def create_elasticsearch_client(
         host,
         ca_certs=certs_path,
         basic_auth=(username, password),
+        connections_per_node=connections_per_node,
     )
 
-    # Successful response!
-    client_info = es.info()
-    assert client_info is not None, "Elasticsearch client info is None!"
+    if verify:
+        # Successful response!
+        client_info = es.info()
+        assert client_info is not None, "Elasticsearch client info is None!"
 
     return es
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterator
+
+
+# how often access times of memory hits are written to disk at most
+TOUCH_FLUSH_SECONDS = 60
+
+
+def cache_key(prompt: str, params: dict) -> str:
+    """Hashes a prompt and its completion parameters (including the engine)
+    into a cache key."""
+    payload = json.dumps({"prompt": prompt, **params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Two level cache of LLM completions.
+
+    An in-memory LRU sits in front of a SQLite table on disk. Entries expire
+    after `ttl_seconds`, and the least recently used entries on disk are
+    evicted once there are more than `max_entries`. Safe to share between
+    threads, eg. Streamlit sessions.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl_seconds: int,
+        max_entries: int,
+        memory_entries: int,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()  # key -> (value, created_at)
+        # memory hits not yet written to `accessed_at` on disk
+        self._touched = {}  # key -> accessed_at
+        self._touched_flushed_at = time.time()
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "evictions": 0,
+        }
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL, "
+            "prompt TEXT)"
+        )
+        # caches created before prompts were stored lack the column
+        columns = [
+            row[1]
+            for row in self._conn.execute("PRAGMA table_info(completions)")
+        ]
+        if "prompt" not in columns:
+            self._conn.execute(
+                "ALTER TABLE completions ADD COLUMN prompt TEXT"
+            )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS completions_accessed_at "
+            "ON completions (accessed_at)"
+        )
+        self._conn.commit()
+
+    def _remember(self, key: str, value: str, created_at: float):
+        """Adds an entry to the in-memory LRU, dropping the oldest if full."""
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _flush_touched(self):
+        """Writes the access times of memory hits to disk, so eviction sees
+        them; call with the lock held, before committing."""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE completions SET accessed_at = ? WHERE key = ?",
+                [(at, key) for key, at in self._touched.items()],
+            )
+            self._touched = {}
+        self._touched_flushed_at = time.time()
+
+    def get(self, key: str) -> str | None:
+        """Returns the cached completion for a key, or None on a miss.
+
+        Memory hits are written to the disk's access times in batches, at
+        most every `TOUCH_FLUSH_SECONDS` or before the next eviction.
+        """
+        now = time.time()
+        with self._lock:
+            if key in self._memory:
+                value, created_at = self._memory[key]
+                if now - created_at < self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    self._touched[key] = now
+                    if now - self._touched_flushed_at >= TOUCH_FLUSH_SECONDS:
+                        self._flush_touched()
+                        self._conn.commit()
+                    return value
+                del self._memory[key]
+
+            row = self._conn.execute(
+                "SELECT value, created_at FROM completions WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+
+            value, created_at = row
+            if now - created_at >= self.ttl_seconds:
+                self._conn.execute(
+                    "DELETE FROM completions WHERE key = ?", (key,)
+                )
+                self._conn.commit()
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+
+            self._touched.pop(key, None)
+            self._conn.execute(
+                "UPDATE completions SET accessed_at = ? WHERE key = ?",
+                (now, key),
+            )
+            self._conn.commit()
+            self._remember(key, value, created_at)
+            self._stats["disk_hits"] += 1
+            return value
+
+    def set(self, key: str, value: str, prompt: str | None = None):
+        """Caches a completion, evicting the least recently used entries on
+        disk if the cache is over `max_entries`. The prompt is stored
+        alongside so cached answers can be reused, eg. to train triage."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self._touched.pop(key, None)
+            self._flush_touched()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?)",
+                (key, value, now, now, prompt),
+            )
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM completions"
+            ).fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM completions WHERE key IN ("
+                    "SELECT key FROM completions "
+                    "ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+                self._stats["evictions"] += count - self.max_entries
+            self._conn.commit()
+
+    def iter_completions(self, prefix: str = "") -> Iterator[tuple[str, str]]:
+        """Yields the `(prompt, completion)` pairs on disk whose prompt
+        starts with `prefix`."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT prompt, value FROM completions "
+                "WHERE prompt IS NOT NULL AND substr(prompt, 1, ?) = ?",
+                (len(prefix), prefix),
+            ).fetchall()
+        yield from rows
+
+    def purge_expired(self) -> int:
+        """Deletes expired entries from disk; returns how many were deleted."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM completions WHERE created_at < ?",
+                (time.time() - self.ttl_seconds,),
+            )
+            self._conn.commit()
+            self._stats["expired"] += cursor.rowcount
+            return cursor.rowcount
+
+    def stats(self) -> dict:
+        """Returns hit, miss and eviction counts, plus the hit rate."""
+        with self._lock:
+            stats = dict(self._stats)
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,554 @@
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import yaml
+
+from src.elastic_search.enrich import enrich_document, facet_values
+from src.elastic_search.facets import FACET_FIELDS, save_facet_counts
+from src.elastic_search.query_index import SEARCH_FIELDS, SOURCE_FIELDS
+from src.logs import configure_logging
+from src.tracing import traced
+
+with open("./config.yaml") as f:
+    config_dict = yaml.safe_load(f)
+
+DATA_DIR = config_dict["scraper"]["datapath"]
+INDEX_PATH = config_dict["local_search"]["index_path"]
+FACET_CACHE_PATH = config_dict["facets"]["cache_path"]
+
+logger = logging.getLogger(__name__)
+
+# BM25 parameters; same defaults as Elasticsearch
+K1 = 1.2
+B = 0.75
+
+# sort key used for documents missing a year; sorts them last
+MISSING_YEAR = np.iinfo(np.int32).max
+
+# arrays of `LocalIndex` saved as one `.npy` file each
+ARRAY_NAMES = [
+    "offsets",
+    "doc_ids",
+    "tfs",
+    "doc_lens",
+    "sort_years",
+    "sources",
+    "source_offsets",
+    "specialty_codes",
+]
+
+# single CJK characters or runs of other word characters, as the standard
+# analyzer splits them
+TOKEN_PATTERN = re.compile(r"[\u4e00-\u9fff]|[^\W\u4e00-\u9fff]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercases and splits text into terms like Elasticsearch's standard
+    analyzer does."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def field_values(doc: dict, field: str) -> list[str]:
+    """Returns all string values at a dotted field path, flattening lists.
+
+    Args:
+        doc (dict): Document to read the field from.
+        field (str): Dotted path, eg. "qualifications.nature.text".
+
+    Returns:
+        list[str]: The values found; empty if the path does not exist.
+    """
+    values = [doc]
+    for key in field.split("."):
+        next_values = []
+        for value in values:
+            if isinstance(value, list):
+                next_values.extend(v.get(key) for v in value if v)
+            elif isinstance(value, dict):
+                next_values.append(value.get(key))
+        values = [v for v in next_values if v is not None]
+    flattened = []
+    for value in values:
+        flattened.extend(value if isinstance(value, list) else [value])
+    return [v for v in flattened if isinstance(v, str)]
+
+
+def source_years(doc: dict) -> tuple[int, int]:
+    """Returns the sort keys of a document: the year of its earliest
+    qualification and the year of its specialty qualification."""
+    years = [q["year"] for q in doc.get("qualifications") or []]
+    specialty = doc.get("speciality_qualification")
+    return (
+        min(years) if years else MISSING_YEAR,
+        specialty["year"] if specialty else MISSING_YEAR,
+    )
+
+
+@dataclass
+class LocalIndex:
+    """Inverted index over the doctor documents, scored with BM25.
+
+    Postings are stored in CSR layout: the postings of term `t` are
+    `doc_ids[offsets[t]:offsets[t + 1]]` with matching term frequencies in
+    `tfs`. Terms are namespaced by field, eg. "4:cardiology", and facet
+    values and registration numbers are indexed as terms too, eg.
+    "district=Wan Chai". All arrays can
+    be memory mapped from disk; only returned `_source` documents are decoded.
+    """
+
+    vocab: dict[str, int]
+    specialty_names: list[str]
+    offsets: np.ndarray  # int64, (n_terms + 1,)
+    doc_ids: np.ndarray  # int32, (n_postings,)
+    tfs: np.ndarray  # float32, (n_postings,)
+    doc_lens: np.ndarray  # float32, (n_fields, n_docs)
+    sort_years: np.ndarray  # int32, (2, n_docs)
+    sources: np.ndarray  # uint8, concatenated utf-8 json documents
+    source_offsets: np.ndarray  # int64, (n_docs + 1,)
+    specialty_codes: np.ndarray  # int32, (n_docs,); -1 without a specialty
+
+    @property
+    def num_docs(self) -> int:
+        """Number of documents in the index."""
+        return len(self.source_offsets) - 1
+
+    def get_source(self, doc_id: int) -> dict:
+        """Decodes the stored document for a document id."""
+        start, end = self.source_offsets[doc_id : doc_id + 2]
+        return json.loads(self.sources[start:end].tobytes())
+
+    def score(self, query_string: str) -> np.ndarray:
+        """Scores every document against the query.
+
+        Mirrors a `best_fields` `multi_match` query: each field is scored
+        with BM25 and a document keeps its best field score.
+
+        Args:
+            query_string (str): Query to search for.
+
+        Returns:
+            np.ndarray: Score per document; 0 for non-matching documents.
+        """
+        terms = tokenize(query_string)
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for field_idx, dl in enumerate(self.doc_lens):
+            field_docs = np.count_nonzero(dl)
+            if not field_docs:
+                continue
+            avgdl = dl.sum() / field_docs
+            field_scores = np.zeros(self.num_docs, dtype=np.float32)
+            for term in terms:
+                term_id = self.vocab.get(f"{field_idx}:{term}")
+                if term_id is None:
+                    continue
+                start, end = self.offsets[term_id : term_id + 2]
+                ids = self.doc_ids[start:end]
+                tf = self.tfs[start:end]
+                idf = np.log1p(
+                    (field_docs - (end - start) + 0.5) / (end - start + 0.5)
+                )
+                norm = K1 * (1 - B + B * dl[ids] / avgdl)
+                field_scores[ids] += idf * tf / (tf + norm)
+            np.maximum(scores, field_scores, out=scores)
+        return scores
+
+    def specialty_mask(self, specialties: list[str]) -> np.ndarray:
+        """Returns which documents have exactly one of the specialty names."""
+        codes = [
+            i
+            for i, name in enumerate(self.specialty_names)
+            if name in specialties
+        ]
+        return np.isin(self.specialty_codes, codes)
+
+    def facet_mask(self, filters: dict[str, list]) -> np.ndarray:
+        """Returns which documents match the selected facet values; values
+        of one facet are OR-ed together and facets are AND-ed."""
+        mask = np.ones(self.num_docs, dtype=bool)
+        for facet, values in filters.items():
+            if not values:
+                continue
+            facet_mask = np.zeros(self.num_docs, dtype=bool)
+            for value in values:
+                term_id = self.vocab.get(f"{facet}={value}")
+                if term_id is None:
+                    continue
+                start, end = self.offsets[term_id : term_id + 2]
+                facet_mask[self.doc_ids[start:end]] = True
+            mask &= facet_mask
+        return mask
+
+
+def build_local_index(docs: list[dict]) -> LocalIndex:
+    """Builds a local index from scraped doctor detail documents.
+
+    Args:
+        docs (list[dict]): Documents as saved by the detail scraper.
+
+    Returns:
+        LocalIndex: The in-memory index.
+    """
+    # stored as enriched, so hits carry eg. their `display_markdown`
+    docs = [enrich_document(doc) for doc in docs]
+    vocab = {}
+    postings = []  # (term_id, doc_id, tf)
+    doc_lens = np.zeros((len(SEARCH_FIELDS), len(docs)), dtype=np.float32)
+
+    for doc_id, doc in enumerate(docs):
+        for facet, values in facet_values(doc).items():
+            for value in values:
+                term_id = vocab.setdefault(f"{facet}={value}", len(vocab))
+                postings.append((term_id, doc_id, 1))
+        # exact lookups by registration number, see `get_doctor`
+        term_id = vocab.setdefault(
+            f"registration_no={doc.get('registration_no')}", len(vocab)
+        )
+        postings.append((term_id, doc_id, 1))
+
+        for field_idx, field in enumerate(SEARCH_FIELDS):
+            counts = {}
+            for value in field_values(doc, field):
+                for term in tokenize(value):
+                    counts[term] = counts.get(term, 0) + 1
+            doc_lens[field_idx, doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                term_id = vocab.setdefault(f"{field_idx}:{term}", len(vocab))
+                postings.append((term_id, doc_id, tf))
+
+    postings = np.array(postings, dtype=np.int64).reshape(-1, 3)
+    # sort by term then document to lay postings out contiguously
+    postings = postings[np.lexsort((postings[:, 1], postings[:, 0]))]
+    offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+    np.cumsum(
+        np.bincount(postings[:, 0], minlength=len(vocab)), out=offsets[1:]
+    )
+
+    encoded = [
+        json.dumps(
+            {k: doc.get(k) for k in SOURCE_FIELDS}, ensure_ascii=False
+        ).encode("utf-8")
+        for doc in docs
+    ]
+    source_offsets = np.zeros(len(docs) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=source_offsets[1:])
+
+    specialty_names = sorted(
+        {doc["specialty_name"] for doc in docs if doc.get("specialty_name")}
+    )
+    codes = {name: i for i, name in enumerate(specialty_names)}
+    specialty_codes = np.array(
+        [codes.get(doc.get("specialty_name"), -1) for doc in docs],
+        dtype=np.int32,
+    )
+
+    return LocalIndex(
+        vocab=vocab,
+        specialty_names=specialty_names,
+        offsets=offsets,
+        doc_ids=postings[:, 1].astype(np.int32),
+        tfs=postings[:, 2].astype(np.float32),
+        doc_lens=doc_lens,
+        sort_years=np.array(
+            [source_years(doc) for doc in docs], dtype=np.int32
+        ).T.reshape(2, len(docs)),
+        sources=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        source_offsets=source_offsets,
+        specialty_codes=specialty_codes,
+    )
+
+
+def save_local_index(local_index: LocalIndex, index_path: str):
+    """Saves the index as `.npy` arrays plus json vocabularies.
+
+    Args:
+        local_index (LocalIndex): Index to save.
+        index_path (str): Directory to save the index to.
+    """
+    os.makedirs(index_path, exist_ok=True)
+    for name in ARRAY_NAMES:
+        np.save(
+            os.path.join(index_path, f"{name}.npy"), getattr(local_index, name)
+        )
+    with open(
+        os.path.join(index_path, "vocab.json"), "w", encoding="utf-8"
+    ) as f:
+        json.dump(local_index.vocab, f, ensure_ascii=False)
+    with open(
+        os.path.join(index_path, "specialties.json"), "w", encoding="utf-8"
+    ) as f:
+        json.dump(local_index.specialty_names, f, ensure_ascii=False)
+
+
+def load_local_index(index_path: str = INDEX_PATH) -> LocalIndex:
+    """Loads an index saved with `save_local_index`, memory mapping its arrays.
+
+    Args:
+        index_path (str): Directory the index was saved to.
+
+    Returns:
+        LocalIndex: The loaded index.
+    """
+    with open(os.path.join(index_path, "vocab.json"), encoding="utf-8") as f:
+        vocab = json.load(f)
+    with open(
+        os.path.join(index_path, "specialties.json"), encoding="utf-8"
+    ) as f:
+        specialty_names = json.load(f)
+    arrays = {
+        name: np.load(os.path.join(index_path, f"{name}.npy"), mmap_mode="r")
+        for name in ARRAY_NAMES
+    }
+    local_index = LocalIndex(
+        vocab=vocab, specialty_names=specialty_names, **arrays
+    )
+    logger.info(f"Loaded local index of {local_index.num_docs} documents")
+    return local_index
+
+
+def _sorted_matches(
+    local_index: LocalIndex,
+    query_string: str,
+    sort_by: str,
+    specialties: list[str] | None = None,
+    filters: dict[str, list] | None = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns matching document ids in sort order with their scores and
+    primary sort keys (ascending; relevance is negated). Specialty and facet
+    filters match without scoring, like a `bool` filter."""
+    scores = np.zeros(local_index.num_docs, dtype=np.float32)
+    if specialties:
+        mask = local_index.specialty_mask(specialties)
+    elif query_string:
+        scores = local_index.score(query_string)
+        mask = scores > 0
+    else:
+        mask = np.ones(local_index.num_docs, dtype=bool)
+    if filters:
+        mask &= local_index.facet_mask(filters)
+    matches = np.flatnonzero(mask)
+    if sort_by == "relevance":
+        keys = -scores[matches].astype(np.float64)
+    elif sort_by == "qualification_year":
+        keys = local_index.sort_years[0, matches].astype(np.float64)
+    elif sort_by == "specialty_year":
+        keys = local_index.sort_years[1, matches].astype(np.float64)
+    else:
+        raise KeyError(f"Unknown sort option: {sort_by}")
+    order = np.lexsort((matches, keys))
+    return matches[order], scores[matches[order]], keys[order]
+
+
+def _response(
+    local_index: LocalIndex,
+    index_name: str,
+    doc_ids: np.ndarray,
+    scores: np.ndarray,
+    total: int,
+    started: float,
+    sort_values: list | None = None,
+) -> dict:
+    """Builds an Elasticsearch shaped search response."""
+    hits = []
+    for i, (doc_id, score) in enumerate(zip(doc_ids, scores)):
+        hit = {
+            "_index": index_name,
+            "_id": str(doc_id),
+            "_score": float(score),
+            "_source": local_index.get_source(int(doc_id)),
+        }
+        if sort_values is not None:
+            hit["sort"] = sort_values[i]
+        hits.append(hit)
+    return {
+        "took": int((time.perf_counter() - started) * 1000),
+        "timed_out": False,
+        "hits": {
+            "total": {"value": total, "relation": "eq"},
+            "max_score": float(scores.max()) if len(scores) else None,
+            "hits": hits,
+        },
+    }
+
+
+@traced("local_search.search")
+def search(
+    local_index: LocalIndex,
+    index_name: str,
+    query_string: str,
+    size: int = 10,
+    specialties: list[str] | None = None,
+    filters: dict[str, list] | None = None,
+) -> dict:
+    """Searches the local index for the query; same interface as
+    `query_index.search`.
+    Args:
+        local_index: Local index to search
+        index_name: Name reported in the hits' `_index`
+        query_string: Query to search for
+        size: Number of hits to return
+        specialties: Canonical specialty names to filter on instead
+        filters: Facet name to the values selected for it
+    Returns:
+        res: Elasticsearch shaped response
+    """
+    started = time.perf_counter()
+    doc_ids, scores, _ = _sorted_matches(
+        local_index, query_string, "relevance", specialties, filters
+    )
+    return _response(
+        local_index,
+        index_name,
+        doc_ids[:size],
+        scores[:size],
+        total=len(doc_ids),
+        started=started,
+    )
+
+
+@traced("local_search.get_doctor")
+def get_doctor(
+    local_index: LocalIndex, index_name: str, registration_no: str
+) -> dict | None:
+    """Looks up a doctor by registration number; same interface as
+    `query_index.get_doctor`.
+    Args:
+        local_index: Local index to search
+        index_name: Unused; kept for interface compatibility
+        registration_no: Registration number of the doctor
+    Returns:
+        doc: The doctor's stored document, or None if not registered
+    """
+    term_id = local_index.vocab.get(f"registration_no={registration_no}")
+    if term_id is None:
+        return None
+    doc_id = local_index.doc_ids[local_index.offsets[term_id]]
+    return local_index.get_source(int(doc_id))
+
+
+def open_point_in_time(
+    local_index: LocalIndex, index_name: str, keep_alive: str = "5m"
+) -> str:
+    """Returns a point in time id; the local index is immutable so every
+    search already sees a consistent view."""
+    return index_name
+
+
+def close_point_in_time(local_index: LocalIndex, pit_id: str):
+    """No-op counterpart of `query_index.close_point_in_time`."""
+
+
+@traced("local_search.search_page")
+def search_page(
+    local_index: LocalIndex,
+    pit_id: str,
+    query_string: str,
+    size: int = 20,
+    search_after: list | None = None,
+    sort_by: str = "relevance",
+    keep_alive: str = "5m",
+    specialties: list[str] | None = None,
+    filters: dict[str, list] | None = None,
+) -> dict:
+    """Fetches one page of results; same interface as
+    `query_index.search_page`.
+    Args:
+        local_index: Local index to search
+        pit_id: Id returned by `open_point_in_time`
+        query_string: Query to search for
+        size: Number of hits per page
+        search_after: Sort values of the last hit of the previous page
+        sort_by: Key of `query_index.SORT_OPTIONS` to order results by
+        keep_alive: Unused; kept for interface compatibility
+        specialties: Canonical specialty names to filter on instead
+        filters: Facet name to the values selected for it
+    Returns:
+        res: Elasticsearch shaped response
+    """
+    started = time.perf_counter()
+    doc_ids, scores, keys = _sorted_matches(
+        local_index, query_string, sort_by, specialties, filters
+    )
+    total = len(doc_ids)
+
+    if search_after is not None:
+        last_key, last_doc = search_after
+        if sort_by == "relevance":
+            last_key = -last_key
+        after = (keys > last_key) | ((keys == last_key) & (doc_ids > last_doc))
+        doc_ids, scores, keys = doc_ids[after], scores[after], keys[after]
+
+    doc_ids, scores, keys = doc_ids[:size], scores[:size], keys[:size]
+    if sort_by == "relevance":
+        keys = -keys
+    sort_values = [[k.item(), int(d)] for k, d in zip(keys, doc_ids)]
+
+    res = _response(
+        local_index,
+        pit_id,
+        doc_ids,
+        scores,
+        total=total,
+        started=started,
+        sort_values=sort_values,
+    )
+    res["pit_id"] = pit_id
+    return res
+
+
+def get_facet_counts(
+    local_index: LocalIndex, index_name: str
+) -> dict[str, list[list]]:
+    """Counts the documents per value of each facet over the whole index;
+    same output as `facets.get_facet_counts`.
+    Args:
+        local_index: Local index to count
+        index_name: Unused; kept for interface compatibility
+    Returns:
+        facet_counts: Facet name to `[value, count]` pairs
+    """
+    facet_counts = {facet: [] for facet in FACET_FIELDS}
+    for term, term_id in local_index.vocab.items():
+        facet, sep, value = term.partition("=")
+        if not sep or facet not in facet_counts:
+            continue
+        if facet == "qualification_year":
+            value = int(value)
+        count = int(
+            local_index.offsets[term_id + 1] - local_index.offsets[term_id]
+        )
+        facet_counts[facet].append([value, count])
+
+    for facet, counts in facet_counts.items():
+        if facet == "qualification_year":
+            counts.sort(key=lambda c: c[0], reverse=True)
+        else:
+            counts.sort(key=lambda c: c[1], reverse=True)
+    return facet_counts
+
+
+if __name__ == "__main__":
+    configure_logging()
+    json_filepaths = [
+        f
+        for f in os.listdir(DATA_DIR)
+        if f.endswith("_scraped_doctors_detail.json")
+    ]
+
+    docs = []
+    for jf in json_filepaths:
+        with open(DATA_DIR + jf) as raw_data:
+            docs.extend(json.load(raw_data))
+
+    logger.info(f"Building local index of {len(docs)} documents")
+    local_index = build_local_index(docs)
+    save_local_index(local_index, INDEX_PATH)
+    logger.info(f"Saved local index to {INDEX_PATH}")
+
+    # cache global facet counts so the app doesn't aggregate on page load
+    save_facet_counts(get_facet_counts(local_index, None), FACET_CACHE_PATH)
+    logger.info(f"Facet counts cached to {FACET_CACHE_PATH}")
@@ -0,0 +1,159 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+
+from .resources import get_config
+
+_lock = threading.Lock()
+_listener = None
+
+
+def truncate(text: str, max_chars: int) -> str:
+    """Cuts text to `max_chars`, noting how much was cut."""
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}... [{len(text) - max_chars} chars truncated]"
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one json object per line.
+
+    Messages are cut to `max_message_chars`, or `max_payload_chars` for
+    payloads logged with `log_payload`.
+    """
+
+    def __init__(self, max_message_chars: int, max_payload_chars: int):
+        super().__init__()
+        self.max_message_chars = max_message_chars
+        self.max_payload_chars = max_payload_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Returns the record as a json line."""
+        max_chars = (
+            self.max_payload_chars
+            if getattr(record, "payload", False)
+            else self.max_message_chars
+        )
+        entry = {
+            "time": datetime.fromtimestamp(
+                record.created, timezone.utc
+            ).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "function": record.funcName,
+            "line": record.lineno,
+            "process": record.process,
+            "thread": record.threadName,
+            "message": truncate(record.getMessage(), max_chars),
+        }
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread without blocking the caller.
+
+    Messages are formatted by the writer thread, so `%s` arguments such as
+    payloads are only turned into strings if they are written. Records
+    are dropped, and counted, when the queue is full rather than waiting.
+    Payload records are kept at `payload_sample_rate`.
+    """
+
+    def __init__(self, log_queue: queue.Queue, payload_sample_rate: float):
+        super().__init__(log_queue)
+        self.payload_sample_rate = payload_sample_rate
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Renders the traceback now, as it can't outlive the caller's
+        frame; everything else is left to the writer thread."""
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info
+            )
+            record.exc_info = None
+        return record
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Samples payload records; other records are always kept."""
+        if (
+            getattr(record, "payload", False)
+            and random.random() >= self.payload_sample_rate
+        ):
+            return False
+        return super().filter(record)
+
+    def enqueue(self, record: logging.LogRecord):
+        """Queues a record, dropping it if the writer has fallen behind."""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging():
+    """Sets up logging for the process, once; called by entry points.
+
+    Records go through a bounded queue to a background thread that writes
+    them as json lines to `logpath`, so logging never waits on disk. Levels
+    are set per logger from `logging.loggers` in `config.yaml`; module
+    loggers are named after their module, eg. "src.openai_query".
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        config_dict = get_config()
+        log_config = config_dict["logging"]
+
+        file_handler = logging.FileHandler(
+            config_dict["logpath"], encoding="utf-8"
+        )
+        file_handler.setFormatter(
+            JsonFormatter(
+                log_config["max_message_chars"],
+                log_config["payload"]["max_chars"],
+            )
+        )
+        queue_handler = NonBlockingQueueHandler(
+            queue.Queue(log_config["queue_size"]),
+            log_config["payload"]["sample_rate"],
+        )
+
+        root = logging.getLogger()
+        root.setLevel(log_config["level"])
+        root.addHandler(queue_handler)
+        for name, level in log_config["loggers"].items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = logging.handlers.QueueListener(
+            queue_handler.queue, file_handler
+        )
+        _listener.start()
+        # write what's queued before the process exits
+        atexit.register(_listener.stop)
+
+
+def log_payload(
+    logger: logging.Logger, message: str, payload, level: int = logging.DEBUG
+):
+    """Logs a large payload, eg. a search response or LLM completion.
+
+    Payloads are sampled at `logging.payload.sample_rate` and cut to
+    `logging.payload.max_chars`; they are only turned into a string by the
+    writer thread, and only if sampled.
+
+    Args:
+        logger (logging.Logger): Logger of the calling module.
+        message (str): What the payload is, eg. "OpenAI response".
+        payload: The payload.
+        level (int): Level to log at.
+    """
+    logger.log(level, "%s: %s", message, payload, extra={"payload": True})
@@ -1,46 +1,72 @@
 # Note: The openai-python library support for Azure OpenAI is in preview.
+import asyncio
+import logging
 import os
 import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncIterator
 
-import openai
-from dotenv import load_dotenv
-from openai.openai_object import OpenAIObject
+from .llm_cache import LLMCache, cache_key
+from .logs import configure_logging
+from .resources import get_config, get_openai
+from .tracing import set_attribute, traced
 
-# load environment variables
-load_dotenv()
+config_dict = get_config()
 
-openai.api_type = os.getenv("OPENAI_API_TYPE")
-openai.api_base = os.getenv("OPENAI_API_BASE")
-openai.api_version = os.getenv("OPENAI_API_VERSION")
-openai.api_key = os.getenv("OPENAI_API_KEY")
+logger = logging.getLogger(__name__)
 
 
+# completions are deterministic at temperature 0, so they are cached
+COMPLETION_PARAMS = {
+    "engine": "text-davinci-003",
+    "temperature": 0,
+    "max_tokens": 4000,
+    "top_p": 0.5,
+    "frequency_penalty": 0,
+    "presence_penalty": 0,
+    "best_of": 3,
+    "stop": None,
+}
+# `best_of` can't be used when streaming tokens
+STREAM_PARAMS = {k: v for k, v in COMPLETION_PARAMS.items() if k != "best_of"}
+LLM_CACHE = LLMCache(**config_dict["openai"]["cache"])
+
 MEDICAL_PROMPT = (
     "Suggest medical specialists for a patient to see based on "
     "their described symptoms in the format of {{specialist 1}},"
     " {{specialist 2}}, ..., {{specialist n}}.\nPatient:"
 )
+MEDICAL_PROMPT_DESC = "Explain very very simply what the specialist does:"
 
 
-def parse_response(response: OpenAIObject) -> str:
-    """Parse the response from OpenAI's API.
+def use_llm_cache(path: str):
+    """Replaces `LLM_CACHE` with an emptied cache at `path`, eg. so stubbed
+    completions stay out of the app's cache and the triage training data."""
+    global LLM_CACHE
+    if os.path.exists(path):
+        os.remove(path)
+    LLM_CACHE = LLMCache(
+        path=path,
+        **{
+            k: v
+            for k, v in config_dict["openai"]["cache"].items()
+            if k != "path"
+        },
+    )
 
-    Args:
-        response (OpenAIObject): The response object from OpenAI's API.
 
-    Returns:
-        str: The text of the first choice in the response, or None if there are no choices.
-    """
-    choices = response["choices"]
-    if not choices:
-        return None
-    choice = choices[0]
-    return choice["text"]
+def parse_specialists(response: str) -> list[str]:
+    """Extracts the `{{specialist}}` names from a response to
+    `MEDICAL_PROMPT`."""
+    return re.findall(r"{{(.*?)}}", response)
 
 
 def strip_string(string):
     """Strip newlines from the start and end of a string."""
-    if string[0] == "\n":
+    if not string:
+        return string
+    elif string[0] == "\n":
         return strip_string(string[1:])
     elif string[-1] == "\n":
         return strip_string(string[:-1])
@@ -48,23 +74,191 @@ def strip_string(string):
         return string
 
 
+class CompletionCoalescer:
+    """Coalesces completion requests across threads and sessions.
+
+    Identical prompts in flight share one request (single-flight), and
+    distinct prompts submitted within `window_ms` of each other are sent as
+    one multi-prompt `Completion.create` call of up to `max_batch` prompts,
+    whose choices are fanned back out to each caller. Completions are added
+    to `LLM_CACHE` before callers are woken.
+
+    Batches are sent from a pool of `senders` threads, so submitting never
+    blocks (eg. an event loop) and each sender reuses `openai`'s per-thread
+    HTTP session across batches.
+    """
+
+    def __init__(
+        self, params: dict, window_ms: int, max_batch: int, senders: int
+    ):
+        self.params = params
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self._executor = ThreadPoolExecutor(
+            max_workers=senders, thread_name_prefix="completions"
+        )
+        self._lock = threading.Lock()
+        self._in_flight = {}  # cache key -> Future
+        self._pending = []  # (cache key, prompt, Future)
+        self._timer = None
+        self._stats = {"requests": 0, "coalesced": 0, "api_calls": 0}
+
+    def submit(self, prompt: str) -> Future:
+        """Queues a prompt for completion.
+
+        Args:
+            prompt (str): The prompt to complete.
+
+        Returns:
+            Future: Resolves to the stripped completion text.
+        """
+        key = cache_key(prompt, self.params)
+        with self._lock:
+            self._stats["requests"] += 1
+            if key in self._in_flight:
+                self._stats["coalesced"] += 1
+                return self._in_flight[key]
+
+            future = Future()
+            self._in_flight[key] = future
+            self._pending.append((key, prompt, future))
+            if len(self._pending) >= self.max_batch:
+                batch = self._take_pending()
+            else:
+                batch = None
+                if self._timer is None:
+                    self._timer = threading.Timer(
+                        self.window_ms / 1000, self._flush
+                    )
+                    self._timer.daemon = True
+                    self._timer.start()
+
+        # a full batch is sent straight away
+        if batch:
+            self._executor.submit(self._complete, batch)
+        return future
+
+    def _take_pending(self) -> list[tuple[str, str, Future]]:
+        """Takes the pending batch and cancels its timer; call with the lock
+        held."""
+        batch, self._pending = self._pending, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _flush(self):
+        """Sends whatever is pending when the batching window closes."""
+        with self._lock:
+            batch = self._take_pending()
+        if batch:
+            self._executor.submit(self._complete, batch)
+
+    def _complete(self, batch: list[tuple[str, str, Future]]):
+        """Completes a batch of prompts in one API call and resolves their
+        futures."""
+        try:
+            with self._lock:
+                self._stats["api_calls"] += 1
+            response = get_openai().Completion.create(
+                prompt=[prompt for _, prompt, _ in batch], **self.params
+            )
+            # with one completion per prompt, choice `index` is the prompt's
+            texts = [None] * len(batch)
+            for choice in response["choices"]:
+                texts[choice["index"]] = strip_string(choice["text"])
+
+            for (key, prompt, future), text in zip(batch, texts):
+                if text is not None:
+                    LLM_CACHE.set(key, text, prompt)
+                    future.set_result(text)
+                else:
+                    future.set_exception(
+                        KeyError("No choice returned for prompt!")
+                    )
+        except Exception as e:
+            logger.error(f"Completion of {len(batch)} prompts failed: {e}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            with self._lock:
+                for key, _, _ in batch:
+                    self._in_flight.pop(key, None)
+
+    def stats(self) -> dict:
+        """Returns request, coalesced request and API call counts."""
+        with self._lock:
+            return dict(self._stats)
+
+
+COALESCER = CompletionCoalescer(
+    COMPLETION_PARAMS, **config_dict["openai"]["coalesce"]
+)
+
+
+@traced()
 def call_openai(prompt: str) -> str:
-    """Summarise the text using OpenAI's API."""
-    response = openai.Completion.create(
-        engine="text-davinci-003",
-        prompt=prompt,
-        temperature=0,
-        max_tokens=4000,
-        top_p=0.5,
-        frequency_penalty=0,
-        presence_penalty=0,
-        best_of=3,
-        stop=None,
-    )
-    return strip_string(parse_response(response))
+    """Summarise the text using OpenAI's API.
+
+    Responses are served from `LLM_CACHE` when the same prompt has been
+    completed with the same parameters before; otherwise the request goes
+    through `COALESCER`, which shares it with identical or concurrent ones.
+    """
+    key = cache_key(prompt, COMPLETION_PARAMS)
+    cached = LLM_CACHE.get(key)
+    set_attribute("cache_hit", cached is not None)
+    if cached is not None:
+        logger.debug(f"LLM cache hit: {LLM_CACHE.stats()}")
+        return cached
+    return COALESCER.submit(prompt).result()
+
+
+@traced()
+async def acall_openai(prompt: str) -> str:
+    """Async version of `call_openai`, sharing its cache and coalescer."""
+    key = cache_key(prompt, COMPLETION_PARAMS)
+    cached = LLM_CACHE.get(key)
+    set_attribute("cache_hit", cached is not None)
+    if cached is not None:
+        return cached
+    # cancelling this caller mustn't cancel a completion others may share
+    return await asyncio.shield(asyncio.wrap_future(COALESCER.submit(prompt)))
+
+
+async def astream_openai(prompt: str) -> AsyncIterator[str]:
+    """Streams the completion of a prompt, yielding text as it arrives.
+
+    Streaming doesn't support `best_of`, so completions are made with
+    `STREAM_PARAMS` and cached separately from `call_openai`'s. A cached
+    completion is yielded in one piece.
+
+    Args:
+        prompt (str): The prompt to complete.
+
+    Yields:
+        str: The next piece of the completion.
+    """
+    key = cache_key(prompt, STREAM_PARAMS)
+    cached = LLM_CACHE.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    pieces = []
+    async for chunk in await get_openai().Completion.acreate(
+        prompt=prompt, stream=True, **STREAM_PARAMS
+    ):
+        if not chunk["choices"]:
+            continue
+        piece = chunk["choices"][0]["text"]
+        pieces.append(piece)
+        yield piece
+    LLM_CACHE.set(key, strip_string("".join(pieces)), prompt)
 
 
 if __name__ == "__main__":
+    configure_logging()
     # create a prompt for the user to enter their medical problem
     medical_problem = input("Enter your medical problem: ")
     prompt = MEDICAL_PROMPT + medical_problem
@@ -76,5 +270,5 @@ if __name__ == "__main__":
     print(response)
 
     # extract the specialist names from the response
-    medical_specialists = values = re.findall(r"{{(.*?)}}", response)
+    medical_specialists = parse_specialists(response)
     print(medical_specialists)
@@ -0,0 +1,692 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field, replace
+from typing import Callable
+
+from elasticsearch import Elasticsearch, helpers
+from prefect import flow, task
+from prefect.task_runners import ConcurrentTaskRunner
+
+from . import render, specialty_resolver
+from .elastic_search import enrich, query_index
+from .elastic_search.create_index import INDEX_SETTINGS
+from .elastic_search.enrich import enrich_document
+from .elastic_search.facets import precompute_facet_counts, save_facet_counts
+from .elastic_search.snapshot import file_sha256
+from .elastic_search.utils import create_elasticsearch_client
+from .local_search import local_index
+from .local_search.local_index import (
+    build_local_index,
+    get_facet_counts,
+    save_local_index,
+)
+from .logs import configure_logging
+from .resources import get_config, get_index_name
+from .scrape import doctor_detail, doctor_overview
+from .scrape.reconcile import (
+    load_refetch_queue,
+    reconcile,
+    refetch_queue,
+    save_reconciliation,
+)
+from .scrape.util import load_pages
+from .specialist_descriptions import (
+    build_description_table,
+    save_description_table,
+    table_version,
+)
+from .specialty_resolver import (
+    build_specialty_resolver,
+    save_specialty_resolver,
+    specialty_names,
+)
+
+config_dict = get_config()
+
+PIPELINE_CONFIG = config_dict["pipeline"]
+PIPELINE_PATH = PIPELINE_CONFIG["path"]
+MANIFEST_PATH = os.path.join(PIPELINE_PATH, "manifest.json")
+RUNS_PATH = os.path.join(PIPELINE_PATH, "runs")
+# stages whose outputs are content addressed files under `PIPELINE_PATH`
+DATA_STAGES = ["scrape_overview", "scrape_detail"]
+
+logger = logging.getLogger(__name__)
+
+# every stage retries on its own; finished stages are kept in the manifest
+stage_task = task(
+    retries=PIPELINE_CONFIG["retries"],
+    retry_delay_seconds=PIPELINE_CONFIG["retry_delay_s"],
+)
+
+
+def content_hash(*parts) -> str:
+    """Returns the hex sha256 of json serialisable parts."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def path_sha256(path: str) -> str:
+    """Returns the hex sha256 of a file, or of the files in a directory."""
+    if not os.path.isdir(path):
+        return file_sha256(path)
+    return content_hash(
+        {
+            name: file_sha256(os.path.join(path, name))
+            for name in sorted(os.listdir(path))
+        }
+    )
+
+
+def source_hash(*modules) -> str:
+    """Returns the hex sha256 of the modules' source files, so a stage is
+    rebuilt when the code building its output changes, eg. formatting."""
+    return content_hash([file_sha256(module.__file__) for module in modules])
+
+
+@dataclass
+class StageResult:
+    """Outcome of a pipeline stage.
+
+    Attributes:
+        stage: Name of the stage.
+        input_hash: Hash of everything the output was built from; the stage
+            is skipped when it matches the last successful run's.
+        output_path: Where the output was written, or the index name.
+        output_hash: Hash of the output's content.
+        records: Number of records in the output.
+        inputs: Input name to the output path of the stage it came from.
+        params: Name to hash of the code and settings the output was built
+            with, eg. to rebuild all of it when they change.
+        skipped: Whether the output of a previous run was reused.
+        duration_s: Time the stage took in this run.
+    """
+
+    stage: str
+    input_hash: str
+    output_path: str
+    output_hash: str
+    records: int
+    inputs: dict[str, str] = field(default_factory=dict)
+    params: dict[str, str] = field(default_factory=dict)
+    skipped: bool = False
+    duration_s: float = 0.0
+
+
+class Manifest:
+    """The last successful result of each stage, saved as each stage
+    finishes so a failed or interrupted run resumes where it stopped."""
+
+    def __init__(self, path: str = MANIFEST_PATH, ignore_previous=False):
+        self.path = path
+        self._lock = threading.Lock()
+        self.stages = {}
+        if os.path.exists(path) and not ignore_previous:
+            with open(path, encoding="utf-8") as f:
+                self.stages = {
+                    stage: StageResult(**result)
+                    for stage, result in json.load(f)["stages"].items()
+                }
+
+    def get(self, stage: str) -> StageResult | None:
+        """Returns the last successful result of a stage, if any."""
+        with self._lock:
+            return self.stages.get(stage)
+
+    def record(self, result: StageResult):
+        """Records a stage's result and saves the manifest."""
+        with self._lock:
+            self.stages[result.stage] = result
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "stages": {
+                            stage: asdict(result)
+                            for stage, result in self.stages.items()
+                        }
+                    },
+                    f,
+                    indent=2,
+                )
+            os.replace(tmp_path, self.path)
+
+    def prune(self):
+        """Deletes stage outputs no stage in the manifest refers to."""
+        with self._lock:
+            referenced = {
+                os.path.abspath(path)
+                for result in self.stages.values()
+                for path in [result.output_path, *result.inputs.values()]
+            }
+        for stage in DATA_STAGES:
+            stage_dir = os.path.join(PIPELINE_PATH, stage)
+            if not os.path.isdir(stage_dir):
+                continue
+            for name in os.listdir(stage_dir):
+                path = os.path.join(stage_dir, name)
+                if os.path.abspath(path) not in referenced:
+                    os.remove(path)
+
+
+def run_stage(
+    manifest: Manifest,
+    stage: str,
+    input_hash: str,
+    build: Callable[[StageResult | None], tuple[str, str, int]],
+    inputs: dict[str, str] | None = None,
+    output_exists: Callable[[str], bool] = os.path.exists,
+    force: bool = False,
+    params: dict[str, str] | None = None,
+) -> StageResult:
+    """Runs a stage unless its inputs are unchanged since it last succeeded
+    and its output is still there.
+
+    Args:
+        manifest (Manifest): Results of previous runs.
+        stage (str): Name of the stage.
+        input_hash (str): Hash of the stage's inputs and parameters.
+        build (Callable): Builds the output given the stage's previous
+            result, eg. to only redo what changed; returns the output path,
+            output hash and number of records.
+        inputs (dict[str, str] | None): Input name to its path.
+        output_exists (Callable[[str], bool]): Whether an output is present.
+        force (bool): Run the stage even if its inputs are unchanged, eg.
+            when its input is a website.
+        params (dict[str, str] | None): Name to hash of the code and
+            settings the stage builds with, recorded for the next run.
+
+    Returns:
+        StageResult: Result of the stage, or of the run it was reused from.
+    """
+    previous = manifest.get(stage)
+    if (
+        not force
+        and previous is not None
+        and previous.input_hash == input_hash
+        and output_exists(previous.output_path)
+    ):
+        logger.info(f"Skipping {stage}, its inputs are unchanged")
+        return replace(previous, skipped=True, duration_s=0.0)
+
+    started = time.perf_counter()
+    output_path, output_hash, records = build(previous)
+    result = StageResult(
+        stage=stage,
+        input_hash=input_hash,
+        output_path=output_path,
+        output_hash=output_hash,
+        records=records,
+        inputs=inputs or {},
+        params=params or {},
+        duration_s=time.perf_counter() - started,
+    )
+    manifest.record(result)
+    logger.info(
+        f"Finished {stage}: {records} records in {result.duration_s:.1f}s"
+    )
+    return result
+
+
+def write_records(stage: str, records: list[dict]) -> tuple[str, str, int]:
+    """Writes records to a file named by their content hash, so unchanged
+    records map to the same file.
+
+    Returns:
+        tuple[str, str, int]: Path, sha256 and number of records.
+    """
+    body = json.dumps(records, ensure_ascii=False, sort_keys=True).encode()
+    sha = hashlib.sha256(body).hexdigest()
+    path = os.path.join(PIPELINE_PATH, stage, f"{sha[:16]}.json")
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(body)
+        os.replace(f"{path}.tmp", path)
+    return path, sha, len(records)
+
+
+def read_records(path: str) -> list[dict]:
+    """Reads records written by `write_records`."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def scrape_pages(
+    urls: list[str], parsing_fn, require_all: bool = False
+) -> list[dict]:
+    """Fetches and parses pages with the scrapers, as dicts.
+
+    Args:
+        urls (list[str]): Pages to scrape.
+        parsing_fn: Parses a page into records.
+        require_all (bool): Raise if any page failed to load, rather than
+            leaving its records out.
+
+    Returns:
+        list[dict]: Records of the pages that loaded.
+    """
+    parsed = 0
+
+    async def count_pages(page):
+        nonlocal parsed
+        parsed += 1
+        return await parsing_fn(page)
+
+    records = [
+        asdict(practitioner)
+        for practitioner in asyncio.run(load_pages(urls, count_pages))
+    ]
+    if require_all and parsed < len(urls):
+        raise RuntimeError(f"{len(urls) - parsed} of {len(urls)} pages failed")
+    return records
+
+
+def is_complete(records: int, previous_records: int) -> bool:
+    """Whether a register of `records` doctors is complete, ie. didn't
+    shrink past `pipeline.min_register_ratio` of the previous run's."""
+    return records >= previous_records * PIPELINE_CONFIG["min_register_ratio"]
+
+
+@stage_task
+def scrape_overview(manifest: Manifest) -> StageResult:
+    """Scrapes the register's overview pages.
+
+    The register can only be known by fetching it, so this stage always
+    runs; stages after it are skipped if its output is unchanged. It fails
+    if a page failed to load or the register shrank past
+    `pipeline.min_register_ratio`, rather than dropping doctors from the
+    stages after it.
+    """
+
+    def build(previous):
+        urls = [
+            doctor_overview.DOCTORS_PAGE_FN(page_num)
+            for page_num in range(doctor_overview.NUM_PAGES + 1)
+        ]
+        records = scrape_pages(
+            urls, doctor_overview.parse_registered_doctors_page, True
+        )
+        if previous is not None and not is_complete(
+            len(records), previous.records
+        ):
+            raise RuntimeError(
+                f"Overview has {len(records)} doctors, down from "
+                f"{previous.records}"
+            )
+        return write_records("scrape_overview", records)
+
+    return run_stage(
+        manifest,
+        "scrape_overview",
+        content_hash(doctor_overview.DOCTORS_PAGE_FN("{page}")),
+        build,
+        force=True,
+    )
+
+
+@stage_task
+def scrape_detail(manifest: Manifest, overview: StageResult) -> StageResult:
+    """Scrapes the detail page of every registered doctor.
+
+    Only doctors whose overview entry is new or changed since the last run,
+    or whose details were missing or didn't match the overview, are
+    fetched; the others keep their previous details, and doctors no longer
+    registered are dropped. The result is reconciled against the overview,
+    see `reconcile.py`, and the stage runs again while the reconciliation
+    queues pages to refetch, even if the overview is unchanged.
+    """
+
+    def build(previous):
+        overview_records = {
+            r["registration_no"]: r for r in read_records(overview.output_path)
+        }
+        previous_overview, previous_detail = {}, {}
+        if previous is not None and all(
+            os.path.exists(p)
+            for p in [previous.output_path, previous.inputs["overview"]]
+        ):
+            previous_overview = {
+                r["registration_no"]: r
+                for r in read_records(previous.inputs["overview"])
+            }
+            previous_detail = {
+                d["registration_no"]: d
+                for d in read_records(previous.output_path)
+            }
+
+        # details that are missing or don't match the overview are fetched
+        # again, as are those of doctors whose overview entry changed
+        unmatched = set(
+            refetch_queue(
+                reconcile(
+                    list(overview_records.values()),
+                    list(previous_detail.values()),
+                )
+            )
+        )
+        to_fetch = [
+            no
+            for no, record in overview_records.items()
+            if no in unmatched or previous_overview.get(no) != record
+        ]
+        logger.info(
+            f"Fetching details of {len(to_fetch)} of "
+            f"{len(overview_records)} doctors"
+        )
+        fetched = {}
+        for i in range(0, len(to_fetch), doctor_detail.BATCH_SIZE):
+            urls = [
+                doctor_detail.DOCTORS_PAGE_FN(no)
+                for no in to_fetch[i : i + doctor_detail.BATCH_SIZE]
+            ]
+            for doc in scrape_pages(
+                urls, doctor_detail.parse_detailed_doctors_page
+            ):
+                fetched[doc["registration_no"]] = doc
+
+        details = [
+            fetched.get(no, previous_detail.get(no))
+            for no in sorted(overview_records)
+        ]
+        details = [d for d in details if d is not None]
+        # queues pages that failed to load, which forces this stage next run
+        save_reconciliation(
+            reconcile(list(overview_records.values()), details)
+        )
+        return write_records("scrape_detail", details)
+
+    return run_stage(
+        manifest,
+        "scrape_detail",
+        overview.output_hash,
+        build,
+        inputs={"overview": overview.output_path},
+        force=bool(load_refetch_queue()),
+    )
+
+
+@stage_task
+def build_local_search_index(
+    manifest: Manifest, detail: StageResult
+) -> StageResult:
+    """Builds the in-process search index from the details."""
+    index_path = config_dict["local_search"]["index_path"]
+
+    def build(previous):
+        index = build_local_index(read_records(detail.output_path))
+        save_local_index(index, index_path)
+        if config_dict["search"]["backend"] == "local":
+            save_facet_counts(
+                get_facet_counts(index, None),
+                config_dict["facets"]["cache_path"],
+            )
+        return index_path, path_sha256(index_path), index.num_docs
+
+    return run_stage(
+        manifest,
+        "build_local_index",
+        content_hash(
+            detail.output_hash,
+            source_hash(local_index, enrich, render, query_index),
+        ),
+        build,
+        inputs={"detail": detail.output_path},
+    )
+
+
+@stage_task
+def build_resolver(manifest: Manifest, detail: StageResult) -> StageResult:
+    """Builds the specialty resolver from the register's specialties; a
+    change of details that doesn't change the specialties skips it."""
+    specialties = specialty_names(read_records(detail.output_path))
+    resolver_path = config_dict["specialty_resolver"]["path"]
+
+    def build(previous):
+        save_specialty_resolver(
+            build_specialty_resolver(specialties), resolver_path
+        )
+        return resolver_path, path_sha256(resolver_path), len(specialties)
+
+    return run_stage(
+        manifest,
+        "build_specialty_resolver",
+        content_hash(
+            specialties,
+            source_hash(specialty_resolver),
+            config_dict["specialty_resolver"],
+        ),
+        build,
+        inputs={"detail": detail.output_path},
+    )
+
+
+@stage_task
+def build_descriptions(manifest: Manifest, detail: StageResult) -> StageResult:
+    """Describes every specialty with the LLM, when the specialties, prompt
+    or completion parameters changed."""
+    specialties = specialty_names(read_records(detail.output_path))
+    table_path = config_dict["specialist_descriptions"]["path"]
+
+    def build(previous):
+        save_description_table(build_description_table(specialties))
+        return table_path, path_sha256(table_path), len(specialties)
+
+    return run_stage(
+        manifest,
+        "build_specialist_descriptions",
+        table_version(specialties),
+        build,
+        inputs={"detail": detail.output_path},
+    )
+
+
+def create_client() -> Elasticsearch:
+    """Creates an Elasticsearch client from the config and environment."""
+    return create_elasticsearch_client(
+        host=config_dict["elasticsearch"]["host_path"],
+        certs_path=config_dict["elasticsearch"]["certs_path"],
+        username=os.getenv("ELASTIC_USERNAME"),
+        password=os.getenv("ELASTIC_PASSWORD"),
+    )
+
+
+@stage_task
+def index_elasticsearch(
+    manifest: Manifest, detail: StageResult
+) -> StageResult:
+    """Brings the Elasticsearch index in line with the details.
+
+    Documents are keyed by registration number. After a first full load,
+    only documents that changed since the last indexed details are indexed,
+    and those of doctors no longer registered deleted. Every document is
+    indexed again if the code building them changed, and the index is
+    recreated if its settings changed. It fails without changing the index
+    if the details shrank past `pipeline.min_register_ratio`.
+    """
+    es_client = create_client()
+    index_name = get_index_name()
+    params = {
+        "settings": content_hash(INDEX_SETTINGS),
+        "code": source_hash(enrich, render),
+    }
+
+    def build(previous):
+        docs = {
+            d["registration_no"]: d for d in read_records(detail.output_path)
+        }
+        previous_docs = {}
+        if (
+            previous is not None
+            and previous.params.get("settings") == params["settings"]
+            and os.path.exists(previous.inputs["detail"])
+            and es_client.indices.exists(index=index_name)
+        ):
+            previous_docs = {
+                d["registration_no"]: d
+                for d in read_records(previous.inputs["detail"])
+            }
+        else:
+            # documents indexed by `populate_index` aren't keyed, and a
+            # mapping can't be changed in place, so start from an empty index
+            if es_client.indices.exists(index=index_name):
+                es_client.indices.delete(index=index_name)
+            es_client.indices.create(index=index_name, **INDEX_SETTINGS)
+
+        deleted = previous_docs.keys() - docs.keys()
+        if not is_complete(len(docs), len(previous_docs)):
+            # a partial scrape; fail before deleting anything, so the next
+            # run still diffs against the complete details indexed last
+            raise RuntimeError(
+                f"Not deleting {len(deleted)} documents, the details have "
+                f"{len(docs)} of {len(previous_docs)} doctors"
+            )
+        # documents formatted by other code are stale, whether or not
+        # their details changed
+        reindex = (
+            previous is None or previous.params.get("code") != params["code"]
+        )
+        actions = [
+            {"_index": index_name, "_id": no, "_source": enrich_document(doc)}
+            for no, doc in docs.items()
+            if reindex or previous_docs.get(no) != doc
+        ] + [
+            {"_op_type": "delete", "_index": index_name, "_id": no}
+            for no in deleted
+        ]
+        logger.info(f"Sending {len(actions)} changes to {index_name}")
+        for ok, item in helpers.parallel_bulk(
+            es_client,
+            actions,
+            thread_count=config_dict["snapshot"]["bulk_threads"],
+            chunk_size=1000,
+            raise_on_error=False,
+        ):
+            if not ok and item.get("delete", {}).get("status") != 404:
+                raise RuntimeError(f"Failed to index document: {item}")
+
+        es_client.indices.refresh(index=index_name)
+        count = int(
+            es_client.cat.count(index=index_name, format="json")[0]["count"]
+        )
+        if count != len(docs):
+            raise RuntimeError(f"Indexed {count} of {len(docs)} documents!")
+        if config_dict["search"]["backend"] == "elasticsearch":
+            precompute_facet_counts(
+                es_client, index_name, config_dict["facets"]["cache_path"]
+            )
+        return index_name, content_hash(detail.output_hash, count), count
+
+    return run_stage(
+        manifest,
+        "index_elasticsearch",
+        content_hash(detail.output_hash, params),
+        build,
+        inputs={"detail": detail.output_path},
+        output_exists=lambda name: es_client.indices.exists(index=name),
+        params=params,
+    )
+
+
+def save_run(results: list[StageResult], started: float) -> str:
+    """Saves the stages' durations and record counts of a run.
+
+    Returns:
+        str: Path of the run record.
+    """
+    run_id = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(started))
+    path = os.path.join(RUNS_PATH, f"{run_id}.json")
+    os.makedirs(RUNS_PATH, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "run_id": run_id,
+                "duration_s": time.time() - started,
+                "stages": [asdict(result) for result in results],
+            },
+            f,
+            indent=2,
+        )
+    return path
+
+
+def format_run(results: list[StageResult]) -> str:
+    """Formats the stages of a run as a table."""
+    lines = [f"{'stage':<32}{'status':>8}{'records':>10}{'seconds':>10}"]
+    for result in results:
+        status = "skipped" if result.skipped else "ran"
+        lines.append(
+            f"{result.stage:<32}{status:>8}{result.records:>10}"
+            f"{result.duration_s:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+@flow(name="refresh-register", task_runner=ConcurrentTaskRunner())
+def refresh_register(
+    full_refresh: bool = False,
+    elasticsearch: bool = PIPELINE_CONFIG["elasticsearch"],
+) -> list[StageResult]:
+    """Refreshes the register from scrape to search indexes.
+
+    The overview is scraped, then the details of changed doctors. The
+    local index, specialty resolver, specialist descriptions and
+    Elasticsearch index are built from the details in parallel, each
+    skipped if what it is built from hasn't changed.
+
+    Args:
+        full_refresh (bool): Redo every stage, ignoring previous runs.
+        elasticsearch (bool): Also update the Elasticsearch index.
+
+    Returns:
+        list[StageResult]: Result of each stage.
+    """
+    configure_logging()
+    started = time.time()
+    manifest = Manifest(ignore_previous=full_refresh)
+
+    overview = scrape_overview(manifest)
+    detail = scrape_detail(manifest, overview)
+    builds = [
+        build_local_search_index.submit(manifest, detail),
+        build_resolver.submit(manifest, detail),
+        build_descriptions.submit(manifest, detail),
+    ]
+    if elasticsearch:
+        builds.append(index_elasticsearch.submit(manifest, detail))
+
+    results = [overview, detail] + [build.result() for build in builds]
+    manifest.prune()
+    logger.info(f"Saved run to {save_run(results, started)}")
+    return results
+
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(
+        description="Refresh the register from scrape to search indexes."
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="redo every stage instead of only what changed",
+    )
+    parser.add_argument(
+        "--no-elasticsearch",
+        action="store_true",
+        help="only build the local index, resolver and descriptions",
+    )
+    args = parser.parse_args()
+
+    results = refresh_register(
+        full_refresh=args.full,
+        elasticsearch=PIPELINE_CONFIG["elasticsearch"]
+        and not args.no_elasticsearch,
+    )
+    print(format_run(results))
@@ -0,0 +1,65 @@
+def format_hit(hit: dict) -> list[str]:
+    """Formats the details of a doctor from the register as markdown lines,
+    without Streamlit so the formatting can be benchmarked and reused.
+
+    Args:
+        hit (dict): The `_source` of a search hit.
+
+    Returns:
+        list[str]: Markdown lines of the doctor's details.
+    """
+    lines = [
+        f"**Name:** {hit['name']}, Registration No: {hit['registration_no']}",
+        f"**Address:** {hit['address']}",
+        "**Qualifications:**",
+    ]
+    for qual in hit["qualifications"]:
+        lines.append(
+            f"{qual['nature']['text']} ({qual['tag']}) - {qual['year']}"
+        )
+
+    if hit["specialty_registration_no"]:
+        lines.append(
+            f"**Specialty Name:** {hit['specialty_name']}, Registration No: {hit['specialty_registration_no']}"
+        )
+        lines.append("**Specialty Qualifications:**")
+        if hit["speciality_qualification"]:
+            qual = hit["speciality_qualification"]
+            lines.append(
+                f"{qual['nature']['text']}:({qual['tag']}) - {qual['year']}"
+            )
+    return lines
+
+
+def hit_markdown(hit: dict) -> str:
+    """Formats the details of a doctor as one markdown block, with a
+    paragraph per line of `format_hit`.
+
+    Built once per document at index time, see `enrich_document`, and
+    stored as `display_markdown`.
+
+    Args:
+        hit (dict): The `_source` of a search hit.
+
+    Returns:
+        str: Markdown of the doctor's details.
+    """
+    return "\n\n".join(format_hit(hit))
+
+
+def page_markdown(hits: list[dict]) -> str:
+    """Joins the details of a page of doctors into one markdown block, so the
+    app renders a page with a single element however many hits and
+    qualifications it has.
+
+    Args:
+        hits (list[dict]): The `_source` of each search hit. Documents
+            indexed before `display_markdown` was added are formatted here.
+
+    Returns:
+        str: Markdown of the page, each doctor followed by a rule.
+    """
+    return "".join(
+        f"{hit.get('display_markdown') or hit_markdown(hit)}\n\n---\n\n"
+        for hit in hits
+    )
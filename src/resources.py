@@ -0,0 +1,208 @@
+import functools
+import logging
+import os
+import threading
+import time
+
+import yaml
+from dotenv import load_dotenv
+
+CONFIG_PATH = "./config.yaml"
+
+logger = logging.getLogger(__name__)
+
+
+# Shared resources, created on first use and then once per process. Streamlit
+# reruns `app.py` on every interaction but imports `src` modules only once, so
+# these survive reruns; heavy modules are imported by the getters that need
+# them rather than at import time.
+
+
+def once(f):
+    """Caches the result of a function without arguments for the process.
+
+    Unlike a bare `lru_cache`, concurrent first calls, eg. from a Streamlit
+    session and the health check, wait for one call instead of each creating
+    the resource.
+    """
+    cached = functools.lru_cache(maxsize=None)(f)
+    lock = threading.Lock()
+
+    @functools.wraps(f)
+    def wrapper():
+        with lock:
+            return cached()
+
+    wrapper.cache_clear = cached.cache_clear
+    return wrapper
+
+
+@once
+def get_config() -> dict:
+    """Reads `config.yaml` and loads the environment variables in `.env`."""
+    load_dotenv()
+    with open(CONFIG_PATH) as f:
+        return yaml.safe_load(f)
+
+
+def get_index_name() -> str | None:
+    """Returns the name of the doctors index from the environment."""
+    get_config()
+    return os.getenv("ELASTIC_INDEXNAME")
+
+
+@once
+def get_openai():
+    """Imports the `openai` module and sets its Azure globals from the
+    environment; the only place they are set."""
+    get_config()
+    import openai
+
+    openai.api_type = os.getenv("OPENAI_API_TYPE")
+    openai.api_base = os.getenv("OPENAI_API_BASE")
+    openai.api_version = os.getenv("OPENAI_API_VERSION")
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+    return openai
+
+
+@once
+def get_search_backend():
+    """Returns the search backend module set in `search.backend`; both
+    backends expose the `query_index` api."""
+    if get_config()["search"]["backend"] == "local":
+        from src.local_search import local_index
+
+        return local_index
+
+    from src.elastic_search import query_index
+
+    return query_index
+
+
+@once
+def get_search_client():
+    """Returns the client of the search backend.
+
+    The Elasticsearch client is created without a round trip to the cluster;
+    `start_health_check` checks it in the background instead.
+    """
+    config = get_config()
+    if config["search"]["backend"] == "local":
+        logger.info("Loading local search index")
+        return get_search_backend().load_local_index(
+            config["local_search"]["index_path"]
+        )
+
+    from src.elastic_search.utils import create_elasticsearch_client
+
+    logger.info("Creating elasticsearch client")
+    return create_elasticsearch_client(
+        host=config["elasticsearch"]["host_path"],
+        certs_path=config["elasticsearch"]["certs_path"],
+        username=os.getenv("ELASTIC_USERNAME"),
+        password=os.getenv("ELASTIC_PASSWORD"),
+        verify=False,
+        connections_per_node=config["elasticsearch"]["connections_per_node"],
+    )
+
+
+@once
+def get_specialty_resolver():
+    """Returns the specialty resolver, or None if it is not built."""
+    from src.specialty_resolver import RESOLVER_PATH, load_specialty_resolver
+
+    if not os.path.exists(RESOLVER_PATH):
+        return None
+    return load_specialty_resolver()
+
+
+@once
+def get_triage_model():
+    """Returns the local triage model, or None if it is not trained."""
+    from src.triage import MODEL_PATH, load_triage_model
+
+    if not os.path.exists(MODEL_PATH):
+        return None
+    return load_triage_model()
+
+
+@once
+def get_specialist_descriptions() -> dict[str, str]:
+    """Returns the precomputed specialist descriptions."""
+    from src.specialist_descriptions import load_description_table
+
+    return load_description_table()
+
+
+class HealthCheck:
+    """Result of the background startup checks, see `start_health_check`."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+        self.finished_at = None
+
+    @property
+    def healthy(self) -> bool | None:
+        """Whether the checks passed, or None while they are running."""
+        if not self.done.is_set():
+            return None
+        return self.error is None
+
+
+def _run_health_check(health: HealthCheck):
+    """Checks the search backend is reachable and the index exists, and
+    warms up the resources a first query needs."""
+    from src.tracing import span
+
+    try:
+        with span("health_check"):
+            get_openai()
+            get_specialty_resolver()
+            get_triage_model()
+            get_specialist_descriptions()
+
+            client = get_search_client()
+            if get_config()["search"]["backend"] == "elasticsearch":
+                assert client.info() is not None, "Elasticsearch info is None!"
+                index_name = get_index_name()
+                assert client.indices.exists(
+                    index=index_name
+                ), f"{index_name} Index does not exist!"
+                with span("elasticsearch.refresh"):
+                    client.indices.refresh(index=index_name)
+        logger.info("Health check passed")
+    except Exception as e:
+        logger.error(f"Health check failed: {e}")
+        health.error = e
+    finally:
+        health.finished_at = time.monotonic()
+        health.done.set()
+
+
+_health = None
+_health_lock = threading.Lock()
+
+
+def start_health_check() -> HealthCheck:
+    """Starts the health check in a background thread on first use.
+
+    Unlike the resources, a failed check isn't kept; it runs again on the
+    next call after `search.health_check_retry_s`, eg. once Elasticsearch
+    is up.
+
+    Returns:
+        HealthCheck: Set once the checks have run.
+    """
+    global _health
+    with _health_lock:
+        if _health is None or (
+            _health.healthy is False
+            and time.monotonic() - _health.finished_at
+            >= get_config()["search"]["health_check_retry_s"]
+        ):
+            _health = HealthCheck()
+            threading.Thread(
+                target=_run_health_check, args=(_health,), daemon=True
+            ).start()
+        return _health
@@ -1,14 +1,19 @@
+import argparse
 import asyncio
 import json
 import logging
 import os
+from dataclasses import asdict
 from typing import IO
 
 import yaml
 from bs4 import BeautifulSoup
-from dr_dataclass import Practitioner, Qualification
-from tqdm.asyncio import tqdm
-from util import load_pages, save_dataclass_list_to_json
+
+from ..logs import configure_logging
+from ..tracing import traced
+from .dr_dataclass import Practitioner, Qualification
+from .reconcile import load_refetch_queue, reconcile, save_reconciliation
+from .util import load_pages, save_dataclass_list_to_json
 
 with open("./config.yaml") as f:
     config_dict = yaml.safe_load(f)
@@ -21,12 +26,7 @@ INPUT_JSON_PATH = config_dict["scraper"]["doctors_overview"]["output_path"]
 OUTPUT_JSON_PATH = config_dict["scraper"]["doctors_detail"]["output_path"]
 BATCH_SIZE = config_dict["scraper"]["doctors_detail"]["batch_size"]
 
-# set log level; debug, info, warning, error, critical
-logging.basicConfig(
-    format="%(asctime)s | %(levelname)s | %(module)s:%(funcName)s:%(lineno)d | %(message)s",
-    level=logging.DEBUG,
-    filename=config_dict["logpath"],
-)
+logger = logging.getLogger(__name__)
 
 
 async def parse_rows(rows: list[list[str]]) -> list[Practitioner]:
@@ -99,6 +99,7 @@ async def parse_rows(rows: list[list[str]]) -> list[Practitioner]:
     return [Practitioner(**practitoner_info)]  # return list to extend
 
 
+@traced()
 async def parse_detailed_doctors_page(page_request: IO[str]) -> Practitioner:
     """
     Takes in a page request and returns a Practitioner object.
@@ -130,47 +131,112 @@ async def parse_detailed_doctors_page(page_request: IO[str]) -> Practitioner:
     return practitioner
 
 
-async def main():
-    """
-    - Go through the output of scraped_doctors_overview.
-    - Load page of detailed information about doctors to get specialist information, if any.
-    - Also can run assertion checks on the data folder against doctors' described details.
-    """
-    logging.info(f"Loading doctors jsonfile: {INPUT_JSON_PATH}.")
-    with open(INPUT_JSON_PATH, "r") as json_file:
-        doctor_data = json.load(json_file)
+def batch_filepath(i: int) -> str:
+    """Returns the path the details of the batch starting at `i` are saved
+    to."""
+    file_name, file_ext = os.path.split(OUTPUT_JSON_PATH)
+    return file_name + f"/{i}_" + file_ext
 
-    logging.info(f"Loading {len(doctor_data)} doctor records.")
-    # >15,000 doctors urls; split into batches otherwise error 1015
-    doctor_urls = [
-        DOCTORS_PAGE_FN(doctor["registration_no"]) for doctor in doctor_data
-    ]
 
-    # split save filepath
-    file_name, file_ext = os.path.split(OUTPUT_JSON_PATH)
+def load_batch(i: int) -> list[dict]:
+    """Loads the saved details of the batch starting at `i`, if any."""
+    if not os.path.exists(batch_filepath(i)):
+        return []
+    with open(batch_filepath(i), encoding="utf-8") as f:
+        return json.load(f)
 
-    # loop thorugh batches
-    for i in range(0, len(doctor_urls), BATCH_SIZE):
-        doctors_url_batch = doctor_urls[i : i + BATCH_SIZE]
-        logging.info(f"Handling batch {i}:{i+BATCH_SIZE}")
 
-        full_practitioner_list = await load_pages(
-            doctors_url_batch, parse_detailed_doctors_page
+def load_detail_records(num_doctors: int) -> list[dict]:
+    """Loads the saved detail batches of an overview of `num_doctors`."""
+    return [
+        record
+        for i in range(0, num_doctors, BATCH_SIZE)
+        for record in load_batch(i)
+    ]
+
+
+async def refetch_details(doctor_data: list[dict]):
+    """Fetches the details of the registrants in the refetch queue again and
+    replaces their records in the batch files they belong to."""
+    queue = load_refetch_queue()
+    logger.info(f"Refetching details of {len(queue)} doctors")
+    fetched = {
+        practitioner.registration_no: asdict(practitioner)
+        for practitioner in await load_pages(
+            [DOCTORS_PAGE_FN(no) for no in queue], parse_detailed_doctors_page
         )
-        logging.info("Doctor records loaded!")
+    }
+    for i in range(0, len(doctor_data), BATCH_SIZE):
+        batch_nos = {
+            d["registration_no"] for d in doctor_data[i : i + BATCH_SIZE]
+        }
+        updated = batch_nos & fetched.keys()
+        if not updated:
+            continue
+        records = load_batch(i)
+        records = [r for r in records if r["registration_no"] not in updated]
+        records.extend(fetched[no] for no in sorted(updated))
+        logger.info(f"Updating {len(updated)} records in {batch_filepath(i)}")
+        with open(batch_filepath(i), "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False, indent=2)
+
+
+async def main(refetch: bool = False):
+    """
+    - Go through the output of scraped_doctors_overview.
+    - Load page of detailed information about doctors to get specialist information, if any.
+    - Reconcile the saved details against the overview, writing a diff report
+      and queueing missing or mismatched doctors to refetch.
 
-        logging.info("Verifying new detailed records against overview..")
-        for old_dd, new_dd in tqdm(
-            zip(doctor_data[i : i + BATCH_SIZE], full_practitioner_list)
-        ):
-            assert old_dd["registration_no"] == new_dd.registration_no
-            assert old_dd["name"]["text"] == new_dd.name
-            assert old_dd["address"]["text"] == new_dd.address
+    Args:
+        - refetch: Only fetch the doctors queued by the last reconciliation,
+          updating their records in the saved batches.
+    """
+    logger.info(f"Loading doctors jsonfile: {INPUT_JSON_PATH}.")
+    with open(INPUT_JSON_PATH, "r") as json_file:
+        doctor_data = json.load(json_file)
 
-        save_filepath = file_name + f"/{i}_" + file_ext
-        logging.info(f"Saving to file: {save_filepath}")
-        save_dataclass_list_to_json(full_practitioner_list, save_filepath)
+    if refetch:
+        await refetch_details(doctor_data)
+    else:
+        logger.info(f"Loading {len(doctor_data)} doctor records.")
+        # >15,000 doctors urls; split into batches otherwise error 1015
+        doctor_urls = [
+            DOCTORS_PAGE_FN(doctor["registration_no"])
+            for doctor in doctor_data
+        ]
+
+        # loop thorugh batches
+        for i in range(0, len(doctor_urls), BATCH_SIZE):
+            doctors_url_batch = doctor_urls[i : i + BATCH_SIZE]
+            logger.info(f"Handling batch {i}:{i+BATCH_SIZE}")
+
+            full_practitioner_list = await load_pages(
+                doctors_url_batch, parse_detailed_doctors_page
+            )
+            logger.info("Doctor records loaded!")
+
+            save_filepath = batch_filepath(i)
+            logger.info(f"Saving to file: {save_filepath}")
+            save_dataclass_list_to_json(full_practitioner_list, save_filepath)
+
+    # pages that failed to load are left out of the batches, so records are
+    # joined on registration number rather than position
+    logger.info("Reconciling detailed records against overview..")
+    save_reconciliation(
+        reconcile(doctor_data, load_detail_records(len(doctor_data)))
+    )
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    configure_logging()
+    parser = argparse.ArgumentParser(
+        description="Scrape the details of every doctor in the overview."
+    )
+    parser.add_argument(
+        "--refetch",
+        action="store_true",
+        help="only fetch the doctors queued by the last reconciliation",
+    )
+    args = parser.parse_args()
+    asyncio.run(main(refetch=args.refetch))
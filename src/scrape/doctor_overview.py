@@ -4,8 +4,11 @@ from typing import IO
 
 import yaml
 from bs4 import BeautifulSoup
-from dr_dataclass import EnZhText, Practitioner, Qualification
-from util import load_pages, save_dataclass_list_to_json
+
+from ..logs import configure_logging
+from ..tracing import traced
+from .dr_dataclass import EnZhText, Practitioner, Qualification
+from .util import load_pages, save_dataclass_list_to_json
 
 with open("./config.yaml") as f:
     config_dict = yaml.safe_load(f)
@@ -17,14 +20,10 @@ DOCTORS_PAGE_FN = (
 NUM_PAGES = config_dict["scraper"]["doctors_overview"]["num_pages"]
 OUTPUT_JSONFILENAME = config_dict["scraper"]["doctors_overview"]["output_path"]
 
-# set log level; debug, info, warning, error, critical
-logging.basicConfig(
-    format="%(asctime)s | %(levelname)s | %(module)s:%(funcName)s:%(lineno)d | %(message)s",
-    level=logging.DEBUG,
-    filename=config_dict["logpath"],
-)
+logger = logging.getLogger(__name__)
 
 
+@traced()
 async def parse_registered_doctors_page(
     page_request: IO[str],
 ) -> list[Practitioner]:
@@ -91,14 +90,15 @@ async def main():
     urls_to_parse = [
         DOCTORS_PAGE_FN(page_num) for page_num in range(NUM_PAGES + 1)
     ]
-    logging.info(f"Parsing {len(urls_to_parse)} pages asynchronously.")
+    logger.info(f"Parsing {len(urls_to_parse)} pages asynchronously.")
     full_practitioner_list = await load_pages(
         urls_to_parse, parse_registered_doctors_page
     )
 
-    logging.info(f"Loaded {NUM_PAGES} pages. Saving to {OUTPUT_JSONFILENAME}")
+    logger.info(f"Loaded {NUM_PAGES} pages. Saving to {OUTPUT_JSONFILENAME}")
     save_dataclass_list_to_json(full_practitioner_list, OUTPUT_JSONFILENAME)
 
 
 if __name__ == "__main__":
+    configure_logging()
     asyncio.run(main())
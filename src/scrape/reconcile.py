@@ -0,0 +1,197 @@
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from ..logs import configure_logging
+
+with open("./config.yaml") as f:
+    config_dict = yaml.safe_load(f)
+
+DATA_DIR = config_dict["scraper"]["datapath"]
+OVERVIEW_JSON_PATH = config_dict["scraper"]["doctors_overview"]["output_path"]
+REPORT_PATH = config_dict["scraper"]["reconcile"]["report_path"]
+REFETCH_PATH = config_dict["scraper"]["reconcile"]["refetch_path"]
+
+# fields on both the overview and detail pages, compared once stripped
+RECONCILED_FIELDS = ["name", "address"]
+STATUSES = ["matched", "mismatched", "missing", "extra"]
+# statuses of registrants whose detail page should be fetched again
+REFETCH_STATUSES = ["missing", "mismatched"]
+
+logger = logging.getLogger(__name__)
+
+
+def to_frame(records: list[dict]) -> pd.DataFrame:
+    """Returns the registration number and reconciled fields of records.
+
+    Overview records hold text as `{"text": ...}` and detail records as
+    strings; both become stripped strings, with missing values empty.
+
+    Args:
+        records (list[dict]): Overview or detail records.
+
+    Returns:
+        pd.DataFrame: A `registration_no` column and one per reconciled
+            field.
+    """
+    frame = pd.json_normalize(records, max_level=1)
+    columns = {"registration_no": frame.get("registration_no")}
+    for field in RECONCILED_FIELDS:
+        column = frame.get(f"{field}.text", frame.get(field))
+        if column is None:
+            column = pd.Series("", index=frame.index)
+        columns[field] = column.fillna("").astype(str).str.strip()
+    if columns["registration_no"] is None:
+        columns["registration_no"] = pd.Series(dtype=str)
+    return pd.DataFrame(columns, index=frame.index)
+
+
+def reconcile(
+    overview_records: list[dict], detail_records: list[dict]
+) -> pd.DataFrame:
+    """Joins detail records to the overview on `registration_no` and
+    classifies each registrant.
+
+    Args:
+        overview_records (list[dict]): Records of the overview scraper.
+        detail_records (list[dict]): Records of the detail scraper, in any
+            order and possibly with pages that failed to load left out.
+
+    Returns:
+        pd.DataFrame: One row per registration number, with its `status`;
+            "matched", "mismatched" if a reconciled field differs,
+            "missing" if it has no detail record and "extra" if it isn't
+            in the overview. Each reconciled field has an `_overview` and a
+            `_detail` column, and `mismatched_<field>` flags.
+    """
+    overview = to_frame(overview_records).drop_duplicates(
+        "registration_no", keep="last"
+    )
+    detail = to_frame(detail_records).drop_duplicates(
+        "registration_no", keep="last"
+    )
+    merged = overview.merge(
+        detail,
+        on="registration_no",
+        how="outer",
+        suffixes=("_overview", "_detail"),
+        indicator=True,
+    )
+
+    in_both = (merged["_merge"] == "both").to_numpy()
+    for field in RECONCILED_FIELDS:
+        merged[f"mismatched_{field}"] = in_both & (
+            merged[f"{field}_overview"].to_numpy()
+            != merged[f"{field}_detail"].to_numpy()
+        )
+    mismatched = merged[
+        [f"mismatched_{field}" for field in RECONCILED_FIELDS]
+    ].to_numpy()
+
+    merged["status"] = np.select(
+        [
+            (merged["_merge"] == "left_only").to_numpy(),
+            (merged["_merge"] == "right_only").to_numpy(),
+            mismatched.any(axis=1),
+        ],
+        ["missing", "extra", "mismatched"],
+        default="matched",
+    )
+    return merged.drop(columns="_merge").sort_values("registration_no")
+
+
+def diff_report(reconciled: pd.DataFrame) -> dict:
+    """Summarises a reconciliation: counts per status and field, and the
+    registrants that aren't matched with only the fields that differ.
+
+    Args:
+        reconciled (pd.DataFrame): Output of `reconcile`.
+
+    Returns:
+        dict: The report, ready to be saved as json.
+    """
+    unmatched = reconciled[reconciled["status"] != "matched"]
+    differences = []
+    for row in unmatched.to_dict("records"):
+        difference = {
+            "registration_no": row["registration_no"],
+            "status": row["status"],
+        }
+        if row["status"] == "mismatched":
+            difference["fields"] = {
+                field: {
+                    "overview": row[f"{field}_overview"],
+                    "detail": row[f"{field}_detail"],
+                }
+                for field in RECONCILED_FIELDS
+                if row[f"mismatched_{field}"]
+            }
+        differences.append(difference)
+
+    counts = reconciled["status"].value_counts()
+    return {
+        "counts": {status: int(counts.get(status, 0)) for status in STATUSES},
+        "mismatched_fields": {
+            field: int(reconciled[f"mismatched_{field}"].sum())
+            for field in RECONCILED_FIELDS
+        },
+        "differences": differences,
+    }
+
+
+def refetch_queue(reconciled: pd.DataFrame) -> list[str]:
+    """Returns the registration numbers whose detail page should be fetched
+    again; those missing a detail record or mismatching the overview."""
+    return reconciled.loc[
+        reconciled["status"].isin(REFETCH_STATUSES), "registration_no"
+    ].tolist()
+
+
+def save_reconciliation(
+    reconciled: pd.DataFrame,
+    report_path: str = REPORT_PATH,
+    refetch_path: str = REFETCH_PATH,
+) -> dict:
+    """Saves the diff report and refetch queue of a reconciliation.
+
+    Returns:
+        dict: The report's counts per status.
+    """
+    report = diff_report(reconciled)
+    for path, content in [
+        (report_path, report),
+        (refetch_path, refetch_queue(reconciled)),
+    ]:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(content, f, ensure_ascii=False, indent=2)
+    logger.info(
+        f"Reconciled detail records against overview: {report['counts']}"
+    )
+    return report["counts"]
+
+
+def load_refetch_queue(refetch_path: str = REFETCH_PATH) -> list[str]:
+    """Loads the registration numbers queued by `save_reconciliation`."""
+    if not os.path.exists(refetch_path):
+        return []
+    with open(refetch_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    with open(OVERVIEW_JSON_PATH, encoding="utf-8") as f:
+        overview_records = json.load(f)
+    detail_records = []
+    for jf in os.listdir(DATA_DIR):
+        if jf.endswith("_scraped_doctors_detail.json"):
+            with open(DATA_DIR + jf, encoding="utf-8") as f:
+                detail_records.extend(json.load(f))
+
+    counts = save_reconciliation(reconcile(overview_records, detail_records))
+    print(counts)
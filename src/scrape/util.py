@@ -10,14 +10,12 @@ import aiohttp
 import yaml
 from tqdm.asyncio import tqdm
 
+from ..tracing import span, traced
+
 with open("./config.yaml") as f:
     config_dict = yaml.safe_load(f)
 
-logging.basicConfig(
-    format="%(asctime)s | %(levelname)s | %(module)s:%(funcName)s:%(lineno)d | %(message)s",
-    level=logging.DEBUG,
-    filename=config_dict["logpath"],
-)
+logger = logging.getLogger(__name__)
 
 
 def retry_with_backoff(retries=5, backoff_in_ms=100):
@@ -40,7 +38,7 @@ def retry_with_backoff(retries=5, backoff_in_ms=100):
                 try:
                     return await f(*args, **kwargs)
                 except Exception as e:
-                    print("Fetch error:", e)
+                    logger.warning(f"Fetch error: {e}")
 
                     if x == retries:
                         raise
@@ -54,13 +52,14 @@ def retry_with_backoff(retries=5, backoff_in_ms=100):
                             raise asyncio.ClientResponseError(
                                 f"Failed after {retries} attempts!"
                             )
-                        print(f"Retrying {x + 1}/{retries}")
+                        logger.info(f"Retrying {x + 1}/{retries}")
 
         return wrapped
 
     return wrapper
 
 
+@traced()
 @retry_with_backoff(retries=5, backoff_in_ms=500)
 async def fetch(session: aiohttp.ClientSession, url: str) -> str:
     """
@@ -87,11 +86,13 @@ async def fetch(session: aiohttp.ClientSession, url: str) -> str:
             ), f"Response status: {response.status}"
             return await response.text()
     except aiohttp.ClientConnectionError as e:
-        print(f"An error occurred while connecting to {url}: {e}")
+        logger.error(f"An error occurred while connecting to {url}: {e}")
     except aiohttp.ClientResponseError as e:
-        print(f"An client response error occurred while fetching {url}: {e}")
+        logger.error(
+            f"An client response error occurred while fetching {url}: {e}"
+        )
     except asyncio.TimeoutError as e:
-        print(f"A timeout occurred while fetching {url}: {e}")
+        logger.error(f"A timeout occurred while fetching {url}: {e}")
 
 
 def save_dataclass_list_to_json(list_to_save: list[Any], output_filepath: str):
@@ -119,25 +120,26 @@ async def load_pages(
     processed_pages = []
     connector = aiohttp.TCPConnector(limit=50)  # num connections
 
-    # load pages async
-    async with aiohttp.ClientSession(connector=connector) as session:
-        tasks = []
-        logging.debug("Fetching URLS")
-        for url in tqdm(urls_to_parse):
-            tasks.append(fetch(session, url))
+    # load pages async; each fetch and parse is a span of one trace
+    with span("load_pages", urls=len(urls_to_parse)):
+        async with aiohttp.ClientSession(connector=connector) as session:
+            tasks = []
+            logger.debug("Fetching URLS")
+            for url in tqdm(urls_to_parse):
+                tasks.append(fetch(session, url))
 
-        logging.debug("Gathering Tasks")
-        pages = await asyncio.gather(*tasks)
-        for page in tqdm(pages):
-            if page is None:
-                continue
+            logger.debug("Gathering Tasks")
+            pages = await asyncio.gather(*tasks)
+            for page in tqdm(pages):
+                if page is None:
+                    continue
 
-            processed_page = await parsing_fn(page)
+                processed_page = await parsing_fn(page)
 
-            if processed_page is None:
-                continue
+                if processed_page is None:
+                    continue
 
-            assert type(processed_page) == list
-            processed_pages.extend(processed_page)
+                assert type(processed_page) == list
+                processed_pages.extend(processed_page)
 
     return processed_pages
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+import yaml
+
+from .logs import configure_logging
+from .openai_query import (
+    COALESCER,
+    COMPLETION_PARAMS,
+    MEDICAL_PROMPT_DESC,
+    acall_openai,
+    call_openai,
+)
+from .specialty_resolver import (
+    SpecialtyResolver,
+    load_specialty_names,
+    normalise,
+)
+
+with open("./config.yaml") as f:
+    config_dict = yaml.safe_load(f)
+
+TABLE_PATH = config_dict["specialist_descriptions"]["path"]
+MIN_SIMILARITY = config_dict["specialist_descriptions"]["min_similarity"]
+
+logger = logging.getLogger(__name__)
+
+
+def table_version(specialties: list[str]) -> str:
+    """Versions a table by the prompt, completion parameters and specialty
+    vocabulary it was generated from."""
+    payload = json.dumps(
+        {
+            "prompt": MEDICAL_PROMPT_DESC,
+            "params": COMPLETION_PARAMS,
+            "specialties": sorted(specialties),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def build_description_table(specialties: list[str]) -> dict:
+    """Generates a description of every specialty with the LLM.
+
+    Prompts are submitted together so `COALESCER` sends them as batched
+    multi-prompt requests.
+
+    Args:
+        specialties (list[str]): Distinct `specialty_name` values.
+
+    Returns:
+        dict: The versioned table, with descriptions keyed by normalised
+            specialty name.
+    """
+    futures = {
+        specialty: COALESCER.submit(MEDICAL_PROMPT_DESC + specialty)
+        for specialty in specialties
+    }
+    return {
+        "version": table_version(specialties),
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "prompt": MEDICAL_PROMPT_DESC,
+        "engine": COMPLETION_PARAMS["engine"],
+        "descriptions": {
+            normalise(specialty): future.result()
+            for specialty, future in futures.items()
+        },
+    }
+
+
+def save_description_table(table: dict, path: str = TABLE_PATH):
+    """Saves a description table to a json file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(table, f, ensure_ascii=False, indent=2)
+
+
+def load_description_table(path: str = TABLE_PATH) -> dict[str, str]:
+    """Loads the descriptions of a table saved with `save_description_table`.
+
+    Tables generated with a different prompt or engine are ignored.
+
+    Returns:
+        dict[str, str]: Normalised specialty name to description; empty if
+            there's no usable table.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        table = json.load(f)
+
+    if (
+        table["prompt"] != MEDICAL_PROMPT_DESC
+        or table["engine"] != COMPLETION_PARAMS["engine"]
+    ):
+        logger.warning(f"Ignoring stale description table {path}")
+        return {}
+    logger.info(f"Loaded description table version {table['version']}")
+    return table["descriptions"]
+
+
+def lookup_description(
+    medical_specialist: str,
+    descriptions: dict[str, str],
+    resolver: SpecialtyResolver | None = None,
+) -> str | None:
+    """Looks up a specialist's description in the precomputed table.
+
+    The name is looked up as is, then as the register specialty the resolver
+    maps it to, eg. "Cardiologist" to "Cardiology"; only if it is the one
+    specialty at least `MIN_SIMILARITY` similar, so eg. "Surgeon" isn't
+    described as Neurosurgery.
+
+    Returns:
+        str | None: The description, or None if the name isn't known.
+    """
+    description = descriptions.get(normalise(medical_specialist))
+    if description is None and resolver is not None:
+        matches = resolver.resolve(
+            [medical_specialist], top_k=2, min_similarity=MIN_SIMILARITY
+        )[0]
+        if len(matches) == 1:
+            description = descriptions.get(normalise(matches[0][0]))
+    return description
+
+
+def get_specialist_description(
+    medical_specialist: str,
+    descriptions: dict[str, str],
+    resolver: SpecialtyResolver | None = None,
+) -> str:
+    """Returns a specialist's description from the precomputed table,
+    asking the LLM only for names that aren't in it."""
+    description = lookup_description(
+        medical_specialist, descriptions, resolver
+    )
+    if description is None:
+        description = call_openai(MEDICAL_PROMPT_DESC + medical_specialist)
+    return description
+
+
+async def aget_specialist_description(
+    medical_specialist: str,
+    descriptions: dict[str, str],
+    resolver: SpecialtyResolver | None = None,
+) -> str:
+    """Async version of `get_specialist_description`."""
+    description = lookup_description(
+        medical_specialist, descriptions, resolver
+    )
+    if description is None:
+        description = await acall_openai(
+            MEDICAL_PROMPT_DESC + medical_specialist
+        )
+    return description
+
+
+if __name__ == "__main__":
+    configure_logging()
+    specialties = load_specialty_names()
+    logger.info(f"Describing {len(specialties)} specialties")
+    table = build_description_table(specialties)
+    save_description_table(table)
+    logger.info(f"Saved description table version {table['version']}")
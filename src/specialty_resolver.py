@@ -0,0 +1,249 @@
+import json
+import logging
+import os
+import re
+import zlib
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+import yaml
+
+from .logs import configure_logging
+
+with open("./config.yaml") as f:
+    config_dict = yaml.safe_load(f)
+
+DATA_DIR = config_dict["scraper"]["datapath"]
+RESOLVER_PATH = config_dict["specialty_resolver"]["path"]
+MIN_SIMILARITY = config_dict["specialty_resolver"]["min_similarity"]
+MARGIN = config_dict["specialty_resolver"]["margin"]
+
+logger = logging.getLogger(__name__)
+
+# size of the hashed character n-gram space
+NUM_FEATURES = 2**12
+NGRAM_RANGE = (2, 4)
+
+# common ways of naming a specialty; keys are matched against the words of the
+# register's specialty names, case insensitively, to find the canonical names
+# they alias
+SPECIALTY_SYNONYMS = {
+    "Anaesthesiology": ["anesthesiologist", "anaesthetist"],
+    "Cardiology": ["cardiologist", "heart specialist", "heart doctor"],
+    "Dermatology": ["dermatologist", "skin specialist", "skin doctor"],
+    "Endocrinology": ["endocrinologist", "diabetes specialist"],
+    "Family Medicine": ["general practitioner", "gp", "family doctor"],
+    "Gastroenterology": ["gastroenterologist", "stomach specialist"],
+    "Geriatric": ["geriatrician", "elderly care"],
+    "Haematology": ["hematologist", "haematologist", "blood specialist"],
+    "Immunology": ["immunologist", "allergist", "allergy specialist"],
+    "Infectious": ["infectious disease specialist"],
+    "Nephrology": ["nephrologist", "kidney specialist"],
+    "Neurology": ["neurologist", "nerve specialist"],
+    "Neurosurgery": ["neurosurgeon", "brain surgeon"],
+    "Obstetrics": ["obstetrician", "gynecologist", "gynaecologist", "obgyn"],
+    "Oncology": ["oncologist", "cancer specialist"],
+    "Ophthalmology": ["ophthalmologist", "eye specialist", "eye doctor"],
+    "Orthopaedics": ["orthopedist", "orthopaedic surgeon", "bone doctor"],
+    "Otorhinolaryngology": [
+        "ent",
+        "ent doctor",
+        "ear nose and throat specialist",
+        "otolaryngologist",
+    ],
+    "Paediatrics": ["pediatrician", "paediatrician", "child doctor"],
+    "Plastic Surgery": ["plastic surgeon", "cosmetic surgeon"],
+    "Psychiatry": ["psychiatrist", "mental health specialist"],
+    "Radiology": ["radiologist"],
+    "Rehabilitation": ["physiatrist", "rehabilitation specialist"],
+    "Respiratory": ["pulmonologist", "lung specialist", "chest physician"],
+    "Rheumatology": ["rheumatologist", "arthritis specialist"],
+    "Urology": ["urologist"],
+}
+
+
+def normalise(text: str) -> str:
+    """Lowercases text and collapses anything but letters into single
+    spaces."""
+    return " ".join(re.findall(r"[a-z]+", text.lower()))
+
+
+def ngram_ids(text: str) -> list[int]:
+    """Hashes the character n-grams of each word in the text to feature ids.
+    Words are padded with spaces so prefixes and suffixes are features too."""
+    ids = []
+    for word in normalise(text).split():
+        padded = f" {word} "
+        for n in range(NGRAM_RANGE[0], NGRAM_RANGE[1] + 1):
+            for i in range(len(padded) - n + 1):
+                gram = padded[i : i + n].encode("utf-8")
+                ids.append(zlib.crc32(gram) % NUM_FEATURES)
+    return ids
+
+
+def count_matrix(
+    texts: list[str],
+    feature_fn: Callable[[str], list[int]] = ngram_ids,
+    num_features: int = NUM_FEATURES,
+) -> np.ndarray:
+    """Returns the hashed feature counts of each text, one row per text.
+
+    Args:
+        texts (list[str]): Texts to count the features of.
+        feature_fn (Callable[[str], list[int]]): Hashes a text to feature
+            ids below `num_features`; character n-grams by default.
+        num_features (int): Size of the hashed feature space.
+
+    Returns:
+        np.ndarray: float32 counts, (len(texts), num_features).
+    """
+    counts = np.zeros((len(texts), num_features), dtype=np.float32)
+    for row, text in enumerate(texts):
+        np.add.at(counts[row], feature_fn(text), 1)
+    return counts
+
+
+def l2_normalise(matrix: np.ndarray) -> np.ndarray:
+    """Scales each row to unit length, leaving all-zero rows as they are."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+@dataclass
+class SpecialtyResolver:
+    """TF-IDF nearest neighbour index over specialty names and synonyms.
+
+    Each row of `vectors` is a canonical specialty name, or a synonym of one,
+    and `row_specialty` maps it to its index in `specialties`.
+    """
+
+    specialties: np.ndarray  # str, (n_specialties,)
+    row_specialty: np.ndarray  # int32, (n_rows,)
+    vectors: np.ndarray  # float32, (n_rows, NUM_FEATURES)
+    idf: np.ndarray  # float32, (NUM_FEATURES,)
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """Embeds texts into the same space as the indexed names."""
+        return l2_normalise(count_matrix(texts) * self.idf)
+
+    def resolve(
+        self,
+        names: list[str],
+        top_k: int = 3,
+        min_similarity: float = MIN_SIMILARITY,
+        margin: float = MARGIN,
+    ) -> list[list[tuple[str, float]]]:
+        """Maps free-form specialist names to canonical specialty names.
+
+        All names are looked up in a single matrix product.
+
+        Args:
+            names (list[str]): Names to resolve, eg. ["Cardiologist", "ENT"].
+            top_k (int): Maximum number of specialties to return per name.
+            min_similarity (float): Cosine similarity below which a match is
+                dropped.
+            margin (float): How far below the best match another match may
+                be, so eg. "Neurologist" doesn't also resolve to Urology.
+
+        Returns:
+            list[list[tuple[str, float]]]: For each name, canonical specialty
+                names with their similarity, best first.
+        """
+        if not names:
+            return []
+        similarity = self.embed(names) @ self.vectors.T
+
+        # best row similarity per specialty; synonyms share a specialty
+        best = np.zeros((len(names), len(self.specialties)), dtype=np.float32)
+        np.maximum.at(best.T, self.row_specialty, similarity.T)
+
+        resolved = []
+        for scores in best:
+            order = np.argsort(-scores)[:top_k]
+            cutoff = max(min_similarity, scores[order[0]] - margin)
+            resolved.append(
+                [
+                    (str(self.specialties[i]), float(scores[i]))
+                    for i in order
+                    if scores[i] >= cutoff
+                ]
+            )
+        return resolved
+
+
+def build_specialty_resolver(specialties: list[str]) -> SpecialtyResolver:
+    """Builds the resolver from the register's distinct specialty names.
+
+    Args:
+        specialties (list[str]): Distinct `specialty_name` values.
+
+    Returns:
+        SpecialtyResolver: The resolver.
+    """
+    texts, row_specialty = [], []
+    for i, specialty in enumerate(specialties):
+        texts.append(specialty)
+        row_specialty.append(i)
+        words = set(normalise(specialty).split())
+        for key, synonyms in SPECIALTY_SYNONYMS.items():
+            # whole words, so eg. "Urology" isn't found in "Neurology"
+            if set(normalise(key).split()) <= words:
+                texts.extend(synonyms)
+                row_specialty.extend([i] * len(synonyms))
+
+    counts = count_matrix(texts)
+    doc_freq = np.count_nonzero(counts, axis=0)
+    idf = np.log((1 + len(texts)) / (1 + doc_freq)) + 1
+
+    return SpecialtyResolver(
+        specialties=np.array(specialties, dtype=str),
+        row_specialty=np.array(row_specialty, dtype=np.int32),
+        vectors=l2_normalise(counts * idf).astype(np.float32),
+        idf=idf.astype(np.float32),
+    )
+
+
+def save_specialty_resolver(resolver: SpecialtyResolver, path: str):
+    """Saves the resolver's arrays to a `.npz` file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez_compressed(
+        path,
+        specialties=resolver.specialties,
+        row_specialty=resolver.row_specialty,
+        vectors=resolver.vectors,
+        idf=resolver.idf,
+    )
+
+
+def load_specialty_resolver(path: str = RESOLVER_PATH) -> SpecialtyResolver:
+    """Loads a resolver saved with `save_specialty_resolver`."""
+    with np.load(path) as arrays:
+        return SpecialtyResolver(**{k: arrays[k] for k in arrays.files})
+
+
+def specialty_names(docs: list[dict]) -> list[str]:
+    """Returns the distinct specialty names of scraped detail documents."""
+    return sorted(
+        {doc["specialty_name"] for doc in docs if doc.get("specialty_name")}
+    )
+
+
+def load_specialty_names(data_dir: str = DATA_DIR) -> list[str]:
+    """Returns the distinct specialty names in the scraped detail files."""
+    docs = []
+    for jf in os.listdir(data_dir):
+        if not jf.endswith("_scraped_doctors_detail.json"):
+            continue
+        with open(data_dir + jf) as raw_data:
+            docs.extend(json.load(raw_data))
+    return specialty_names(docs)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    specialties = load_specialty_names()
+    logger.info(f"Building resolver for {len(specialties)} specialties")
+    resolver = build_specialty_resolver(specialties)
+    save_specialty_resolver(resolver, RESOLVER_PATH)
+    logger.info(f"Saved specialty resolver to {RESOLVER_PATH}")
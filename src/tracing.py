@@ -0,0 +1,376 @@
+import atexit
+import collections
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import secrets
+import sys
+import threading
+import time
+import urllib.request
+
+from .resources import get_config, once
+
+logger = logging.getLogger(__name__)
+
+# the span code running now belongs to; tasks and `asyncio.to_thread` copy it
+_current_span = contextvars.ContextVar("current_span", default=None)
+# threads being sampled by a `SamplingProfiler`, so nested spans don't
+# profile a thread twice
+_profiled_threads = set()
+_profiled_threads_lock = threading.Lock()
+
+
+def tracing_config() -> dict:
+    """Returns the `tracing` section of `config.yaml`."""
+    return get_config()["tracing"]
+
+
+class Trace:
+    """Spans of one request, eg. one Streamlit run or API request."""
+
+    def __init__(self, sampled: bool):
+        self.trace_id = secrets.token_hex(16)
+        self.sampled = sampled
+        self.spans = []
+
+    def breakdown(self) -> list[dict]:
+        """Returns the finished spans in start order, with their depth in the
+        trace and times in ms relative to the start of the trace."""
+        if not self.spans:
+            return []
+        spans = sorted(self.spans, key=lambda s: s.start_ns)
+        depths = {}
+        rows = []
+        for span in spans:
+            depth = depths.get(span.parent_id, -1) + 1
+            depths[span.span_id] = depth
+            rows.append(
+                {
+                    "span": "  " * depth + span.name,
+                    "start_ms": (span.start_ns - spans[0].start_ns) / 1e6,
+                    "duration_ms": span.duration_ms,
+                    "error": span.error,
+                }
+            )
+        return rows
+
+
+class Span:
+    """A timed operation within a trace."""
+
+    def __init__(
+        self,
+        name: str,
+        trace: Trace,
+        parent_id: str | None,
+        attributes: dict,
+    ):
+        self.name = name
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def duration_ms(self) -> float:
+        """Time the span took, or has taken so far."""
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_otlp(self) -> dict:
+        """Returns the span in the OTLP/JSON encoding."""
+        otlp_span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": otlp_attributes(self.attributes),
+            "status": (
+                {"code": 2, "message": self.error}  # STATUS_CODE_ERROR
+                if self.error
+                else {"code": 1}  # STATUS_CODE_OK
+            ),
+        }
+        if self.parent_id:
+            otlp_span["parentSpanId"] = self.parent_id
+        return otlp_span
+
+
+def otlp_attributes(attributes: dict) -> list[dict]:
+    """Encodes attributes as OTLP/JSON key values."""
+    encoded = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            encoded_value = {"boolValue": value}
+        elif isinstance(value, int):
+            encoded_value = {"intValue": str(value)}
+        elif isinstance(value, float):
+            encoded_value = {"doubleValue": value}
+        else:
+            encoded_value = {"stringValue": str(value)}
+        encoded.append({"key": key, "value": encoded_value})
+    return encoded
+
+
+class SpanExporter:
+    """Exports sampled traces from a background thread, so requests don't
+    wait on disk or the network.
+
+    Each trace is written as one OTLP/JSON `ExportTraceServiceRequest` per
+    line to `export_path`, the format of the OpenTelemetry collector's file
+    exporter, and posted to an OTLP/HTTP collector at `endpoint` if set.
+    Traces are dropped when the queue is full.
+    """
+
+    def __init__(
+        self,
+        export_path: str | None,
+        endpoint: str | None,
+        service_name: str,
+        queue_size: int,
+    ):
+        self.export_path = export_path
+        self.endpoint = endpoint
+        self.resource = {
+            "attributes": otlp_attributes({"service.name": service_name})
+        }
+        self.queue = queue.Queue(queue_size)
+        self.dropped = 0
+        if export_path:
+            os.makedirs(os.path.dirname(export_path) or ".", exist_ok=True)
+        self._thread = threading.Thread(
+            target=self._run, name="span-exporter", daemon=True
+        )
+        self._thread.start()
+
+    def export(self, trace: Trace):
+        """Queues a finished trace for export."""
+        try:
+            self.queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def to_otlp(self, trace: Trace) -> dict:
+        """Returns a trace as an OTLP/JSON `ExportTraceServiceRequest`."""
+        return {
+            "resourceSpans": [
+                {
+                    "resource": self.resource,
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __name__},
+                            "spans": [s.to_otlp() for s in trace.spans],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    def _run(self):
+        """Writes queued traces until `shutdown` queues None."""
+        while True:
+            trace = self.queue.get()
+            if trace is None:
+                return
+            body = json.dumps(self.to_otlp(trace))
+            try:
+                if self.export_path:
+                    with open(self.export_path, "a", encoding="utf-8") as f:
+                        f.write(body + "\n")
+                if self.endpoint:
+                    request = urllib.request.Request(
+                        f"{self.endpoint}/v1/traces",
+                        data=body.encode(),
+                        headers={"Content-Type": "application/json"},
+                    )
+                    urllib.request.urlopen(request, timeout=5).close()
+            except Exception as e:
+                logger.warning(f"Exporting trace {trace.trace_id} failed: {e}")
+
+    def shutdown(self):
+        """Exports the queued traces, eg. before the process exits."""
+        try:
+            self.queue.put(None, timeout=1)
+        except queue.Full:
+            return
+        self._thread.join(timeout=5)
+
+
+@once
+def get_exporter() -> SpanExporter:
+    """Returns the process's span exporter, started on first use."""
+    config = tracing_config()
+    exporter = SpanExporter(
+        config["export_path"],
+        config["endpoint"],
+        config["service_name"],
+        config["queue_size"],
+    )
+    atexit.register(exporter.shutdown)
+    return exporter
+
+
+class SamplingProfiler:
+    """Samples a thread's stack every `interval_ms` while running.
+
+    Stacks are appended to `output_path` in the folded format of
+    flamegraph.pl and speedscope, one `frame;frame;... count` per line,
+    prefixed with the span they were sampled in.
+    """
+
+    def __init__(
+        self, span: Span, thread_id: int, interval_ms: float, output_path: str
+    ):
+        self.span = span
+        self.thread_id = thread_id
+        self.interval_s = interval_ms / 1000
+        self.output_path = output_path
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="sampling-profiler", daemon=True
+        )
+
+    def start(self):
+        """Starts sampling in the background."""
+        self._thread.start()
+
+    def _run(self):
+        """Counts the sampled thread's stacks until stopped."""
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                module = frame.f_globals.get("__name__", "?")
+                frames.append(f"{module}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(frames))] += 1
+
+    def stop(self):
+        """Stops sampling and appends the folded stacks to the output."""
+        self._stop.set()
+        self._thread.join()
+        self.span.attributes["profile.samples"] = sum(self.stacks.values())
+        if not self.stacks:
+            return
+        os.makedirs(os.path.dirname(self.output_path) or ".", exist_ok=True)
+        with open(self.output_path, "a", encoding="utf-8") as f:
+            for stack, count in self.stacks.items():
+                f.write(f"{self.span.name};{stack} {count}\n")
+
+
+def start_profiler(span: Span) -> SamplingProfiler | None:
+    """Profiles the current thread for the span if profiling is enabled,
+    the span is listed in `tracing.profile.spans` and the thread isn't
+    profiled already."""
+    config = tracing_config()["profile"]
+    thread_id = threading.get_ident()
+    if not config["enabled"] or span.name not in config["spans"]:
+        return None
+    with _profiled_threads_lock:
+        if thread_id in _profiled_threads:
+            return None
+        _profiled_threads.add(thread_id)
+    profiler = SamplingProfiler(
+        span, thread_id, config["interval_ms"], config["output_path"]
+    )
+    profiler.start()
+    return profiler
+
+
+def current_span() -> Span | None:
+    """Returns the span code is running in, if any."""
+    return _current_span.get()
+
+
+def set_attribute(key: str, value):
+    """Sets an attribute on the current span, if any, eg. a cache hit."""
+    span = _current_span.get()
+    if span is not None:
+        span.attributes[key] = value
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """Times the code in the block as a span.
+
+    The span is a child of the current span; outside of one it starts a new
+    trace, which is exported when the span ends if it was sampled at
+    `tracing.sample_rate`. Spans are always timed, so a trace's breakdown
+    can be shown whether or not it is exported.
+
+    Args:
+        name (str): Name of the operation, eg. "call_openai".
+        **attributes: Attributes of the span, eg. the size of a search.
+
+    Yields:
+        Span | None: The span, or None if tracing is disabled.
+    """
+    config = tracing_config()
+    if not config["enabled"]:
+        yield None
+        return
+
+    parent = _current_span.get()
+    if parent is None:
+        trace = Trace(sampled=random.random() < config["sample_rate"])
+        new_span = Span(name, trace, None, attributes)
+    else:
+        new_span = Span(name, parent.trace, parent.span_id, attributes)
+    token = _current_span.set(new_span)
+    profiler = start_profiler(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.error = repr(e)
+        raise
+    finally:
+        new_span.end_ns = time.time_ns()
+        _current_span.reset(token)
+        if profiler is not None:
+            profiler.stop()
+            with _profiled_threads_lock:
+                _profiled_threads.discard(profiler.thread_id)
+        new_span.trace.spans.append(new_span)
+        if parent is None and new_span.trace.sampled:
+            get_exporter().export(new_span.trace)
+
+
+def traced(name: str | None = None):
+    """Decorates a function or coroutine function to run in a span named
+    after it, or `name`."""
+
+    def wrapper(f):
+        span_name = name or f.__qualname__
+
+        if inspect.iscoroutinefunction(f):
+
+            @functools.wraps(f)
+            async def async_wrapped(*args, **kwargs):
+                with span(span_name):
+                    return await f(*args, **kwargs)
+
+            return async_wrapped
+
+        @functools.wraps(f)
+        def wrapped(*args, **kwargs):
+            with span(span_name):
+                return f(*args, **kwargs)
+
+        return wrapped
+
+    return wrapper
@@ -0,0 +1,236 @@
+import logging
+import os
+import re
+import zlib
+from dataclasses import dataclass
+
+import numpy as np
+import yaml
+
+from .logs import configure_logging, log_payload
+from .openai_query import LLM_CACHE, MEDICAL_PROMPT, parse_specialists
+from .specialty_resolver import count_matrix, l2_normalise
+
+with open("./config.yaml") as f:
+    config_dict = yaml.safe_load(f)
+
+MODEL_PATH = config_dict["triage"]["model_path"]
+MIN_CONFIDENCE = config_dict["triage"]["min_confidence"]
+NEIGHBOURS = config_dict["triage"]["neighbours"]
+
+logger = logging.getLogger(__name__)
+
+# size of the hashed word feature space
+NUM_FEATURES = 2**12
+# words are also matched on their first letters, so "rashes" matches "rash"
+STEM_LENGTH = 5
+
+STOPWORDS = {
+    "a", "an", "and", "are", "at", "have", "i", "in", "is", "it", "my",
+    "of", "on", "or", "the", "to", "with", "when", "been", "feel", "got",
+}  # fmt: skip
+
+# symptoms with unambiguous specialists, in the LLM's naming
+CURATED_TRIAGE = {
+    "toothache": ["Dentist"],
+    "tooth pain": ["Dentist"],
+    "bleeding gums": ["Dentist", "Periodontist"],
+    "skin rash": ["Dermatologist"],
+    "itchy skin": ["Dermatologist"],
+    "acne": ["Dermatologist"],
+    "eczema": ["Dermatologist"],
+    "mole changing shape": ["Dermatologist", "Oncologist"],
+    "hair loss": ["Dermatologist"],
+    "chest pain": ["Cardiologist"],
+    "heart palpitations": ["Cardiologist"],
+    "high blood pressure": ["Cardiologist"],
+    "shortness of breath": ["Pulmonologist", "Cardiologist"],
+    "persistent cough": ["Pulmonologist"],
+    "asthma": ["Pulmonologist"],
+    "wheezing": ["Pulmonologist"],
+    "blurred vision": ["Ophthalmologist"],
+    "red eye": ["Ophthalmologist"],
+    "eye pain": ["Ophthalmologist"],
+    "ear pain": ["ENT Specialist"],
+    "hearing loss": ["ENT Specialist"],
+    "sore throat": ["ENT Specialist"],
+    "blocked nose": ["ENT Specialist"],
+    "sinus pain": ["ENT Specialist"],
+    "headache": ["Neurologist"],
+    "migraine": ["Neurologist"],
+    "numbness in hands": ["Neurologist"],
+    "seizures": ["Neurologist"],
+    "back pain": ["Orthopedist", "Physiotherapist"],
+    "knee pain": ["Orthopedist"],
+    "broken bone": ["Orthopedist"],
+    "sprained ankle": ["Orthopedist"],
+    "joint pain": ["Rheumatologist", "Orthopedist"],
+    "stomach ache": ["Gastroenterologist"],
+    "heartburn": ["Gastroenterologist"],
+    "diarrhoea": ["Gastroenterologist"],
+    "constipation": ["Gastroenterologist"],
+    "blood in stool": ["Gastroenterologist"],
+    "painful urination": ["Urologist"],
+    "kidney stones": ["Urologist", "Nephrologist"],
+    "irregular periods": ["Gynecologist"],
+    "pregnancy": ["Obstetrician"],
+    "anxiety": ["Psychiatrist"],
+    "depression": ["Psychiatrist"],
+    "insomnia": ["Psychiatrist", "Neurologist"],
+    "thyroid problems": ["Endocrinologist"],
+    "diabetes": ["Endocrinologist"],
+    "child fever": ["Pediatrician"],
+    "allergies": ["Allergist"],
+    "fever": ["General Practitioner"],
+    "cold and flu": ["General Practitioner"],
+}
+
+
+def feature_ids(text: str) -> list[int]:
+    """Hashes the words, word stems and word bigrams of a text to feature
+    ids."""
+    words = [
+        w for w in re.findall(r"[a-z]+", text.lower()) if w not in STOPWORDS
+    ]
+    features = words + [f"{w[:STEM_LENGTH]}~" for w in words]
+    features += [f"{a} {b}" for a, b in zip(words, words[1:])]
+    return [zlib.crc32(f.encode("utf-8")) % NUM_FEATURES for f in features]
+
+
+@dataclass
+class TriageModel:
+    """Nearest neighbour classifier from symptoms to specialists.
+
+    Each row of `vectors` is the TF-IDF vector of a training example, and
+    the same row of `labels` marks the specialists suggested for it.
+    """
+
+    vectors: np.ndarray  # float32, (n_examples, NUM_FEATURES)
+    idf: np.ndarray  # float32, (NUM_FEATURES,)
+    labels: np.ndarray  # bool, (n_examples, n_specialists)
+    specialists: np.ndarray  # str, (n_specialists,)
+
+    def predict(
+        self, symptoms: list[str], neighbours: int = NEIGHBOURS
+    ) -> list[list[tuple[str, float]]]:
+        """Suggests specialists for each description of symptoms.
+
+        A specialist's confidence is the similarity-weighted share of the
+        nearest examples suggesting it, scaled by the similarity of the
+        closest example, so unfamiliar symptoms get low confidence.
+
+        Args:
+            symptoms (list[str]): Descriptions of symptoms.
+            neighbours (int): Number of nearest examples to vote.
+
+        Returns:
+            list[list[tuple[str, float]]]: For each description, specialists
+                with their confidence in [0, 1], most confident first.
+        """
+        if not symptoms or not len(self.vectors):
+            return [[] for _ in symptoms]
+        queries = l2_normalise(
+            count_matrix(symptoms, feature_ids, NUM_FEATURES) * self.idf
+        )
+        similarity = queries @ self.vectors.T
+
+        k = min(neighbours, len(self.vectors))
+        nearest = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        predictions = []
+        for row, idx in enumerate(nearest):
+            weights = similarity[row, idx]
+            if weights.max() <= 0:
+                predictions.append([])
+                continue
+            votes = weights @ self.labels[idx] / weights.sum()
+            confidence = votes * weights.max()
+            order = np.argsort(-confidence)
+            predictions.append(
+                [
+                    (str(self.specialists[i]), float(confidence[i]))
+                    for i in order
+                    # keep specialists with at least half the top vote
+                    if confidence[i] > 0 and votes[i] >= votes[order[0]] / 2
+                ]
+            )
+        return predictions
+
+
+def load_training_examples() -> list[tuple[str, list[str]]]:
+    """Returns the curated examples plus every medical prompt answered by
+    the LLM and kept in `LLM_CACHE`, as `(symptoms, specialists)` pairs."""
+    examples = list(CURATED_TRIAGE.items())
+    for prompt, completion in LLM_CACHE.iter_completions(MEDICAL_PROMPT):
+        specialists = parse_specialists(completion)
+        if specialists:
+            examples.append((prompt[len(MEDICAL_PROMPT) :], specialists))
+    return examples
+
+
+def train_triage_model(examples: list[tuple[str, list[str]]]) -> TriageModel:
+    """Trains the triage model on `(symptoms, specialists)` examples."""
+    specialists = sorted({s.strip() for _, names in examples for s in names})
+    columns = {name: i for i, name in enumerate(specialists)}
+    labels = np.zeros((len(examples), len(specialists)), dtype=bool)
+    for row, (_, names) in enumerate(examples):
+        labels[row, [columns[s.strip()] for s in names]] = True
+
+    counts = count_matrix(
+        [symptoms for symptoms, _ in examples], feature_ids, NUM_FEATURES
+    )
+    doc_freq = np.count_nonzero(counts, axis=0)
+    idf = np.log((1 + len(examples)) / (1 + doc_freq)) + 1
+
+    return TriageModel(
+        vectors=l2_normalise(counts * idf).astype(np.float32),
+        idf=idf.astype(np.float32),
+        labels=labels,
+        specialists=np.array(specialists, dtype=str),
+    )
+
+
+def save_triage_model(model: TriageModel, path: str = MODEL_PATH):
+    """Saves the model's arrays to a `.npz` file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez_compressed(
+        path,
+        vectors=model.vectors,
+        idf=model.idf,
+        labels=model.labels,
+        specialists=model.specialists,
+    )
+
+
+def load_triage_model(path: str = MODEL_PATH) -> TriageModel:
+    """Loads a model saved with `save_triage_model`."""
+    with np.load(path) as arrays:
+        return TriageModel(**{k: arrays[k] for k in arrays.files})
+
+
+def triage(
+    model: TriageModel, symptoms: str, min_confidence: float = MIN_CONFIDENCE
+) -> list[str] | None:
+    """Suggests specialists for symptoms if the model is confident enough.
+
+    Args:
+        model (TriageModel): The trained model.
+        symptoms (str): Description of symptoms.
+        min_confidence (float): Confidence of the top specialist needed.
+
+    Returns:
+        list[str] | None: Suggested specialists, or None if the LLM should
+            be asked instead.
+    """
+    prediction = model.predict([symptoms])[0]
+    log_payload(logger, f"Triage of {symptoms}", prediction)
+    if not prediction or prediction[0][1] < min_confidence:
+        return None
+    return [specialist for specialist, _ in prediction]
+
+
+if __name__ == "__main__":
+    configure_logging()
+    examples = load_training_examples()
+    logger.info(f"Training triage model on {len(examples)} examples")
+    save_triage_model(train_triage_model(examples))
+    logger.info(f"Saved triage model to {MODEL_PATH}")
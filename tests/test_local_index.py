@@ -0,0 +1,11 @@
+from src.benchmark.latency import synthetic_documents
+from src.local_search.local_index import build_local_index
+from src.render import hit_markdown
+
+
+def test_stores_enriched_sources():
+    docs = synthetic_documents(3)
+    local_index = build_local_index(docs)
+    for doc_id, doc in enumerate(docs):
+        source = local_index.get_source(doc_id)
+        assert source["display_markdown"] == hit_markdown(doc)
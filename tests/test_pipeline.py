@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+pytest.importorskip("prefect")
+
+from src import pipeline  # noqa: E402
+from src.benchmark.latency import synthetic_documents  # noqa: E402
+
+DETAILS = synthetic_documents(2)
+
+
+class FakeIndices:
+    def __init__(self):
+        self.created = 0
+
+    def exists(self, index):
+        return self.created > 0
+
+    def create(self, index, **settings):
+        self.created += 1
+
+    def delete(self, index):
+        pass
+
+    def refresh(self, index):
+        pass
+
+
+class FakeCat:
+    def count(self, index, format):
+        return [{"count": str(len(DETAILS))}]
+
+
+class FakeElasticsearch:
+    def __init__(self):
+        self.indices = FakeIndices()
+        self.cat = FakeCat()
+
+
+@pytest.fixture
+def indexed(tmp_path, monkeypatch):
+    """Runs the Elasticsearch stage against a fake client, returning the
+    bulk actions sent by each run."""
+    client = FakeElasticsearch()
+    sent = []
+
+    def parallel_bulk(es_client, actions, **kwargs):
+        sent.append(list(actions))
+        return [(True, {}) for _ in sent[-1]]
+
+    monkeypatch.setattr(pipeline, "create_client", lambda: client)
+    monkeypatch.setattr(pipeline, "get_index_name", lambda: "doctors")
+    monkeypatch.setattr(pipeline.helpers, "parallel_bulk", parallel_bulk)
+    monkeypatch.setitem(pipeline.config_dict["search"], "backend", "local")
+
+    detail_path = tmp_path / "detail.json"
+    detail_path.write_text(json.dumps(DETAILS))
+    detail = pipeline.StageResult(
+        stage="scrape_detail",
+        input_hash="",
+        output_path=str(detail_path),
+        output_hash="details",
+        records=len(DETAILS),
+    )
+    manifest = pipeline.Manifest(str(tmp_path / "manifest.json"))
+
+    def run():
+        runs = len(sent)
+        pipeline.index_elasticsearch.fn(manifest, detail)
+        return sent[-1] if len(sent) > runs else None
+
+    run.client = client
+    return run
+
+
+def test_code_change_reindexes_unchanged_details(indexed, monkeypatch):
+    assert len(indexed()) == len(DETAILS)
+    assert indexed() is None  # skipped, nothing changed
+
+    # eg. documents are formatted differently, with the same details
+    monkeypatch.setattr(pipeline, "source_hash", lambda *modules: "changed")
+    assert [action["_id"] for action in indexed()] == ["M00000", "M00001"]
+    # only a change of settings recreates the index
+    assert indexed.client.indices.created == 1
@@ -0,0 +1,18 @@
+from src.specialist_descriptions import lookup_description
+from src.specialty_resolver import build_specialty_resolver, normalise
+
+SPECIALTIES = ["Neurology", "Neurosurgery", "Paediatrics", "Urology"]
+DESCRIPTIONS = {normalise(s): f"About {s}" for s in SPECIALTIES}
+
+
+def test_looks_up_only_near_exact_matches():
+    resolver = build_specialty_resolver(SPECIALTIES)
+
+    def lookup(name):
+        return lookup_description(name, DESCRIPTIONS, resolver)
+
+    assert lookup("Urologist") == "About Urology"
+    assert lookup("Pediatrician") == "About Paediatrics"
+    # left to the LLM rather than described as another specialty
+    assert lookup("Surgeon") is None
+    assert lookup("Pediatric surgeon") is None
@@ -0,0 +1,32 @@
+import pytest
+
+from src.specialty_resolver import build_specialty_resolver
+
+SPECIALTIES = [
+    "Geriatric Medicine",
+    "Neurology",
+    "Neurosurgery",
+    "Ophthalmology",
+    "Otorhinolaryngology",
+    "Paediatrics",
+    "Urology",
+]
+
+
+def test_synonyms_match_whole_words():
+    resolver = build_specialty_resolver(SPECIALTIES)
+    [urologist] = resolver.resolve(["Urologist"])
+    assert urologist[0] == ("Urology", pytest.approx(1.0))
+    # "urology" is in "neurology", but isn't one of its words
+    assert urologist[1:] == [] or urologist[1][1] < 0.99
+
+
+def test_resolves_only_close_matches():
+    resolver = build_specialty_resolver(SPECIALTIES + ["Plastic Surgery"])
+    neurologist, pediatrician, surgeon = resolver.resolve(
+        ["Neurologist", "Pediatrician", "Surgeon"]
+    )
+    assert [name for name, _ in neurologist] == ["Neurology"]
+    assert [name for name, _ in pediatrician] == ["Paediatrics"]
+    # too weak to filter on, so callers search the name's text instead
+    assert surgeon == []